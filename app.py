@@ -1,14 +1,93 @@
-from extensions import app, db, login_manager
+import os
 
+from flask import Flask
+from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from extensions import db, load_config, login_manager, migrate
+from db_routing import configure_binds, init_db_routing
 from models import *
+from json_provider import init_json
+from user_cache import init_user_cache, load_cached_user
+from http_client import init_http_client
+from fx_rates import init_fx_rates
+from redenomination import init_redenomination
+from org_import import init_org_import
+from events import init_events
+from notifications import init_notifications
+from search_index import init_search
+from expense_log import init_expense_log
+from fragment_cache import init_fragment_cache
+from assets import init_assets
+from approval_steps import init_approval_steps
+from sla import init_sla
+from archive import init_archive
+from receipts import init_receipts
+from tenancy import configure_tenant_binds, init_tenancy
+from ratelimit import init_rate_limits
+from profiling import init_profiling
+from routes import register_blueprints
+
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_cached_user(int(user_id))
+
+
+def create_app(config=None):
+    """Build the application; `config` overrides values read from the environment"""
+    app = Flask(__name__)
+    load_config(app)
+    if config:
+        app.config.update(config)
+
+    configure_binds(app)
+    configure_tenant_binds(app)
+    db.init_app(app)
+    init_db_routing(app, db)
+    migrate.init_app(app, db)
+    login_manager.init_app(app)
+    CORS(app)
+    if app.config['TRUSTED_PROXY_HOPS']:
+        # Take the client address and scheme from the X-Forwarded-* headers the proxies set
+        hops = app.config['TRUSTED_PROXY_HOPS']
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    init_json(app)
+    init_user_cache(app)
+    init_http_client(app)
+    init_fx_rates(app)
+    init_redenomination(app)
+    init_org_import(app)
+    init_events(app)
+    init_notifications(app)
+    init_search(app)
+    init_expense_log(app)
+    init_fragment_cache(app)
+    init_assets(app)
+    init_approval_steps(app)
+    init_sla(app)
+    init_archive(app)
+    init_receipts(app)
+    init_tenancy(app)
+    init_rate_limits(app)
+    init_profiling(app)
+    register_blueprints(app)
+    return app
+
+
+def __getattr__(name):
+    # `from app import app` (gunicorn app:app, flask --app app, scripts) builds the
+    # default app on first access, so importing create_app alone stays cheap
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-import routes
 
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
         db.create_all()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,157 @@
+"""
+Quorum evaluation for approval steps
+
+The approvals sharing a sequence number form one ``ApprovalStep`` that
+counts approved and rejected decisions. A decision increments one counter
+with an atomic UPDATE and judges the step from its counters alone, so it
+costs the same however many approvers share the step. A step closes as soon
+as its outcome is certain: the rule's percentage of approvers has approved,
+the HYBRID rule's specific approver has approved, or enough have rejected
+that the quorum can no longer be met. Steps without a percentage need
+everyone. Approvals still pending in a closed step are skipped.
+"""
+
+import math
+from datetime import datetime
+
+from sqlalchemy import update
+
+from extensions import db
+from models import Approval, ApprovalRuleType, ApprovalStep, Expense, ExpenseStatus
+
+STEP_WAITING = 'waiting'
+STEP_ACTIVE = 'active'
+STEP_APPROVED = 'approved'
+STEP_REJECTED = 'rejected'
+STEP_SKIPPED = 'skipped'
+
+
+class StepClosedError(Exception):
+    """The step was decided by another approver before this decision was counted"""
+
+
+def required_approvals(total, percentage=None):
+    """Approvals needed out of `total` to meet `percentage`; no percentage means all of them"""
+    if not percentage or percentage >= 100:
+        return total
+    return min(total, max(1, math.ceil(total * percentage / 100)))
+
+
+def step_outcome(required, total, approved, rejected, specific_status=None):
+    """
+    'approved' or 'rejected' once a step's counters settle it, else None.
+    `specific_status` is the HYBRID specific approver's decision ('pending'
+    until they decide), or None when the step has no specific approver.
+    """
+    if approved >= required or specific_status == STEP_APPROVED:
+        return STEP_APPROVED
+    if total - rejected < required and specific_status in (None, STEP_REJECTED):
+        return STEP_REJECTED
+    return None
+
+
+def build_steps(expense_id, approvals, rules=None):
+    """One step per sequence number in `approvals`, the first one active; `rules` maps a sequence to its rule"""
+    rules = rules or {}
+    totals = {}
+    members = {}
+    for approval in approvals:
+        totals[approval.sequence] = totals.get(approval.sequence, 0) + 1
+        members.setdefault(approval.sequence, set()).add(approval.approver_id)
+
+    steps = []
+    for sequence in sorted(totals):
+        rule = rules.get(sequence)
+        percentage = specific_approver_id = None
+        if rule is not None and rule.rule_type in (ApprovalRuleType.PERCENTAGE, ApprovalRuleType.HYBRID):
+            percentage = rule.percentage_required
+        # A specific approver already in the management chain has no approval in this step to decide it with
+        if rule is not None and rule.rule_type == ApprovalRuleType.HYBRID \
+                and rule.specific_approver_id in members[sequence]:
+            specific_approver_id = rule.specific_approver_id
+        steps.append(ApprovalStep(
+            expense_id=expense_id,
+            sequence=sequence,
+            rule_id=rule.id if rule is not None else None,
+            status=STEP_WAITING if steps else STEP_ACTIVE,
+            total=totals[sequence],
+            required=required_approvals(totals[sequence], percentage),
+            approved_count=0,
+            rejected_count=0,
+            specific_approver_id=specific_approver_id,
+            specific_status='pending' if specific_approver_id else None,
+        ))
+    return steps
+
+
+def backfill_steps(expense):
+    """Build steps for an expense submitted before steps existed, replaying its approvals' statuses"""
+    approvals = Approval.query.filter_by(expense_id=expense.id).all()
+    steps = build_steps(expense.id, approvals)
+    reached = True
+    for step in steps:
+        members = [a for a in approvals if a.sequence == step.sequence]
+        step.approved_count = sum(a.status == 'approved' for a in members)
+        step.rejected_count = sum(a.status == 'rejected' for a in members)
+        if not reached:
+            step.status = STEP_WAITING
+            continue
+        outcome = step_outcome(step.required, step.total, step.approved_count, step.rejected_count)
+        step.status = outcome or STEP_ACTIVE
+        if outcome != STEP_APPROVED:
+            reached = False
+        if outcome == STEP_REJECTED:
+            for later in steps[steps.index(step) + 1:]:
+                later.status = STEP_SKIPPED
+            break
+    db.session.add_all(steps)
+    db.session.flush()
+    return steps
+
+
+def step_for(approval):
+    """The approval's step, backfilling the expense's steps if it has none yet"""
+    step = ApprovalStep.query.filter_by(expense_id=approval.expense_id, sequence=approval.sequence).first()
+    if step is None and not ApprovalStep.query.filter_by(expense_id=approval.expense_id).first():
+        steps = backfill_steps(approval.expense)
+        step = next((s for s in steps if s.sequence == approval.sequence), None)
+    return step
+
+
+def record_decision(step, decision, approver_id):
+    """
+    Count one decision on `step` and return the outcome it settles, or None
+    while the step stays open. The increment is a single UPDATE, which also
+    row-locks the step until commit, so concurrent deciders are serialized.
+    """
+    column = ApprovalStep.approved_count if decision == STEP_APPROVED else ApprovalStep.rejected_count
+    values = {column.key: column + 1}
+    if approver_id == step.specific_approver_id:
+        values['specific_status'] = decision
+    db.session.execute(
+        update(ApprovalStep).where(ApprovalStep.id == step.id).values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.refresh(step)
+    if step.status != STEP_ACTIVE:
+        raise StepClosedError(f"Approval step {step.sequence} is already {step.status}")
+    return step_outcome(step.required, step.total, step.approved_count, step.rejected_count, step.specific_status)
+
+
+def close_step(step, outcome):
+    step.status = outcome
+    step.closed_at = datetime.utcnow()
+
+
+def init_approval_steps(app):
+    @app.cli.command('approval-steps-backfill')
+    def backfill_command():
+        """Build approval steps for pending expenses submitted before steps existed"""
+        with app.app_context():
+            expenses = Expense.query.filter(
+                Expense.status == ExpenseStatus.PENDING_APPROVAL, ~Expense.steps.any()
+            ).all()
+            for expense in expenses:
+                backfill_steps(expense)
+            db.session.commit()
+        print(f"Backfilled approval steps for {len(expenses)} expense(s)")
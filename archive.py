@@ -0,0 +1,222 @@
+"""
+Archival of finalized expenses
+
+Approved, rejected and paid expenses last updated more than
+ARCHIVE_AFTER_DAYS ago move, with their approvals, approval steps and
+fingerprints, into archive tables with the same columns. The live tables
+then hold the recent and open items the dashboard, lists and stats read.
+Each batch of ARCHIVE_BATCH_SIZE expenses moves with INSERT ... SELECT and
+DELETE statements in its own short transaction, so a run can stop at any
+point. History views union live and archived rows when a user asks for
+them, and ``restore_expense`` moves an expense back.
+"""
+
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import click
+from sqlalchemy import DateTime, delete, func, insert, literal, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+
+from expense_log import record_transition
+from extensions import db
+from fragment_cache import bump_company_version
+from models import (
+    Approval, ApprovalStep, ArchivedApproval, ArchivedApprovalStep, ArchivedExpense, ArchivedExpenseFingerprint,
+    Expense, ExpenseFingerprint, ExpenseStatus,
+)
+from routes import SimplePagination, visible_expenses_filter
+from tenancy import tenant_scope
+
+FINAL_STATUSES = (ExpenseStatus.APPROVED, ExpenseStatus.REJECTED, ExpenseStatus.PAID)
+
+# (live model, archive model, column holding the expense id), parents first
+ARCHIVED_MODELS = (
+    (Expense, ArchivedExpense, 'id'),
+    (Approval, ArchivedApproval, 'expense_id'),
+    (ApprovalStep, ArchivedApprovalStep, 'expense_id'),
+    (ExpenseFingerprint, ArchivedExpenseFingerprint, 'expense_id'),
+)
+
+
+class RestoreConflictError(Exception):
+    """Live rows already use some of an archived expense's ids, so it can't be moved back"""
+
+
+def _move(source, target, key, expense_ids, archived_at=None):
+    """Copy rows of `source` for the expenses into `target`; archived_at is set going in, dropped coming out"""
+    names = [column.name for column in source.columns if column.name != 'archived_at']
+    columns = [source.c[name] for name in names]
+    if archived_at is not None:
+        names.append('archived_at')
+        columns.append(literal(archived_at, DateTime).label('archived_at'))
+    db.session.execute(insert(target).from_select(names, select(*columns).where(source.c[key].in_(expense_ids))))
+
+
+def _transfer(expense_ids, archiving):
+    now = datetime.utcnow()
+    pairs = [(live.__table__, archived.__table__, key) for live, archived, key in ARCHIVED_MODELS]
+    for live, archived, key in pairs:
+        if archiving:
+            _move(live, archived, key, expense_ids, archived_at=now)
+        else:
+            _move(archived, live, key, expense_ids)
+    for live, archived, key in reversed(pairs):
+        source = live if archiving else archived
+        db.session.execute(delete(source).where(source.c[key].in_(expense_ids)))
+
+
+def _keeps_newest_rows(live):
+    """
+    SQLite hands out max(id) + 1, so expenses owning the newest row of any
+    archived table stay live, keeping those ids from being handed out again
+    """
+    conditions = [live.c.id < select(func.max(live.c.id)).scalar_subquery()]
+    for model, _, key in ARCHIVED_MODELS[1:]:
+        table = model.__table__
+        newest = select(func.max(table.c.id)).scalar_subquery()
+        conditions.append(live.c.id.not_in(select(table.c[key]).where(table.c.id == newest)))
+    return conditions
+
+
+def archivable_ids(cutoff, limit, company_id=None):
+    """Oldest-first ids of finalized expenses last updated before `cutoff`"""
+    live = Expense.__table__
+    query = select(live.c.id, live.c.company_id).where(
+        live.c.status.in_(FINAL_STATUSES),
+        live.c.updated_at < cutoff,
+        # Expenses still pointed at by a live duplicate stay until that one is archived
+        live.c.id.not_in(select(live.c.duplicate_of_id).where(live.c.duplicate_of_id.isnot(None))),
+        *_keeps_newest_rows(live),
+    )
+    if company_id is not None:
+        query = query.where(live.c.company_id == company_id)
+    return db.session.execute(query.order_by(live.c.id).limit(limit)).all()
+
+
+def archive_batch(cutoff, batch_size=500, company_id=None):
+    """Archive one batch of expenses and commit; returns how many were moved"""
+    rows = archivable_ids(cutoff, batch_size, company_id)
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    expense_ids = [expense_id for expense_id, _ in rows]
+    _transfer(expense_ids, archiving=True)
+    for expense_id, row_company_id in rows:
+        record_transition(db.session, SimpleNamespace(id=expense_id, company_id=row_company_id),
+                          'expense.archived', None, 'archived')
+    db.session.commit()
+    for row_company_id in {row_company_id for _, row_company_id in rows}:
+        bump_company_version(row_company_id)
+    return len(rows)
+
+
+def archive_expenses(older_than_days, batch_size=500, company_id=None, pause=0.0, max_batches=None):
+    """Archive every eligible expense, batch by batch; returns the total moved"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = archive_batch(cutoff, batch_size, company_id)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        if pause:
+            # Let other writers in between batches
+            time.sleep(pause)
+    return total
+
+
+def restore_expense(expense_id, actor_id=None):
+    """
+    Move an archived expense and its rows back to the live tables, counting
+    the restore as an update so it isn't archived again before
+    ARCHIVE_AFTER_DAYS pass. Returns the live Expense, or None. Raises
+    RestoreConflictError if any of its ids are taken.
+    """
+    archived = db.session.get(ArchivedExpense, expense_id)
+    if archived is None:
+        return None
+    company_id = archived.company_id
+    db.session.expunge(archived)
+
+    try:
+        _transfer([expense_id], archiving=False)
+        # A fresh updated_at keeps the next archive run from moving it straight back
+        db.session.execute(update(Expense.__table__).where(Expense.__table__.c.id == expense_id)
+                           .values(updated_at=datetime.utcnow()))
+        record_transition(db.session, SimpleNamespace(id=expense_id, company_id=company_id),
+                          'expense.restored', 'archived', None, actor_id=actor_id)
+        db.session.commit()
+    except IntegrityError as e:
+        # Ids freed by deleting the newest rows of a table can be reused by new live rows
+        db.session.rollback()
+        raise RestoreConflictError(f"Expense {expense_id} can't be restored: its ids are in use again") from e
+    bump_company_version(company_id)
+    return db.session.get(Expense, expense_id)
+
+
+def find_expense(expense_id):
+    """The live expense, else the archived one, else None"""
+    return db.session.get(Expense, expense_id) or db.session.get(ArchivedExpense, expense_id)
+
+
+def expense_history_page(user, page, per_page):
+    """One page of the expenses a user can see, live and archived together, newest first"""
+    history = union_all(
+        select(Expense.id, Expense.created_at, literal(False).label('archived'))
+        .where(visible_expenses_filter(user)),
+        select(ArchivedExpense.id, ArchivedExpense.created_at, literal(True).label('archived'))
+        .where(visible_expenses_filter(user, ArchivedExpense)),
+    ).subquery()
+    total = db.session.scalar(select(func.count()).select_from(history))
+    rows = db.session.execute(
+        select(history.c.id, history.c.archived)
+        .order_by(history.c.created_at.desc(), history.c.id.desc())
+        .limit(per_page).offset((page - 1) * per_page)
+    ).all()
+
+    loaded = {}
+    for model, archived in ((Expense, False), (ArchivedExpense, True)):
+        ids = [expense_id for expense_id, is_archived in rows if bool(is_archived) == archived]
+        if ids:
+            for expense in model.query.filter(model.id.in_(ids)).options(
+                db.joinedload(model.employee), db.joinedload(model.category)
+            ):
+                loaded[(archived, expense.id)] = expense
+    items = [loaded[(bool(is_archived), expense_id)] for expense_id, is_archived in rows]
+    return SimplePagination(items, page, per_page, total)
+
+
+def init_archive(app):
+    @app.cli.command('expenses-archive')
+    @click.option('--older-than-days', type=int, default=None,
+                  help='Archive finalized expenses last updated this long ago (default ARCHIVE_AFTER_DAYS)')
+    @click.option('--batch-size', type=int, default=None)
+    @click.option('--company-id', type=int, default=None)
+    @click.option('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+    def archive_command(older_than_days, batch_size, company_id, pause):
+        """Move old approved, rejected and paid expenses into the archive tables"""
+        with app.app_context(), tenant_scope(company_id) if company_id is not None else nullcontext():
+            moved = archive_expenses(
+                older_than_days if older_than_days is not None else app.config.get('ARCHIVE_AFTER_DAYS', 365),
+                batch_size or app.config.get('ARCHIVE_BATCH_SIZE', 500),
+                company_id=company_id, pause=pause,
+            )
+        print(f"Archived {moved} expense(s)")
+
+    @app.cli.command('expenses-restore')
+    @click.argument('expense_ids', nargs=-1, type=int, required=True)
+    def restore_command(expense_ids):
+        """Move archived expenses back to the live tables"""
+        with app.app_context():
+            for expense_id in expense_ids:
+                try:
+                    found = restore_expense(expense_id) is not None
+                except RestoreConflictError as e:
+                    print(e)
+                    continue
+                print(f"Expense {expense_id}: {'restored' if found else 'not in the archive'}")
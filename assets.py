@@ -0,0 +1,313 @@
+"""
+Static asset pipeline
+
+``build_assets`` minifies every CSS and JS file under ``static/``, writes it
+under a content-hashed name (``css/style.3f2a9c1e04b7.css``) with
+pre-compressed ``.gz`` and, when the ``brotli`` package is installed,
+``.br`` siblings, and records the mapping in ``manifest.json``. Templates
+keep calling ``url_for('static', filename=...)``; the override installed by
+``init_assets`` points those URLs at the hashed file. Hashed files never
+change, so ``/assets/`` serves them with a one-year immutable
+Cache-Control and picks the best pre-built encoding from Accept-Encoding;
+nothing is compressed per request.
+
+Assets are rebuilt at startup when a source is newer than the manifest, or
+ahead of time with ``flask assets-build``.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import tempfile
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+MINIFIERS = {}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Characters after which a '/' starts a regex literal rather than a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {'return', 'typeof', 'case', 'in', 'of', 'new', 'delete', 'void', 'throw', 'instanceof'}
+# Whitespace next to these can go without joining two tokens into one
+JS_TIGHT = set('{}();,:=[]<>!?&|.+-*/%^~')
+
+
+def _minifier(extension):
+    def register(func):
+        MINIFIERS[extension] = func
+        return func
+    return register
+
+
+CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+@_minifier('.css')
+def minify_css(source):
+    """Drop comments and redundant whitespace; strings are left untouched"""
+    parts = []
+    code = []
+    position = 0
+    for match in CSS_TOKENS.finditer(source):
+        code.append(source[position:match.start()])
+        if match.group(1):
+            parts.append(_squeeze_css(''.join(code)))
+            parts.append(match.group(1))
+            code = []
+        else:
+            code.append(' ')
+        position = match.end()
+    code.append(source[position:])
+    parts.append(_squeeze_css(''.join(code)))
+    return ''.join(parts).strip()
+
+
+def _squeeze_css(text):
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r' ?([{};,>]) ?', r'\1', text)
+    # Spaces after ':' can go; spaces before it can't ('a :hover' differs from 'a:hover')
+    return text.replace(': ', ':').replace(';}', '}')
+
+
+def _is_word(char):
+    return char.isalnum() or char in '_$'
+
+
+@_minifier('.js')
+def minify_js(source):
+    """
+    Strip comments and collapse whitespace outside string, template and
+    regex literals. Line breaks are kept wherever dropping one could change
+    automatic semicolon insertion, so the output behaves like the input.
+    """
+    out = []
+    templates = []  # brace depth at which each open ${...} returns to its template literal
+    depth = 0
+    i, n = 0, len(source)
+    space = ''
+    in_template = False
+    last = ''  # last significant character written in code
+    last_word = ''
+
+    def emit_space(next_char):
+        if not space or not out:
+            return
+        if space == '\n':
+            if last in '{;,([' or next_char in '}),];':
+                return
+            out.append('\n')
+        elif not (last in JS_TIGHT or next_char in JS_TIGHT) or last + next_char in ('++', '+-', '-+', '--', '//', '/*'):
+            out.append(' ')
+
+    while i < n:
+        c = source[i]
+
+        if in_template:
+            if c == '\\':
+                out.append(source[i:i + 2])
+                i += 2
+            elif c == '`':
+                out.append(c)
+                in_template = False
+                last, i = c, i + 1
+            elif source.startswith('${', i):
+                out.append('${')
+                templates.append(depth)
+                depth += 1
+                in_template = False
+                last, i = '{', i + 2
+            else:
+                out.append(c)
+                i += 1
+            continue
+
+        if c in ' \t\r\n':
+            j = i
+            while j < n and source[j] in ' \t\r\n':
+                j += 1
+            if '\n' in source[i:j]:
+                space = '\n'
+            elif not space:
+                space = ' '
+            i = j
+            continue
+        if source.startswith('//', i):
+            j = source.find('\n', i)
+            i = n if j == -1 else j
+            continue
+        if source.startswith('/*', i):
+            j = source.find('*/', i + 2)
+            j = n if j == -1 else j + 2
+            if '\n' in source[i:j]:
+                space = '\n'
+            elif not space:
+                space = ' '
+            i = j
+            continue
+
+        emit_space(c)
+        space = ''
+
+        if c in '"\'':
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == '\\' else 1
+            out.append(source[i:j + 1])
+            last, last_word, i = c, '', j + 1
+        elif c == '`':
+            out.append(c)
+            in_template = True
+            i += 1
+        elif c == '/' and (not last or last in REGEX_PRECEDERS or last_word in REGEX_KEYWORDS):
+            j = i + 1
+            in_class = False
+            while j < n and (source[j] != '/' or in_class):
+                if source[j] == '\\':
+                    j += 1
+                elif source[j] == '[':
+                    in_class = True
+                elif source[j] == ']':
+                    in_class = False
+                j += 1
+            j += 1
+            while j < n and source[j].isalpha():
+                j += 1
+            out.append(source[i:j])
+            last, last_word, i = '/', '', j
+        elif _is_word(c):
+            j = i
+            while j < n and _is_word(source[j]):
+                j += 1
+            last_word = source[i:j]
+            out.append(last_word)
+            last, i = source[j - 1], j
+        else:
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+                if templates and templates[-1] == depth:
+                    templates.pop()
+                    out.append(c)
+                    in_template = True
+                    i += 1
+                    continue
+            out.append(c)
+            last, last_word, i = c, '', i + 1
+
+    return ''.join(out).strip()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def hashed_name(path, digest):
+    root, extension = os.path.splitext(path)
+    return f'{root}.{digest}{extension}'
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def source_files(static_folder):
+    """Relative paths (with forward slashes) of the assets the pipeline handles"""
+    for root, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in MINIFIERS:
+                yield os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+
+
+def build_assets(static_folder, output_folder):
+    """Minify, hash and pre-compress every asset; returns the manifest"""
+    manifest = {}
+    for relative in source_files(static_folder):
+        with open(os.path.join(static_folder, relative), encoding='utf-8') as f:
+            minified = MINIFIERS[os.path.splitext(relative)[1]](f.read()).encode('utf-8')
+        target = hashed_name(relative, content_hash(minified))
+        path = os.path.join(output_folder, target)
+        _write_atomic(path, minified)
+        _write_atomic(path + '.gz', gzip.compress(minified, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write_atomic(path + '.br', brotli.compress(minified, quality=11))
+        manifest[relative] = target
+    _write_atomic(os.path.join(output_folder, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(static_folder, output_folder, rebuild_if_stale=True):
+    """The current manifest, rebuilding first if any source changed since it was written"""
+    manifest_path = os.path.join(output_folder, MANIFEST)
+    if rebuild_if_stale:
+        built_at = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else 0
+        if any(os.path.getmtime(os.path.join(static_folder, relative)) > built_at
+               for relative in source_files(static_folder)):
+            return build_assets(static_folder, output_folder)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def pick_encoding(accept_encodings, available):
+    """Best pre-built encoding the client accepts: brotli, then gzip, else identity"""
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if suffix in available and accept_encodings[encoding]:
+            return encoding, suffix
+    return None, ''
+
+
+def init_assets(app):
+    output_folder = app.config['ASSETS_BUILD_DIR']
+    if not app.config.get('ASSETS_ENABLED', True):
+        return
+
+    manifest = load_manifest(app.static_folder, output_folder,
+                             rebuild_if_stale=app.config.get('ASSETS_BUILD_ON_STARTUP', True))
+    hashed = set(manifest.values())
+    app.extensions['assets'] = {'manifest': manifest, 'folder': output_folder}
+
+    def serve_asset(filename):
+        if filename not in hashed:
+            abort(404)
+        available = {suffix for suffix in ('.br', '.gz') if os.path.exists(os.path.join(output_folder, filename + suffix))}
+        encoding, suffix = pick_encoding(request.accept_encodings, available)
+        response = send_from_directory(output_folder, filename + suffix,
+                                       mimetype=mimetypes.guess_type(filename)[0], max_age=31536000)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+
+    def asset_url_for(endpoint, **values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            return url_for('assets', filename=manifest[values.pop('filename')], **values)
+        return url_for(endpoint, **values)
+
+    app.jinja_env.globals['url_for'] = asset_url_for
+
+    @app.cli.command('assets-build')
+    def build_command():
+        """Minify, fingerprint and pre-compress static assets"""
+        built = build_assets(app.static_folder, output_folder)
+        for source, target in sorted(built.items()):
+            print(f"{source} -> {target}")
+        if brotli is None:
+            print("brotli is not installed; only gzip variants were written")
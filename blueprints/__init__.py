@@ -0,0 +1,6 @@
+"""
+View blueprints, registered by ``routes.register_blueprints``
+
+Endpoints are namespaced by blueprint (``url_for('expenses.new_expense')``);
+URLs are unchanged.
+"""
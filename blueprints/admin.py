@@ -0,0 +1,303 @@
+"""
+Company settings, user management and admin-only API views
+"""
+
+import os
+
+from flask import (
+    Blueprint, abort, current_app, flash, jsonify, redirect, render_template, request, send_from_directory, url_for,
+)
+from flask_login import current_user, login_required
+from werkzeug.security import generate_password_hash
+
+from db_routing import read_only
+from expense_log import event_to_dict, read_events
+from extensions import db
+from fragment_cache import get_fragment_cache
+from org_import import ImportFormatError, import_org_chart, parse_org_chart
+from profiling import (
+    PROFILE_HEADER, SUFFIXES, aggregate_by_endpoint, is_profile_admin, load_summaries, profile_token,
+)
+from redenomination import job_to_dict, latest_job, launch_job, resume_stale_jobs, retry_job, schedule_redenomination
+from user_cache import invalidate_company_users, invalidate_user
+from models import *
+from routes import get_countries_and_currencies, get_all_subordinates
+
+bp = Blueprint('admin', __name__)
+
+
+@bp.route('/company')
+@login_required
+def company_settings():
+    if current_user.role != UserRole.ADMIN:
+        return redirect(url_for('expenses.dashboard'))
+    
+    company = Company.query.get(current_user.company_id)
+    resume_stale_jobs(company.id)
+    return render_template('company_settings.html', company=company, currency_job=latest_job(company.id))
+
+@bp.route('/api/company/currency-jobs')
+@login_required
+def api_currency_job():
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job = latest_job(current_user.company_id)
+    return jsonify({'job': job_to_dict(job) if job else None})
+
+@bp.route('/company/currency-jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_currency_job(job_id):
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    job = CurrencyConversionJob.query.filter_by(id=job_id, company_id=current_user.company_id).first_or_404()
+    if job.status != 'failed':
+        return jsonify({'error': 'Only failed jobs can be retried'}), 400
+    
+    retry_job(job)
+    db.session.commit()
+    launch_job(job.id)
+    return jsonify({'job': job_to_dict(job)})
+
+@bp.route('/company/edit', methods=['GET', 'POST'])
+@login_required
+def edit_company():
+    if current_user.role != UserRole.ADMIN:
+        return redirect(url_for('expenses.dashboard'))
+    
+    company = Company.query.get(current_user.company_id)
+    
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        # Update company information
+        company.name = data.get('company_name', company.name)
+        company.country = data.get('country', company.country)
+        old_currency = company.currency
+        company.currency = data.get('currency', company.currency)
+        if 'approval_sla_hours' in data:
+            # Blank falls back to the default APPROVAL_SLA_HOURS
+            sla_hours = str(data.get('approval_sla_hours') or '').strip()
+            if sla_hours and not sla_hours.isdigit():
+                if request.is_json:
+                    return jsonify({'error': 'Approval SLA must be a whole number of hours'}), 400
+                flash('Approval SLA must be a whole number of hours')
+                return redirect(url_for('admin.edit_company'))
+            company.approval_sla_hours = int(sla_hours) if sla_hours else None
+        
+        try:
+            job = None
+            if company.currency != old_currency:
+                # Existing converted amounts are in the old currency; recompute them in the background
+                job = schedule_redenomination(company, old_currency)
+            db.session.commit()
+            invalidate_company_users(company.id)
+            if job:
+                launch_job(job.id)
+            if request.is_json:
+                return jsonify({
+                    'message': 'Company settings updated successfully',
+                    'currency_job': job_to_dict(job) if job else None
+                })
+            if job:
+                flash(f'Company settings updated. Converting existing expenses to {company.currency} in the background.')
+                return redirect(url_for('admin.company_settings'))
+            flash('Company settings updated successfully!')
+            return redirect(url_for('admin.company_settings'))
+        except Exception as e:
+            db.session.rollback()
+            if request.is_json:
+                return jsonify({'error': str(e)}), 500
+            flash('Error updating company settings')
+            return redirect(url_for('admin.edit_company'))
+    
+    try:
+        countries = get_countries_and_currencies()
+    except Exception as e:
+        print(f"Error loading countries: {e}")
+        countries = [
+            {'name': 'United States', 'currency': 'USD'},
+            {'name': 'India', 'currency': 'INR'},
+            {'name': 'United Kingdom', 'currency': 'GBP'},
+            {'name': 'Germany', 'currency': 'EUR'},
+            {'name': 'France', 'currency': 'EUR'},
+            {'name': 'Canada', 'currency': 'CAD'},
+            {'name': 'Australia', 'currency': 'AUD'},
+            {'name': 'Japan', 'currency': 'JPY'}
+        ]
+    
+    return render_template('edit_company.html', company=company, countries=countries)
+
+@bp.route('/users')
+@read_only
+@login_required
+def users():
+    if current_user.role != UserRole.ADMIN:
+        return redirect(url_for('expenses.dashboard'))
+    
+    users = User.query.filter_by(company_id=current_user.company_id).all()
+    return render_template('users.html', users=users)
+
+@bp.route('/users/new', methods=['GET', 'POST'])
+@login_required
+def new_user():
+    if current_user.role != UserRole.ADMIN:
+        return redirect(url_for('expenses.dashboard'))
+    
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        email = data.get('email')
+        password = data.get('password')
+        first_name = data.get('first_name')
+        last_name = data.get('last_name')
+        role = UserRole(data.get('role'))
+        manager_id = data.get('manager_id') if data.get('manager_id') else None
+        
+        # Check if user already exists
+        if User.query.filter_by(email=email).first():
+            if request.is_json:
+                return jsonify({'error': 'Email already registered'}), 400
+            flash('Email already registered')
+            return redirect(url_for('admin.new_user'))
+        
+        user = User(
+            email=email,
+            password_hash=generate_password_hash(password),
+            first_name=first_name,
+            last_name=last_name,
+            role=role,
+            company_id=current_user.company_id,
+            manager_id=manager_id
+        )
+        
+        db.session.add(user)
+        db.session.commit()
+        invalidate_user(user.id)
+        
+        if request.is_json:
+            return jsonify({'message': 'User created successfully', 'user_id': user.id})
+        
+        flash('User created successfully!')
+        return redirect(url_for('admin.users'))
+    
+    managers = User.query.filter(
+        User.company_id == current_user.company_id,
+        User.role.in_([UserRole.MANAGER, UserRole.ADMIN])
+    ).all()
+    
+    return render_template('new_user.html', managers=managers)
+
+@bp.route('/users/import', methods=['GET', 'POST'])
+@login_required
+def import_users():
+    if current_user.role != UserRole.ADMIN:
+        if request.method == 'POST':
+            return jsonify({'error': 'Unauthorized'}), 403
+        return redirect(url_for('expenses.dashboard'))
+    
+    if request.method == 'POST':
+        try:
+            if request.is_json:
+                rows = parse_org_chart(request.get_data(as_text=True), 'org_chart.json')
+                data = request.get_json(silent=True)
+                skip_invalid = isinstance(data, dict) and bool(data.get('skip_invalid'))
+            else:
+                file = request.files.get('file')
+                if not file or file.filename == '':
+                    return jsonify({'error': 'No file uploaded'}), 400
+                rows = parse_org_chart(file.read(), file.filename)
+                skip_invalid = request.form.get('skip_invalid') in ('1', 'true', 'on')
+        except ImportFormatError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not rows:
+            return jsonify({'error': 'The org chart has no users'}), 400
+        
+        try:
+            result = import_org_chart(rows, current_user.company_id, skip_invalid=skip_invalid)
+        except Exception as e:
+            print(f"Org chart import failed: {e}")
+            return jsonify({'error': f'Import failed: {str(e)}'}), 500
+        
+        return jsonify(result), 200 if result['created'] or not result['errors'] else 400
+    
+    return render_template('import_users.html')
+
+@bp.route('/api/debug/hierarchy')
+@login_required
+def api_debug_hierarchy():
+    if current_user.role == UserRole.MANAGER:
+        all_subordinates = get_all_subordinates(current_user)
+        return jsonify({
+            'manager': current_user.full_name,
+            'role': current_user.role.value,
+            'direct_subordinates': [{'name': sub.full_name, 'role': sub.role.value} for sub in current_user.subordinates],
+            'all_subordinates': [{'name': sub.full_name, 'role': sub.role.value} for sub in all_subordinates],
+            'total_subordinates': len(all_subordinates)
+        })
+    else:
+        return jsonify({
+            'user': current_user.full_name,
+            'role': current_user.role.value,
+            'message': 'Not a manager'
+        })
+
+@bp.route('/api/fragment-cache/stats')
+@login_required
+def api_fragment_cache_stats():
+    """Hit rate and size of this process's template fragment cache"""
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(get_fragment_cache().stats())
+
+@bp.route('/api/expense-events')
+@read_only
+@login_required
+def api_expense_events():
+    """Company's expense event log after the caller's stored offset, for external consumers"""
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), current_app.config['EXPENSE_EVENTS_BATCH_SIZE'])
+    kinds = [kind for kind in request.args.get('kinds', '').split(',') if kind]
+    events = read_events(after=after, limit=max(limit, 1), company_id=current_user.company_id, kinds=kinds)
+    return jsonify({
+        'events': [event_to_dict(expense_event) for expense_event in events],
+        'next_after': events[-1].id if events else after
+    })
+
+@bp.route('/admin/profiles')
+@login_required
+def profiles():
+    """Per-endpoint aggregates of stored request profiles, and a token for profiling a request (operators)"""
+    if not is_profile_admin(current_user):
+        return redirect(url_for('expenses.dashboard'))
+    
+    summaries = load_summaries(current_app.config['PROFILE_DIR'])
+    return render_template(
+        'profiles.html',
+        endpoints=aggregate_by_endpoint(summaries),
+        profiles=summaries[:50],
+        header=PROFILE_HEADER,
+        token=profile_token(current_app, current_user.id),
+        sample_rate=current_app.config['PROFILE_SAMPLE_RATE'],
+    )
+
+@bp.route('/admin/profiles/<name>')
+@login_required
+def profile_file(name):
+    """Download a profile's speedscope or collapsed-stack file (operators)"""
+    if not is_profile_admin(current_user):
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    directory = os.path.abspath(current_app.config['PROFILE_DIR'])
+    suffix = next((suffix for suffix in SUFFIXES[:2] if name.endswith(suffix)), None)
+    if suffix is None or name.startswith('.') or os.sep in name:
+        abort(404)
+    summary = next((s for s in load_summaries(directory) if s['name'] == name[:-len(suffix)]), None)
+    if summary is None:
+        abort(404)
+    return send_from_directory(directory, name, as_attachment=True)
@@ -0,0 +1,192 @@
+"""
+JSON API used by the front end
+"""
+
+from datetime import datetime
+
+from flask import Blueprint, current_app, jsonify, request, Response
+from flask_login import current_user, login_required
+
+from archive import RestoreConflictError, find_expense, restore_expense
+from db_routing import read_only
+from events import get_broker, stream_events
+from extensions import db
+from fx_rates import ExchangeRateUnavailable, get_exchange_rate, get_rate_for_date
+from json_provider import stream_json_array
+from search_index import InvalidCursor
+from models import *
+from ratelimit import rate_limited
+from receipts import has_derivatives
+from routes import (
+    get_countries_and_currencies,
+    visible_expenses_filter,
+    run_expense_search,
+    get_all_subordinates,
+    is_approval_ready_for_processing,
+    expense_summary,
+    get_management_hierarchy_info,
+)
+
+bp = Blueprint('api', __name__)
+
+
+@bp.route('/api/countries')
+@rate_limited('countries')
+def api_countries():
+    return jsonify(get_countries_and_currencies())
+
+@bp.route('/api/test')
+@login_required
+def api_test():
+    return jsonify({'status': 'ok', 'user': current_user.full_name})
+
+@bp.route('/api/events')
+@login_required
+def api_events():
+    """Server-sent event stream of the current user's approval and expense updates"""
+    config = current_app.config
+    subscription = get_broker().subscribe(current_user.id, request.headers.get('Last-Event-ID', type=int))
+    return Response(
+        stream_events(subscription, config['EVENTS_KEEPALIVE_SECONDS'],
+                      config['EVENTS_MAX_STREAM_SECONDS'], config['EVENTS_RETRY_MS']),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/exchange-rate/<from_currency>/<to_currency>')
+@rate_limited('exchange_rate')
+def api_exchange_rate(from_currency, to_currency):
+    on_date = request.args.get('date')
+    try:
+        if on_date:
+            rate = get_rate_for_date(from_currency, to_currency, datetime.strptime(on_date, '%Y-%m-%d').date())
+        else:
+            rate = get_exchange_rate(from_currency, to_currency)
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    except ExchangeRateUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'rate': float(rate)})
+
+@bp.route('/api/expenses/search')
+@read_only
+@login_required
+def api_search_expenses():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing search query'}), 400
+    
+    try:
+        results = run_expense_search(query, limit=min(request.args.get('limit', 20, type=int), 100))
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    
+    return jsonify({
+        'results': [expense_summary(expense) for expense in results.items],
+        'next_cursor': results.next_cursor
+    })
+
+@bp.route('/api/expenses/export')
+@read_only
+@login_required
+def api_export_expenses():
+    """Every expense the user can see, streamed as one JSON array"""
+    expenses = Expense.query.filter(visible_expenses_filter(current_user)).options(
+        db.joinedload(Expense.employee), db.joinedload(Expense.category)
+    ).order_by(Expense.id).yield_per(500)
+    return stream_json_array(expenses, expense_summary, key='expenses')
+
+@bp.route('/api/expenses/<int:expense_id>')
+@read_only
+@login_required
+def api_expense_details(expense_id):
+    try:
+        expense = find_expense(expense_id)
+        if expense is None:
+            return jsonify({'error': 'Expense not found'}), 404
+        
+        # Check permissions
+        has_permission = False
+        
+        if current_user.role == UserRole.ADMIN:
+            # Admin can see all expenses in their company
+            has_permission = (expense.company_id == current_user.company_id)
+        elif current_user.role == UserRole.MANAGER:
+            # Manager can see their own expenses and ALL subordinates' expenses (including indirect)
+            all_subordinates = get_all_subordinates(current_user)
+            subordinate_ids = [u.id for u in all_subordinates] + [current_user.id]
+            has_permission = (expense.employee_id in subordinate_ids)
+        elif current_user.role == UserRole.EMPLOYEE:
+            # Employee can only see their own expenses
+            has_permission = (expense.employee_id == current_user.id)
+        
+        if not has_permission:
+            print(f"DEBUG: User {current_user.full_name} ({current_user.role.value}) denied access to expense {expense_id} (owner: {expense.employee.full_name})")
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        approvals = sorted(expense.approvals, key=lambda approval: (approval.sequence, approval.id))
+        steps = {step.sequence: step for step in expense.steps}
+        has_receipt_images = bool(expense.receipt_filename) and has_derivatives(expense.receipt_filename)
+    except Exception as e:
+        print(f"Error in api_expense_details: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    try:
+        return jsonify({
+            'id': expense.id,
+            'title': expense.title,
+            'description': expense.description,
+            'amount': expense.amount,
+            'currency': expense.currency,
+            'amount_in_company_currency': expense.amount_in_company_currency or expense.amount,
+            'expense_date': expense.expense_date,
+            'status': expense.status,
+            'employee': expense.employee.full_name,
+            'category': expense.category.name,
+            'receipt_url': f"/uploads/{expense.receipt_filename}" if expense.receipt_filename else None,
+            'receipt_thumbnail_url': f"/uploads/{expense.receipt_filename}/thumb" if has_receipt_images else None,
+            'receipt_display_url': f"/uploads/{expense.receipt_filename}/display" if has_receipt_images else None,
+            'duplicate_of': expense.duplicate_of_id,
+            'archived': expense.archived,
+            'management_hierarchy': get_management_hierarchy_info(expense.employee),
+            'approvals': [{
+                'id': approval.id,
+                'approver': approval.approver.full_name,
+                'approver_role': approval.approver.role,
+                'status': approval.status,
+                'comments': approval.comments,
+                'sequence': approval.sequence,
+                'is_ready': is_approval_ready_for_processing(approval, steps),
+                'approved_at': approval.approved_at
+            } for approval in approvals],
+            'approval_steps': [{
+                'sequence': step.sequence,
+                'status': step.status,
+                'required': step.required,
+                'total': step.total,
+                'approved': step.approved_count,
+                'rejected': step.rejected_count
+            } for step in steps.values()]
+        })
+    except Exception as e:
+        print(f"Error creating JSON response: {e}")
+        return jsonify({'error': 'Failed to serialize expense data'}), 500
+
+@bp.route('/api/expenses/<int:expense_id>/restore', methods=['POST'])
+@login_required
+def api_restore_expense(expense_id):
+    """Move an archived expense back to the live tables (admins, own company)"""
+    if current_user.role != UserRole.ADMIN:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    archived = db.session.get(ArchivedExpense, expense_id)
+    if archived is None or archived.company_id != current_user.company_id:
+        return jsonify({'error': 'Archived expense not found'}), 404
+    
+    try:
+        expense = restore_expense(expense_id, actor_id=current_user.id)
+    except RestoreConflictError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'message': 'Expense restored', 'expense': expense_summary(expense)})
@@ -0,0 +1,69 @@
+"""
+Approval queue and approve/reject views
+"""
+
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+
+from approval_steps import StepClosedError, step_for
+from db_routing import read_only
+from extensions import db
+from fragment_cache import Deferred
+from models import *
+from routes import approval_decision_error, decide_approval, ready_approvals_page
+
+bp = Blueprint('approvals', __name__)
+
+
+@bp.route('/approvals')
+@read_only
+@login_required
+def approvals():
+    if current_user.role == UserRole.EMPLOYEE:
+        return redirect(url_for('expenses.dashboard'))
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = 10
+    
+    return render_template('approvals.html', approvals=Deferred(lambda: ready_approvals_page(page, per_page)), page=page)
+
+@bp.route('/approvals/<int:approval_id>/approve', methods=['POST'])
+@login_required
+def approve_expense(approval_id):
+    return decide(approval_id, 'approved', 'Expense approved successfully')
+
+@bp.route('/approvals/<int:approval_id>/reject', methods=['POST'])
+@login_required
+def reject_expense(approval_id):
+    return decide(approval_id, 'rejected', 'Expense rejected successfully')
+
+def decide(approval_id, decision, message):
+    approval = Approval.query.get_or_404(approval_id)
+    
+    if approval.approver_id != current_user.id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    
+    data = request.get_json() if request.is_json else request.form
+    comments = data.get('comments', '')
+    
+    step = step_for(approval)
+    error = approval_decision_error(approval, step)
+    if error is None:
+        try:
+            decide_approval(approval, step, decision, comments, current_user.id)
+            db.session.commit()
+        except StepClosedError as e:
+            db.session.rollback()
+            error = str(e)
+    
+    if error is not None:
+        if request.is_json:
+            return jsonify({'error': error}), 409
+        flash(error)
+        return redirect(url_for('approvals.approvals'))
+    
+    if request.is_json:
+        return jsonify({'message': message})
+    
+    flash(f'{message}!')
+    return redirect(url_for('approvals.approvals'))
@@ -0,0 +1,210 @@
+"""
+Sign-up, login and profile views
+"""
+
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+from flask_login import current_user, login_required, login_user, logout_user
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from extensions import db
+from user_cache import invalidate_user
+from models import *
+from ratelimit import rate_limited
+from routes import get_countries_and_currencies
+
+bp = Blueprint('auth', __name__)
+
+
+@bp.route('/')
+def index():
+    if current_user.is_authenticated:
+        return redirect(url_for('expenses.dashboard'))
+    return render_template('index.html')
+
+def register_page():
+    try:
+        countries = get_countries_and_currencies()
+    except Exception as e:
+        print(f"Error loading countries: {e}")
+        # Fallback countries list
+        countries = [
+            {'name': 'United States', 'currency': 'USD'},
+            {'name': 'India', 'currency': 'INR'},
+            {'name': 'United Kingdom', 'currency': 'GBP'},
+            {'name': 'Germany', 'currency': 'EUR'},
+            {'name': 'France', 'currency': 'EUR'},
+            {'name': 'Canada', 'currency': 'CAD'},
+            {'name': 'Australia', 'currency': 'AUD'},
+            {'name': 'Japan', 'currency': 'JPY'}
+        ]
+    return render_template('register.html', countries=countries)
+
+@bp.route('/register', methods=['GET', 'POST'])
+@rate_limited('register', methods=('POST',), page=register_page)
+def register():
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        email = data.get('email')
+        password = data.get('password')
+        first_name = data.get('first_name')
+        last_name = data.get('last_name')
+        company_name = data.get('company_name')
+        country = data.get('country')
+        
+        # Check if user already exists
+        if User.query.filter_by(email=email).first():
+            if request.is_json:
+                return jsonify({'error': 'Email already registered'}), 400
+            flash('Email already registered')
+            return redirect(url_for('auth.register'))
+        
+        # Get currency for the selected country
+        try:
+            countries = get_countries_and_currencies()
+            currency = next((c['currency'] for c in countries if c['name'] == country), 'USD')
+        except Exception as e:
+            print(f"Error fetching countries: {e}")
+            # Fallback currency mapping
+            currency_map = {
+                'United States': 'USD',
+                'India': 'INR', 
+                'United Kingdom': 'GBP',
+                'Germany': 'EUR',
+                'France': 'EUR',
+                'Canada': 'CAD',
+                'Australia': 'AUD',
+                'Japan': 'JPY'
+            }
+            currency = currency_map.get(country, 'USD')
+        
+        try:
+            # Create company
+            company = Company(
+                name=company_name,
+                country=country,
+                currency=currency
+            )
+            db.session.add(company)
+            db.session.flush()  # Get the company ID
+            
+            # Create admin user
+            user = User(
+                email=email,
+                password_hash=generate_password_hash(password),
+                first_name=first_name,
+                last_name=last_name,
+                role=UserRole.ADMIN,
+                company_id=company.id
+            )
+            db.session.add(user)
+            
+            # Create default expense categories
+            default_categories = [
+                'Travel', 'Meals', 'Office Supplies', 'Software', 'Training', 'Other'
+            ]
+            for cat_name in default_categories:
+                category = ExpenseCategory(
+                    name=cat_name,
+                    company_id=company.id
+                )
+                db.session.add(category)
+            
+            db.session.commit()
+            
+            login_user(user)
+            
+            if request.is_json:
+                return jsonify({'message': 'Registration successful', 'redirect': url_for('expenses.dashboard')})
+            
+            flash('Registration successful!')
+            return redirect(url_for('expenses.dashboard'))
+            
+        except Exception as e:
+            db.session.rollback()
+            print(f"Registration error: {e}")
+            if request.is_json:
+                return jsonify({'error': f'Registration failed: {str(e)}'}), 500
+            flash(f'Registration failed: {str(e)}')
+            return redirect(url_for('auth.register'))
+    
+    return register_page()
+
+@bp.route('/login', methods=['GET', 'POST'])
+@rate_limited('login', methods=('POST',), page=lambda: render_template('login.html'))
+def login():
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        email = data.get('email')
+        password = data.get('password')
+        
+        user = User.query.filter_by(email=email).first()
+        
+        if user and check_password_hash(user.password_hash, password):
+            login_user(user)
+            if request.is_json:
+                return jsonify({'message': 'Login successful', 'redirect': url_for('expenses.dashboard')})
+            return redirect(url_for('expenses.dashboard'))
+        
+        if request.is_json:
+            return jsonify({'error': 'Invalid credentials'}), 401
+        flash('Invalid credentials')
+    
+    return render_template('login.html')
+
+@bp.route('/logout')
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('auth.index'))
+
+@bp.route('/profile')
+@login_required
+def profile():
+    return render_template('profile.html', user=current_user)
+
+@bp.route('/profile/edit', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        # current_user is a cached snapshot; changes go through the User row
+        user = User.query.get(current_user.id)
+        
+        # Update user information
+        user.first_name = data.get('first_name', user.first_name)
+        user.last_name = data.get('last_name', user.last_name)
+        
+        # Only allow email change if it's not already taken
+        new_email = data.get('email')
+        if new_email and new_email != user.email:
+            existing_user = User.query.filter_by(email=new_email).first()
+            if existing_user:
+                if request.is_json:
+                    return jsonify({'error': 'Email already in use'}), 400
+                flash('Email already in use')
+                return redirect(url_for('auth.edit_profile'))
+            user.email = new_email
+        
+        # Update password if provided
+        new_password = data.get('password')
+        if new_password:
+            user.password_hash = generate_password_hash(new_password)
+        
+        try:
+            db.session.commit()
+            invalidate_user(user.id)
+            if request.is_json:
+                return jsonify({'message': 'Profile updated successfully'})
+            flash('Profile updated successfully!')
+            return redirect(url_for('auth.profile'))
+        except Exception as e:
+            db.session.rollback()
+            if request.is_json:
+                return jsonify({'error': str(e)}), 500
+            flash('Error updating profile')
+            return redirect(url_for('auth.edit_profile'))
+    
+    return render_template('edit_profile.html', user=current_user)
@@ -0,0 +1,228 @@
+"""
+Dashboard, expense list and expense submission views
+"""
+
+from datetime import datetime
+from decimal import Decimal
+
+from flask import Blueprint, flash, jsonify, redirect, render_template, request, url_for
+from flask_login import current_user, login_required
+
+from archive import expense_history_page
+from db_routing import read_only
+from extensions import db
+from fingerprints import compute_fingerprints, describe_duplicates, find_duplicates, record_fingerprints
+from fragment_cache import Deferred
+from fx_rates import ExchangeRateUnavailable, get_rate_for_date
+from search_index import InvalidCursor
+from models import *
+from routes import (
+    visible_expenses_filter,
+    run_expense_search,
+    create_approval_workflow,
+    get_all_subordinates,
+    ready_approvals,
+    uploaded_receipt_path,
+)
+
+bp = Blueprint('expenses', __name__)
+
+
+@bp.route('/dashboard')
+@read_only
+@login_required
+def dashboard():
+    # Debug: Print hierarchy information
+    if current_user.role == UserRole.MANAGER:
+        all_subordinates = get_all_subordinates(current_user)
+        print(f"DEBUG: Manager {current_user.full_name} has {len(all_subordinates)} total subordinates:")
+        for sub in all_subordinates:
+            print(f"  - {sub.full_name} ({sub.role.value})")
+    
+    # Computed only when the cached fragments that display them miss
+    def recent_expenses():
+        if current_user.role == UserRole.ADMIN:
+            # Admin sees all company expenses
+            expenses = Expense.query.filter_by(company_id=current_user.company_id).order_by(Expense.created_at.desc()).limit(5).all()
+        elif current_user.role == UserRole.MANAGER:
+            # Manager sees their own expenses and ALL subordinates' expenses (including indirect)
+            all_subordinates = get_all_subordinates(current_user)
+            subordinate_ids = [user.id for user in all_subordinates]
+            subordinate_ids.append(current_user.id)  # Include manager's own expenses
+            expenses = Expense.query.filter(Expense.employee_id.in_(subordinate_ids)).order_by(Expense.created_at.desc()).limit(5).all()
+        else:
+            # Employee sees only their own expenses
+            expenses = Expense.query.filter_by(employee_id=current_user.id).order_by(Expense.created_at.desc()).limit(5).all()
+        return expenses
+    
+    def ready_pending_approvals():
+        pending_approvals = []
+        if current_user.role in [UserRole.MANAGER, UserRole.ADMIN]:
+            # Pending approvals for current user whose step is active
+            pending_approvals = sorted(ready_approvals(current_user.id),
+                                       key=lambda x: x.expense.created_at, reverse=True)[:5]
+        return pending_approvals
+    
+    def dashboard_stats():
+        if current_user.role == UserRole.ADMIN:
+            # Admin stats for all company expenses
+            stats = {
+                'total_expenses': Expense.query.filter_by(company_id=current_user.company_id).count(),
+                'pending_expenses': Expense.query.filter_by(
+                    company_id=current_user.company_id,
+                    status=ExpenseStatus.PENDING_APPROVAL
+                ).count(),
+                'approved_expenses': Expense.query.filter_by(
+                    company_id=current_user.company_id,
+                    status=ExpenseStatus.APPROVED
+                ).count(),
+                'pending_approvals': len(pending_approvals)
+            }
+        elif current_user.role == UserRole.MANAGER:
+            # Manager stats for their entire team (including indirect subordinates)
+            all_subordinates = get_all_subordinates(current_user)
+            subordinate_ids = [user.id for user in all_subordinates]
+            subordinate_ids.append(current_user.id)
+            stats = {
+                'total_expenses': Expense.query.filter(Expense.employee_id.in_(subordinate_ids)).count(),
+                'pending_expenses': Expense.query.filter(
+                    Expense.employee_id.in_(subordinate_ids),
+                    Expense.status == ExpenseStatus.PENDING_APPROVAL
+                ).count(),
+                'approved_expenses': Expense.query.filter(
+                    Expense.employee_id.in_(subordinate_ids),
+                    Expense.status == ExpenseStatus.APPROVED
+                ).count(),
+                'pending_approvals': len(pending_approvals)
+            }
+        else:
+            # Employee stats for their own expenses
+            stats = {
+                'total_expenses': Expense.query.filter_by(employee_id=current_user.id).count(),
+                'pending_expenses': Expense.query.filter_by(
+                    employee_id=current_user.id,
+                    status=ExpenseStatus.PENDING_APPROVAL
+                ).count(),
+                'approved_expenses': Expense.query.filter_by(
+                    employee_id=current_user.id,
+                    status=ExpenseStatus.APPROVED
+                ).count(),
+                'pending_approvals': 0  # Employees don't approve expenses
+            }
+        return stats
+    
+    pending_approvals = Deferred(ready_pending_approvals)
+    
+    return render_template('dashboard.html', 
+                         expenses=Deferred(recent_expenses), 
+                         pending_approvals=pending_approvals,
+                         stats=Deferred(dashboard_stats))
+
+@bp.route('/expenses')
+@read_only
+@login_required
+def expenses():
+    page = request.args.get('page', 1, type=int)
+    per_page = 10
+    
+    query = request.args.get('q', '').strip()
+    if query:
+        try:
+            results = run_expense_search(query, limit=per_page)
+        except (InvalidCursor, ValueError) as e:
+            flash(str(e))
+            return redirect(url_for('expenses.expenses'))
+        return render_template('expenses.html', expenses=results, search=results)
+    
+    if request.args.get('history'):
+        # Archived expenses only when asked for; the live table alone is the fast path
+        history = Deferred(lambda: expense_history_page(current_user, page, per_page))
+        return render_template('expenses.html', expenses=history, page=page, history=True)
+    
+    expenses_pagination = Deferred(lambda: Expense.query.filter(visible_expenses_filter(current_user)).order_by(
+        Expense.created_at.desc()
+    ).paginate(page=page, per_page=per_page, error_out=False))
+    
+    return render_template('expenses.html', expenses=expenses_pagination, page=page)
+
+@bp.route('/expenses/new', methods=['GET', 'POST'])
+@login_required
+def new_expense():
+    if request.method == 'POST':
+        data = request.get_json() if request.is_json else request.form
+        
+        title = data.get('title')
+        description = data.get('description')
+        amount = Decimal(str(data.get('amount')))
+        currency = data.get('currency')
+        expense_date = datetime.strptime(data.get('expense_date'), '%Y-%m-%d').date()
+        category_id = int(data.get('category_id'))
+        merchant = (data.get('merchant') or '').strip() or None
+        ocr_text = (data.get('ocr_text') or '').strip() or None
+        
+        # Convert amount to company currency, read fresh: the cached user may predate a currency change
+        company_currency = db.session.query(Company.currency).filter_by(id=current_user.company_id).scalar()
+        try:
+            # Rate in effect on the expense date, not today's
+            exchange_rate = get_rate_for_date(currency, company_currency, expense_date, record=True)
+        except ExchangeRateUnavailable as e:
+            if request.is_json:
+                return jsonify({'error': f'{e}. Please try again later.'}), 503
+            flash(f'{e}. Please try again later.')
+            return redirect(url_for('expenses.new_expense'))
+        amount_in_company_currency = amount * Decimal(str(exchange_rate))
+        
+        receipt_filename = data.get('receipt_filename') or None
+        receipt_path = uploaded_receipt_path(receipt_filename)
+        if receipt_filename and receipt_path is None:
+            if request.is_json:
+                return jsonify({'error': 'Receipt upload not found. Please upload it again.'}), 400
+            flash('Receipt upload not found. Please upload it again.')
+            return redirect(url_for('expenses.new_expense'))
+        
+        # Flag likely duplicates before any approver is asked to look at this
+        fingerprints = compute_fingerprints(receipt_path, amount_in_company_currency, expense_date, merchant)
+        duplicates = find_duplicates(current_user.company_id, fingerprints)
+        allow_duplicate = str(data.get('allow_duplicate', '')).lower() in ('1', 'true', 'yes', 'on')
+        if duplicates and not allow_duplicate:
+            message = 'This looks like an expense that was already submitted.'
+            if request.is_json:
+                return jsonify({'error': message, 'duplicates': describe_duplicates(duplicates)}), 409
+            flash(message)
+            return redirect(url_for('expenses.new_expense'))
+        
+        expense = Expense(
+            title=title,
+            description=description,
+            amount=amount,
+            currency=currency,
+            amount_in_company_currency=amount_in_company_currency,
+            exchange_rate=Decimal(str(exchange_rate)),
+            expense_date=expense_date,
+            employee_id=current_user.id,
+            company_id=current_user.company_id,
+            category_id=category_id,
+            merchant=merchant,
+            ocr_text=ocr_text,
+            receipt_filename=receipt_filename,
+            duplicate_of_id=duplicates[0]['expense_id'] if duplicates else None,
+            status=ExpenseStatus.SUBMITTED
+        )
+        
+        db.session.add(expense)
+        db.session.flush()
+        record_fingerprints(expense, fingerprints)
+        
+        # Create approval workflow
+        create_approval_workflow(expense)
+        
+        db.session.commit()
+        
+        if request.is_json:
+            return jsonify({'message': 'Expense submitted successfully', 'expense_id': expense.id})
+        
+        flash('Expense submitted successfully!')
+        return redirect(url_for('expenses.expenses'))
+    
+    categories = ExpenseCategory.query.filter_by(company_id=current_user.company_id, is_active=True).all()
+    return render_template('new_expense.html', categories=categories)
@@ -0,0 +1,65 @@
+"""
+Receipt OCR endpoint; the OCR stack is only imported on first use
+"""
+
+import os
+import uuid
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import current_user, login_required
+from werkzeug.utils import secure_filename
+
+from fingerprints import compute_fingerprints, describe_duplicates, find_duplicates
+from ratelimit import rate_limited
+from receipts import queue_derivatives
+from routes import allowed_file
+
+bp = Blueprint('ocr', __name__)
+
+
+@bp.route('/api/ocr/process', methods=['POST'])
+@login_required
+@rate_limited('ocr')
+def process_ocr():
+    """Process receipt image using OCR"""
+    if 'receipt' not in request.files:
+        return jsonify({'error': 'No receipt file provided'}), 400
+    
+    file = request.files['receipt']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    if file and allowed_file(file.filename):
+        # Prefix with a random token so concurrent uploads of the same name don't collide
+        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
+        filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+        file.save(filepath)
+        
+        try:
+            # Imported here so workers that never scan a receipt don't load Tesseract and PIL
+            from ocr_utils import get_ocr_instance
+
+            # Process receipt with OCR
+            ocr = get_ocr_instance(force_mock=current_app.config['OCR_FORCE_MOCK'])
+            result = ocr.process_receipt(filepath)
+            
+            if result['success']:
+                # Keep the upload so the expense can reference it, and warn early about resubmitted receipts
+                duplicates = find_duplicates(current_user.company_id, compute_fingerprints(filepath))
+                queue_derivatives(filename)
+                return jsonify(dict(
+                    result['data'],
+                    receipt_filename=filename,
+                    duplicates=describe_duplicates(duplicates)
+                ))
+            else:
+                os.remove(filepath)
+                return jsonify({'error': result['error']}), 400
+                
+        except Exception as e:
+            # Clean up uploaded file on error
+            if os.path.exists(filepath):
+                os.remove(filepath)
+            return jsonify({'error': f'OCR processing failed: {str(e)}'}), 500
+    
+    return jsonify({'error': 'Invalid file type'}), 400
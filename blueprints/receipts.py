@@ -0,0 +1,56 @@
+"""
+Receipt originals and their WebP derivatives, for users who can see the expense
+"""
+
+import os
+
+from flask import Blueprint, abort, current_app, send_file
+from flask_login import current_user, login_required
+
+from db_routing import read_only
+from models import *
+from receipts import DERIVATIVE_SIZES, has_derivatives
+from routes import uploaded_receipt_path, visible_expenses_filter
+
+bp = Blueprint('receipts', __name__)
+
+# Receipt names carry a random token, so a given URL never changes content
+PRIVATE_IMMUTABLE = 'private, max-age=31536000, immutable'
+
+
+def visible_receipt_path(filename):
+    """Path of a receipt attached to an expense (live or archived) the current user may see; 404 otherwise"""
+    path = uploaded_receipt_path(filename)
+    if path is None:
+        abort(404)
+    for model in (Expense, ArchivedExpense):
+        if model.query.filter(model.receipt_filename == filename, visible_expenses_filter(current_user, model)).first():
+            return path
+    abort(404)
+
+
+@bp.route('/uploads/<filename>')
+@read_only
+@login_required
+def receipt_original(filename):
+    response = send_file(os.path.abspath(visible_receipt_path(filename)), conditional=True)
+    response.headers['Cache-Control'] = PRIVATE_IMMUTABLE
+    return response
+
+
+@bp.route('/uploads/<filename>/<kind>')
+@read_only
+@login_required
+def receipt_derivative(filename, kind):
+    original = visible_receipt_path(filename)
+    if kind not in DERIVATIVE_SIZES or not has_derivatives(filename):
+        abort(404)
+    path = current_app.extensions['receipt_workers'].ensure(filename, kind)
+    if path is None:
+        # Not rendered in time, or unrenderable: the original stands in, uncached so the derivative replaces it
+        response = send_file(os.path.abspath(original), conditional=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    response = send_file(os.path.abspath(path), mimetype='image/webp', conditional=True)
+    response.headers['Cache-Control'] = PRIVATE_IMMUTABLE
+    return response
@@ -0,0 +1,406 @@
+"""
+Cache backends shared by the user, fragment and upstream-data caches
+
+``LocalCache`` is an in-process LRU and the default. ``FileSystemCache`` keeps
+entries as files in one directory, so all workers on a host share them.
+``RedisCache`` speaks the Redis protocol to a server shared by every host;
+``loadtest.mock_services.MockRedis`` stands in for one in tests. Pick one
+with CACHE_URL: ``local://``, ``file:///var/cache/expenses`` or
+``redis://[:password@]host:6379/0``.
+
+Every backend has get/set/delete and an atomic counter. ``Namespace`` uses
+the counter for per-company versioning: keys embed the company's version,
+so a bump in any worker makes the company's older entries unreachable in
+all of them, and they expire on their own.
+
+Shared backends store pickled values; point CACHE_URL only at a directory or
+server that nothing but the app can write to.
+"""
+
+import hashlib
+import os
+import pickle
+import socket
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlsplit
+
+
+class LocalCache:
+    """Thread-safe in-process LRU with per-entry TTLs; counters are kept outside the LRU"""
+
+    shared = False
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            return self._counters[key]
+
+    def size(self):
+        with self._lock:
+            return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache:
+    """
+    One file per entry under `directory`, shared by every process on the host.
+    Writes are atomic renames and counters are updated under an exclusive
+    file lock, so concurrent workers never see partial values.
+    """
+
+    shared = True
+    HEADER = struct.Struct('<d')  # expiry as a Unix timestamp, 0 for none
+    PRUNE_EVERY = 256
+
+    def __init__(self, directory, max_entries=10000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._sets = 0
+        os.makedirs(os.path.join(directory, 'counters'), exist_ok=True)
+
+    def _path(self, key, folder=''):
+        return os.path.join(self.directory, folder, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        expires_at, = self.HEADER.unpack_from(data)
+        if expires_at and expires_at < time.time():
+            self._remove(path)
+            return None
+        return pickle.loads(data[self.HEADER.size:])
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        data = self.HEADER.pack(time.time() + ttl if ttl else 0) + pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self._path(key))
+        self._sets += 1
+        if self._sets % self.PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key):
+        self._remove(self._path(key))
+
+    def counter(self, key):
+        try:
+            with open(self._path(key, 'counters'), 'rb') as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def incr(self, key, amount=1):
+        import fcntl
+
+        with open(self._path(key, 'counters'), 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            value = int(f.read() or 0) + amount
+            f.seek(0)
+            f.truncate()
+            f.write(str(value).encode())
+            f.flush()
+        return value
+
+    def _entry_paths(self):
+        with os.scandir(self.directory) as entries:
+            return [entry.path for entry in entries if entry.is_file() and not entry.name.startswith('.')]
+
+    def size(self):
+        return len(self._entry_paths())
+
+    def prune(self):
+        """Drop expired entries, then the oldest ones while over max_entries"""
+        now = time.time()
+        live = []
+        for path in self._entry_paths():
+            try:
+                with open(path, 'rb') as f:
+                    expires_at, = self.HEADER.unpack(f.read(self.HEADER.size))
+                modified = os.path.getmtime(path)
+            except (OSError, struct.error):
+                continue
+            if expires_at and expires_at < now:
+                self._remove(path)
+            else:
+                live.append((modified, path))
+        live.sort()
+        for _, path in live[:max(0, len(live) - self.max_entries)]:
+            self._remove(path)
+
+    def clear(self):
+        for path in self._entry_paths():
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache:
+    """
+    Minimal Redis (RESP) client. Connection failures are logged and treated
+    as misses, so the app keeps working, uncached, while the server is down;
+    after one, commands are skipped for `retry_after` seconds instead of each
+    waiting out the timeout.
+    """
+
+    shared = True
+
+    def __init__(self, host='127.0.0.1', port=6379, db=0, password=None, prefix='expenses:',
+                 timeout=2.0, retry_after=5.0):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._down_until = 0.0
+        self._conn = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        parts = urlsplit(url)
+        return cls(
+            host=parts.hostname or '127.0.0.1',
+            port=parts.port or 6379,
+            db=int(parts.path.strip('/') or 0),
+            password=unquote(parts.password) if parts.password else None,
+            **kwargs,
+        )
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            count = int(rest)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise RedisError(f'Unexpected reply {line!r}')
+
+    def _connect(self):
+        self._conn = socket.create_connection(self.address, timeout=self.timeout)
+        self._reader = self._conn.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _send(self, *args):
+        self._conn.sendall(self._encode(args))
+        return self._read_reply()
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = self._reader = None
+
+    def execute(self, *args):
+        """Run one command, reconnecting once if the connection dropped"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._connect()
+                    return self._send(*args)
+                except OSError:
+                    self._disconnect()
+                    if attempt:
+                        raise
+
+    def _safe(self, default, *args):
+        if time.monotonic() < self._down_until:
+            return default
+        try:
+            return self.execute(*args)
+        except OSError as e:
+            self._down_until = time.monotonic() + self.retry_after
+            print(f"Cache server unreachable, skipping cache for {self.retry_after}s: {e}")
+        except RedisError as e:
+            print(f"Cache command {args[0]} failed: {e}")
+        return default
+
+    def get(self, key):
+        data = self._safe(None, 'GET', self.prefix + key)
+        return None if data is None else pickle.loads(data)
+
+    def get_many(self, keys):
+        if not keys:
+            return []
+        values = self._safe([None] * len(keys), 'MGET', *[self.prefix + key for key in keys])
+        return [None if data is None else pickle.loads(data) for data in values]
+
+    def set(self, key, value, ttl=None):
+        args = ['SET', self.prefix + key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)]
+        if ttl:
+            args += ['PX', max(1, int(ttl * 1000))]
+        self._safe(None, *args)
+
+    def delete(self, key):
+        self._safe(None, 'DEL', self.prefix + key)
+
+    def counter(self, key):
+        """Current counter value, or None if the server can't be reached"""
+        value = self._safe(False, 'GET', self.prefix + key)
+        if value is False:
+            return None
+        return int(value or 0)
+
+    def incr(self, key, amount=1):
+        return self._safe(None, 'INCRBY', self.prefix + key, amount)
+
+    def size(self):
+        return None
+
+    def clear(self):
+        """Delete every key under this client's prefix"""
+        cursor = '0'
+        while True:
+            reply = self._safe(None, 'SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            if reply is None:
+                return
+            cursor, keys = reply[0].decode(), reply[1]
+            if keys:
+                self._safe(None, 'DEL', *keys)
+            if cursor == '0':
+                return
+
+
+class Namespace:
+    """Entries grouped per company under a version counter; bump() retires a company's entries everywhere"""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    def _version_key(self, company_id):
+        return f'{self.name}:version:{company_id}'
+
+    def version(self, company_id):
+        """The company's current version, or None when the backend can't say"""
+        return self.backend.counter(self._version_key(company_id))
+
+    def bump(self, company_id):
+        return self.backend.incr(self._version_key(company_id))
+
+    def key(self, company_id, version, key):
+        return f'{self.name}:{company_id}:{version}:{key}'
+
+    def get(self, company_id, key):
+        version = self.version(company_id)
+        if version is None:
+            return None
+        return self.backend.get(self.key(company_id, version, key))
+
+    def set(self, company_id, key, value, ttl=None):
+        version = self.version(company_id)
+        if version is not None:
+            self.backend.set(self.key(company_id, version, key), value, ttl=ttl)
+
+
+def backend_from_url(url, max_size=10000):
+    """Build the backend named by a CACHE_URL"""
+    scheme = urlsplit(url or '').scheme
+    if scheme in ('', 'local'):
+        return LocalCache(max_size=max_size)
+    if scheme == 'file':
+        return FileSystemCache(unquote(urlsplit(url).path), max_entries=max_size)
+    if scheme == 'redis':
+        return RedisCache.from_url(url)
+    raise ValueError(f"Unsupported CACHE_URL scheme '{scheme}'")
+
+
+def cache_backend(app, max_size=10000):
+    """
+    Backend for one of the app's caches. In-process caches each get their own
+    LRU of `max_size`; a shared backend is created once and used by all of them.
+    """
+    url = app.config.get('CACHE_URL') or 'local://'
+    if urlsplit(url).scheme in ('', 'local'):
+        return LocalCache(max_size=max_size)
+    if 'cache_backend' not in app.extensions:
+        app.extensions['cache_backend'] = backend_from_url(url, max_size=app.config.get('CACHE_MAX_ENTRIES', 50000))
+    return app.extensions['cache_backend']
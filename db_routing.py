@@ -0,0 +1,205 @@
+"""
+Read/write session routing
+
+Writes always go to the primary database. Views marked with ``@read_only``
+read from one of the configured replicas, unless the same browser session
+wrote something within the last ``DB_READ_YOUR_WRITES_SECONDS`` seconds, in
+which case they stay on the primary so users see their own changes.
+Companies with a dedicated database have their tables routed there first
+(see tenancy.py).
+"""
+
+import os
+import random
+import sqlite3
+import time
+from functools import wraps
+
+import click
+
+from flask import current_app, g, has_app_context, has_request_context, request, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import make_url
+
+REPLICA_BIND_PREFIX = 'replica_'
+LAST_WRITE_KEY = '_db_last_write'
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return view(*args, **kwargs)
+
+    wrapper._db_read_only = True
+    return wrapper
+
+
+def _is_sqlite_memory(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def _engine_options(url, pool_size, pre_ping):
+    options = {'pool_pre_ping': pre_ping}
+    # In-memory SQLite uses a StaticPool, which has no size
+    if pool_size is not None and not _is_sqlite_memory(url):
+        options['pool_size'] = pool_size
+    return options
+
+
+def configure_binds(app):
+    """
+    Turn the replica and pool settings into Flask-SQLAlchemy engine config.
+
+    Must run before ``SQLAlchemy(app)`` creates the engines. Each replica URL
+    becomes a ``replica_<n>`` bind with its own pool settings.
+    """
+    config = app.config
+    primary_url = config['SQLALCHEMY_DATABASE_URI']
+
+    engine_options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    for key, value in _engine_options(primary_url, config.get('DB_POOL_SIZE'), config.get('DB_POOL_PRE_PING', True)).items():
+        engine_options.setdefault(key, value)
+
+    binds = config.setdefault('SQLALCHEMY_BINDS', {})
+    for index, url in enumerate(config.get('DB_REPLICA_URLS', [])):
+        options = _engine_options(url, config.get('DB_REPLICA_POOL_SIZE'), config.get('DB_POOL_PRE_PING', True))
+        options['url'] = url
+        binds[f'{REPLICA_BIND_PREFIX}{index}'] = options
+
+
+def replica_bind_keys(app):
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS', {}) if key.startswith(REPLICA_BIND_PREFIX))
+
+
+class RoutingSession(Session):
+    """Session that sends a company's tables to its own database, and reads of read-only requests to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            tenant = _tenant_bind(self, mapper, clause)
+            if tenant is not None:
+                return self._db.engines[tenant]
+        if bind is None and not self._flushing:
+            replica = _request_replica()
+            if replica is not None and not _has_own_bind(mapper):
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _tenant_bind(session, mapper, clause):
+    """Bind of the current company's dedicated database for its tables (see tenancy.py), or None"""
+    if not has_app_context():
+        return None
+    router = current_app.extensions.get('tenancy')
+    if router is None or not router.databases:
+        return None
+    return router.bind_for(session, mapper, clause)
+
+
+def _has_own_bind(mapper):
+    """Models with an explicit bind_key are never rerouted"""
+    if mapper is None:
+        return False
+    return inspect(mapper).local_table.metadata.info.get('bind_key') is not None
+
+
+def _request_replica():
+    if not has_request_context() or g.get('db_wrote'):
+        return None
+    return g.get('db_replica')
+
+
+def _choose_replica():
+    """before_request hook: pick a replica for read-only views"""
+    g.db_replica = None
+    replicas = current_app.extensions.get('db_routing', {}).get('replicas')
+    if not replicas or request.method not in READ_METHODS:
+        return
+
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, '_db_read_only', False):
+        return
+
+    last_write = flask_session.get(LAST_WRITE_KEY)
+    if last_write and time.time() - last_write < current_app.config['DB_READ_YOUR_WRITES_SECONDS']:
+        return
+
+    g.db_replica = random.choice(replicas)
+
+
+def _remember_write(response):
+    """after_request hook: start the read-your-writes window after a write"""
+    if g.get('db_wrote') and current_app.extensions.get('db_routing', {}).get('replicas'):
+        flask_session[LAST_WRITE_KEY] = time.time()
+    return response
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_write(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _mark_bulk_write(orm_execute_state):
+    # Bulk insert/update/delete statements bypass flush
+    if has_request_context() and (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        g.db_wrote = True
+
+
+def _set_sqlite_pragmas(readonly):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        if readonly:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+    return on_connect
+
+
+def init_db_routing(app, db):
+    """Register request hooks and per-bind SQLite pragmas"""
+    replicas = replica_bind_keys(app)
+    app.extensions['db_routing'] = {'replicas': replicas}
+
+    app.before_request(_choose_replica)
+    app.after_request(_remember_write)
+
+    if app.config.get('SQLITE_WAL', True):
+        with app.app_context():
+            for key, engine in db.engines.items():
+                if engine.dialect.name == 'sqlite' and not _is_sqlite_memory(engine.url):
+                    event.listen(engine, 'connect', _set_sqlite_pragmas(readonly=key in replicas))
+
+    @app.cli.command('db-sync-replicas')
+    @click.option('--interval', type=float, default=0, help='Keep syncing every N seconds')
+    def sync_replicas_command(interval):
+        """Copy the primary SQLite database into every SQLite replica"""
+        with app.app_context():
+            primary = db.engines[None].url.database
+            while True:
+                for key in replicas:
+                    replica = db.engines[key].url.database
+                    sync_sqlite_replica(primary, replica)
+                    print(f"Synced {key}: {replica}")
+                if not interval:
+                    break
+                time.sleep(interval)
+
+
+def sync_sqlite_replica(primary_path, replica_path):
+    """Snapshot a SQLite primary into a replica file using the online backup API"""
+    os.makedirs(os.path.dirname(os.path.abspath(replica_path)), exist_ok=True)
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
@@ -0,0 +1,205 @@
+"""
+Per-user event stream
+
+Views queue small events (an approval became active, an expense changed
+status) on the database session with ``queue_event``; they are published only
+after the transaction commits, so nobody is told about changes that were
+rolled back. The broker fans events out to the user's open ``/api/events``
+server-sent-event streams. ``LocalBroker`` works within one process;
+``PubSubBroker`` relays through a pub/sub server so every app process sees
+every event.
+"""
+
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from db_routing import RoutingSession
+
+PENDING_EVENTS_KEY = 'pending_events'
+
+
+class Subscription:
+    """One open stream's queue of events for a user"""
+
+    def __init__(self, broker, user_id, max_size):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=max_size)
+
+    def get(self, timeout=None):
+        """Next event dict, or None if nothing arrived within `timeout` seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """In-process broker with a short per-user replay buffer for reconnecting clients"""
+
+    def __init__(self, replay_size=50, queue_size=100):
+        self.replay_size = replay_size
+        self.queue_size = queue_size
+        self._subscriptions = defaultdict(set)
+        self._recent = defaultdict(lambda: deque(maxlen=self.replay_size))
+        self._ids = itertools.count(int(time.time() * 1000))
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, payload):
+        """Deliver an event to every stream the user has open"""
+        self.deliver(user_id, dict(payload, id=next(self._ids)))
+
+    def deliver(self, user_id, message):
+        with self._lock:
+            self._recent[user_id].append(message)
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.queue.put_nowait(message)
+            except queue.Full:
+                pass  # A stalled client misses events; it refreshes on reconnect
+
+    def subscribe(self, user_id, last_event_id=None):
+        """Open a subscription, first replaying buffered events newer than last_event_id"""
+        subscription = Subscription(self, user_id, self.queue_size)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+            if last_event_id is not None:
+                for message in self._recent.get(user_id, ()):
+                    if message['id'] > last_event_id:
+                        subscription.queue.put_nowait(message)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(subs) for subs in self._subscriptions.values())
+
+
+class PubSubBroker(LocalBroker):
+    """
+    Broker that relays events through a JSON-lines pub/sub server.
+
+    Publishes go to the server; a listener thread receives every message on
+    the channel and delivers it to this process's local subscribers.
+    """
+
+    def __init__(self, url, channel='expense-events', **kwargs):
+        super().__init__(**kwargs)
+        host, _, port = url.replace('pubsub://', '').partition(':')
+        self.address = (host or '127.0.0.1', int(port or 6380))
+        self.channel = channel
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._listener = threading.Thread(target=self._listen, daemon=True, name='event-broker-listener')
+        self._listener.start()
+
+    def publish(self, user_id, payload):
+        line = json.dumps({
+            'op': 'publish', 'channel': self.channel,
+            'data': {'user_id': user_id, 'message': dict(payload, id=next(self._ids))},
+        }) + '\n'
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = socket.create_connection(self.address, timeout=2)
+                    self._publisher.sendall(line.encode())
+                    return
+                except OSError as e:
+                    self._publisher = None
+                    if attempt:
+                        print(f"Error publishing event: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                with socket.create_connection(self.address, timeout=5) as conn:
+                    conn.settimeout(None)
+                    conn.sendall((json.dumps({'op': 'subscribe', 'channel': self.channel}) + '\n').encode())
+                    for line in conn.makefile('r'):
+                        data = json.loads(line)['data']
+                        self.deliver(data['user_id'], data['message'])
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Event broker connection lost: {e}")
+            time.sleep(1)
+
+
+def queue_event(session, user_id, event_type, **data):
+    """Publish an event to a user once the session's transaction commits"""
+    session.info.setdefault(PENDING_EVENTS_KEY, []).append((user_id, dict(data, type=event_type)))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _publish_pending(session):
+    pending = session.info.pop(PENDING_EVENTS_KEY, None)
+    if not pending or not has_app_context():
+        return
+    broker = current_app.extensions.get('event_broker')
+    if broker is None:
+        return
+    for user_id, payload in pending:
+        broker.publish(user_id, payload)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_EVENTS_KEY, None)
+
+
+def get_broker():
+    return current_app.extensions['event_broker']
+
+
+def format_sse(message):
+    """Encode an event dict as a server-sent event"""
+    return f"id: {message['id']}\nevent: {message['type']}\ndata: {json.dumps(message)}\n\n"
+
+
+def stream_events(subscription, keepalive=15, max_duration=300, retry_ms=3000):
+    """
+    Yield SSE frames for a subscription until max_duration.
+
+    Keepalive comments stop proxies from closing an idle stream; ending the
+    stream periodically frees the worker, and the browser reconnects after
+    `retry_ms` with Last-Event-ID so buffered events are replayed.
+    """
+    deadline = time.monotonic() + max_duration
+    try:
+        yield f"retry: {retry_ms}\n\n"
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=min(keepalive, max(0.0, deadline - time.monotonic())))
+            if message is None:
+                yield ': keepalive\n\n'
+            else:
+                yield format_sse(message)
+    finally:
+        subscription.close()
+
+
+def init_events(app):
+    url = app.config.get('EVENT_BROKER_URL')
+    if url:
+        app.extensions['event_broker'] = PubSubBroker(url)
+    else:
+        app.extensions['event_broker'] = LocalBroker()
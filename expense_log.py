@@ -0,0 +1,218 @@
+"""
+Append-only expense event log
+
+Every status transition of an expense or approval is appended to the
+expense_event table in the same transaction as the change itself, so the
+log can't disagree with current state. Views call ``record_transition``;
+events are buffered on the session and written with one multi-row INSERT
+just before commit (and dropped on rollback).
+
+Counters, rollups and exports read the log incrementally with
+``EventConsumer``, which stores each consumer's offset (the last event id
+it processed) in the same commit as whatever the handler wrote. A consumer
+therefore sees each event exactly once and never rescans history.
+"""
+
+import json
+from datetime import datetime, timedelta
+from enum import Enum
+
+import click
+from flask import current_app
+from sqlalchemy import event, insert, update
+
+from db_routing import RoutingSession
+from extensions import db
+from models import EventConsumerOffset, Expense, ExpenseEvent
+
+PENDING_LOG_KEY = 'pending_expense_events'
+
+
+class OffsetConflict(RuntimeError):
+    """Another process advanced the consumer's offset first"""
+
+
+def _status(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+def record_transition(session, expense, kind, from_status, to_status, approval=None, actor_id=None, **data):
+    """Append an event to the session's transaction; no-op if nothing changed"""
+    from_status, to_status = _status(from_status), _status(to_status)
+    if from_status == to_status:
+        return
+    session.info.setdefault(PENDING_LOG_KEY, []).append({
+        'company_id': expense.company_id,
+        'expense_id': expense.id,
+        'approval_id': approval.id if approval is not None else None,
+        'actor_id': actor_id,
+        'kind': kind,
+        'from_status': from_status,
+        'to_status': to_status,
+        'payload': json.dumps(data) if data else None,
+    })
+
+
+@event.listens_for(RoutingSession, 'before_commit')
+def _write_pending(session):
+    pending = session.info.pop(PENDING_LOG_KEY, None)
+    if not pending:
+        return
+    now = datetime.utcnow()
+    for row in pending:
+        row['created_at'] = now
+    session.execute(insert(ExpenseEvent), pending)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_LOG_KEY, None)
+
+
+def read_events(after=0, limit=500, company_id=None, kinds=None, settle_seconds=None):
+    """
+    Events with id > `after`, oldest first.
+
+    Ids are assigned at insert but become visible at commit, so on databases
+    with concurrent writers a lower id can appear after a higher one has been
+    read. Events younger than `settle_seconds` are held back to close that gap.
+    """
+    if settle_seconds is None:
+        settle_seconds = current_app.config.get('EXPENSE_EVENTS_SETTLE_SECONDS', 0)
+    query = ExpenseEvent.query.filter(ExpenseEvent.id > after)
+    if settle_seconds:
+        query = query.filter(ExpenseEvent.created_at <= datetime.utcnow() - timedelta(seconds=settle_seconds))
+    if company_id is not None:
+        query = query.filter(ExpenseEvent.company_id == company_id)
+    if kinds:
+        query = query.filter(ExpenseEvent.kind.in_(kinds))
+    return query.order_by(ExpenseEvent.id).limit(limit).all()
+
+
+def event_to_dict(expense_event):
+    return {
+        'id': expense_event.id,
+        'expense_id': expense_event.expense_id,
+        'approval_id': expense_event.approval_id,
+        'actor_id': expense_event.actor_id,
+        'kind': expense_event.kind,
+        'from_status': expense_event.from_status,
+        'to_status': expense_event.to_status,
+        'data': expense_event.data,
+        'created_at': expense_event.created_at.isoformat(),
+    }
+
+
+class EventConsumer:
+    """
+    A named reader of the event log that remembers how far it got.
+
+    ``poll(handler)`` passes the next batch of events to `handler` and
+    commits the handler's database writes together with the new offset.
+    If the handler raises, both are rolled back and the batch is retried on
+    the next poll.
+    """
+
+    def __init__(self, name, batch_size=None, company_id=None, kinds=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.company_id = company_id
+        self.kinds = kinds
+
+    @property
+    def position(self):
+        offset = db.session.get(EventConsumerOffset, self.name)
+        return offset.position if offset else 0
+
+    def _ensure_offset(self):
+        if db.session.get(EventConsumerOffset, self.name) is None:
+            db.session.add(EventConsumerOffset(consumer=self.name, position=0))
+            db.session.commit()
+
+    def poll(self, handler):
+        """Process one batch; returns the number of events handled"""
+        self._ensure_offset()
+        start = self.position
+        events = read_events(
+            after=start,
+            limit=self.batch_size or current_app.config['EXPENSE_EVENTS_BATCH_SIZE'],
+            company_id=self.company_id,
+            kinds=self.kinds,
+        )
+        if not events:
+            return 0
+
+        try:
+            handler(events)
+            # Conditional update: two workers running the same consumer can't both commit a batch
+            moved = db.session.execute(
+                update(EventConsumerOffset)
+                .where(EventConsumerOffset.consumer == self.name, EventConsumerOffset.position == start)
+                .values(position=events[-1].id, updated_at=datetime.utcnow())
+            ).rowcount
+            if not moved:
+                raise OffsetConflict(f'Offset for consumer {self.name} moved during processing')
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return len(events)
+
+    def drain(self, handler):
+        """Poll until caught up; returns the total number of events handled"""
+        total = 0
+        while True:
+            handled = self.poll(handler)
+            if not handled:
+                return total
+            total += handled
+
+    def reset(self, position=0):
+        """Move the offset, e.g. back to 0 to rebuild a rollup from scratch"""
+        self._ensure_offset()
+        db.session.get(EventConsumerOffset, self.name).position = position
+        db.session.commit()
+
+
+def backfill_snapshots(batch_size=1000):
+    """
+    Log a `snapshot` event for each expense that has no events yet.
+
+    Expenses created before the log existed otherwise never show up for
+    consumers. Returns the number of snapshots written.
+    """
+    logged = db.select(ExpenseEvent.expense_id)
+    total = 0
+    last_id = 0
+    while True:
+        expenses = Expense.query.filter(Expense.id > last_id, Expense.id.not_in(logged)) \
+            .order_by(Expense.id).limit(batch_size).all()
+        if not expenses:
+            return total
+        for expense in expenses:
+            record_transition(db.session, expense, 'snapshot', None, expense.status)
+        db.session.commit()
+        total += len(expenses)
+        last_id = expenses[-1].id
+
+
+def init_expense_log(app):
+    @app.cli.command('expense-events-export')
+    @click.argument('consumer')
+    @click.argument('path', type=click.Path(dir_okay=False))
+    def export_command(consumer, path):
+        """Append events the named consumer hasn't seen yet to a JSON-lines file"""
+        with app.app_context():
+            with open(path, 'a') as f:
+                def write(events):
+                    for expense_event in events:
+                        f.write(json.dumps(event_to_dict(expense_event)) + '\n')
+                    f.flush()
+                total = EventConsumer(consumer).drain(write)
+            print(f"Exported {total} events")
+
+    @app.cli.command('expense-events-backfill')
+    def backfill_command():
+        """Log a snapshot event for expenses created before the event log"""
+        with app.app_context():
+            print(f"Logged {backfill_snapshots()} snapshot events")
@@ -1,25 +1,139 @@
-from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
-from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 
-load_dotenv()
+from db_routing import RoutingSession
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///expense_management.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+load_dotenv()
 
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+migrate = Migrate()
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-CORS(app)
+login_manager.login_view = 'auth.login'
+
+
+def load_config(app):
+    """Read configuration from the environment into `app.config`"""
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///expense_management.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Comma-separated replica URLs; read-only views are served from these
+    app.config['DB_REPLICA_URLS'] = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    app.config['DB_READ_YOUR_WRITES_SECONDS'] = float(os.environ.get('DB_READ_YOUR_WRITES_SECONDS', 5))
+    app.config['DB_POOL_SIZE'] = int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None
+    app.config['DB_REPLICA_POOL_SIZE'] = int(os.environ['DB_REPLICA_POOL_SIZE']) if os.environ.get('DB_REPLICA_POOL_SIZE') else None
+    app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+    app.config['SQLITE_WAL'] = os.environ.get('SQLITE_WAL', 'true').lower() in ('1', 'true', 'yes')
+    app.config['USER_CACHE_TTL'] = float(os.environ.get('USER_CACHE_TTL', 60))
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # External services (overridable so load tests can point at local stand-ins)
+    app.config['COUNTRIES_API_URL'] = os.environ.get('COUNTRIES_API_URL', 'https://restcountries.com/v3.1/all?fields=name,currencies')
+    app.config['EXCHANGE_RATE_API_URL'] = os.environ.get('EXCHANGE_RATE_API_URL', 'https://api.exchangerate-api.com/v4/latest')
+    app.config['HTTP_CONNECT_TIMEOUT'] = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3))
+    app.config['HTTP_DEADLINE'] = float(os.environ.get('HTTP_DEADLINE', 5))
+    app.config['HTTP_POOL_SIZE'] = int(os.environ.get('HTTP_POOL_SIZE', 10))
+    app.config['HTTP_BREAKER_THRESHOLD'] = int(os.environ.get('HTTP_BREAKER_THRESHOLD', 5))
+    app.config['HTTP_BREAKER_RESET'] = float(os.environ.get('HTTP_BREAKER_RESET', 30))
+    app.config['COUNTRIES_FRESH_SECONDS'] = 24 * 3600
+    app.config['COUNTRIES_STALE_SECONDS'] = 7 * 24 * 3600
+    app.config['EXCHANGE_RATE_FRESH_SECONDS'] = float(os.environ.get('EXCHANGE_RATE_FRESH_SECONDS', 15 * 60))
+    app.config['EXCHANGE_RATE_STALE_SECONDS'] = float(os.environ.get('EXCHANGE_RATE_STALE_SECONDS', 24 * 3600))
+    # Historical rates: ECB files quote against EUR; weekends/holidays use the prior business day
+    app.config['FX_BASE_CURRENCY'] = os.environ.get('FX_BASE_CURRENCY', 'EUR')
+    app.config['FX_MAX_LOOKBACK_DAYS'] = int(os.environ.get('FX_MAX_LOOKBACK_DAYS', 7))
+    app.config['FX_LIVE_RATE_DAYS'] = int(os.environ.get('FX_LIVE_RATE_DAYS', 3))
+    # Re-denomination after a currency change: small chunks keep each write transaction short
+    app.config['REDENOMINATION_CHUNK_SIZE'] = int(os.environ.get('REDENOMINATION_CHUNK_SIZE', 500))
+    app.config['REDENOMINATION_CHUNK_PAUSE'] = float(os.environ.get('REDENOMINATION_CHUNK_PAUSE', 0.05))
+    app.config['REDENOMINATION_LEASE_SECONDS'] = int(os.environ.get('REDENOMINATION_LEASE_SECONDS', 60))
+    # Org-chart import hashes passwords in this many processes (unset: one per CPU, 0: inline)
+    app.config['IMPORT_HASH_WORKERS'] = int(os.environ['IMPORT_HASH_WORKERS']) if os.environ.get('IMPORT_HASH_WORKERS') else None
+    # Server-sent events; set EVENT_BROKER_URL (pubsub://host:port) to share events across processes
+    app.config['EVENT_BROKER_URL'] = os.environ.get('EVENT_BROKER_URL')
+    app.config['EVENTS_KEEPALIVE_SECONDS'] = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+    app.config['EVENTS_MAX_STREAM_SECONDS'] = float(os.environ.get('EVENTS_MAX_STREAM_SECONDS', 60))
+    app.config['EVENTS_RETRY_MS'] = int(os.environ.get('EVENTS_RETRY_MS', 3000))
+    # Notification outbox, drained by `flask notifications-dispatch`
+    app.config['SMTP_HOST'] = os.environ.get('SMTP_HOST', 'localhost')
+    app.config['SMTP_PORT'] = int(os.environ.get('SMTP_PORT', 25))
+    app.config['SMTP_USERNAME'] = os.environ.get('SMTP_USERNAME')
+    app.config['SMTP_PASSWORD'] = os.environ.get('SMTP_PASSWORD')
+    app.config['SMTP_USE_TLS'] = os.environ.get('SMTP_USE_TLS', '').lower() in ('1', 'true', 'yes')
+    app.config['MAIL_FROM'] = os.environ.get('MAIL_FROM', 'expenses@localhost')
+    app.config['NOTIFY_DIGEST_SECONDS'] = float(os.environ.get('NOTIFY_DIGEST_SECONDS', 60))
+    app.config['NOTIFY_BATCH_SIZE'] = int(os.environ.get('NOTIFY_BATCH_SIZE', 200))
+    app.config['NOTIFY_MAX_ATTEMPTS'] = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 6))
+    app.config['NOTIFY_RETRY_BASE_SECONDS'] = float(os.environ.get('NOTIFY_RETRY_BASE_SECONDS', 60))
+    app.config['NOTIFY_LEASE_SECONDS'] = int(os.environ.get('NOTIFY_LEASE_SECONDS', 300))
+    # Expense event log consumers; events younger than the settle time are held back so
+    # transactions that commit out of id order are never skipped
+    app.config['EXPENSE_EVENTS_BATCH_SIZE'] = int(os.environ.get('EXPENSE_EVENTS_BATCH_SIZE', 500))
+    app.config['EXPENSE_EVENTS_SETTLE_SECONDS'] = float(os.environ.get('EXPENSE_EVENTS_SETTLE_SECONDS', 1))
+    # Rendered template fragments; entries also expire after the TTL because versions are per process
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+    app.config['FRAGMENT_CACHE_TTL'] = float(os.environ.get('FRAGMENT_CACHE_TTL', 30))
+    # Compiled Jinja templates are kept here across restarts; set to an empty string to disable
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = os.environ.get('JINJA_BYTECODE_CACHE_DIR', os.path.join(app.instance_path, 'jinja_cache'))
+    # Minified, content-hashed static assets with pre-built gzip/brotli variants
+    app.config['ASSETS_ENABLED'] = os.environ.get('ASSETS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    app.config['ASSETS_BUILD_DIR'] = os.environ.get('ASSETS_BUILD_DIR', os.path.join(app.instance_path, 'assets'))
+    app.config['ASSETS_BUILD_ON_STARTUP'] = os.environ.get('ASSETS_BUILD_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+    # JSON bodies at least this large are gzip/brotli-compressed for clients that accept it
+    app.config['JSON_COMPRESS_MIN_SIZE'] = int(os.environ.get('JSON_COMPRESS_MIN_SIZE', 1024))
+    app.config['JSON_COMPRESS_LEVEL'] = int(os.environ.get('JSON_COMPRESS_LEVEL', 6))
+    # Cache backend for user snapshots, fragments and upstream data: local://, file:///path or redis://host:port/db
+    app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'local://')
+    app.config['CACHE_MAX_ENTRIES'] = int(os.environ.get('CACHE_MAX_ENTRIES', 50000))
+    # Hours before a pending approval escalates to the approver's manager (0 disables); companies can override
+    app.config['APPROVAL_SLA_HOURS'] = float(os.environ.get('APPROVAL_SLA_HOURS', 48))
+    # Run the SLA scheduler as a thread in the web process; otherwise run `flask sla-scheduler`
+    app.config['APPROVAL_SLA_SCHEDULER'] = os.environ.get('APPROVAL_SLA_SCHEDULER', '').lower() in ('1', 'true', 'yes')
+    app.config['APPROVAL_SLA_LOOKAHEAD'] = int(os.environ.get('APPROVAL_SLA_LOOKAHEAD', 300))
+    # Finalized expenses last updated this many days ago move to the archive tables, in batches
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+    # Dedicated company databases as name=url pairs; TENANT_DATABASE points a worker process at one of them
+    app.config['TENANT_DATABASE_URLS'] = dict(
+        (part.strip() for part in entry.split('=', 1))
+        for entry in os.environ.get('TENANT_DATABASE_URLS', '').split(',') if '=' in entry
+    )
+    app.config['TENANT_DATABASE'] = os.environ.get('TENANT_DATABASE')
+    # Seconds between reloads of the company -> database map, and rows per batch when moving a company
+    app.config['TENANT_MAP_TTL'] = float(os.environ.get('TENANT_MAP_TTL', 10))
+    app.config['TENANT_MOVE_BATCH_SIZE'] = int(os.environ.get('TENANT_MOVE_BATCH_SIZE', 1000))
+    # Reverse proxies (e.g. Nginx) in front of the app; rate limits see the proxy's address unless this is set
+    app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+    # Token buckets per endpoint as "scope:count/period" lists (scopes: user, ip, company); empty disables one
+    app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    app.config['RATE_LIMIT_STORAGE_URL'] = os.environ.get('RATE_LIMIT_STORAGE_URL', 'local://')
+    app.config['RATE_LIMITS'] = {
+        name: os.environ.get(f'RATE_LIMIT_{name.upper()}', default) for name, default in (
+            ('login', 'ip:20/minute'),
+            ('register', 'ip:10/hour'),
+            ('countries', 'ip:30/minute'),
+            ('exchange_rate', 'user:60/minute'),
+            ('ocr', 'user:10/minute, company:60/minute'),
+        )
+    }
+    # Request profiling: the fraction of requests sampled, how often stacks are recorded, and where profiles go
+    app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+    app.config['PROFILE_MAX_FILES'] = int(os.environ.get('PROFILE_MAX_FILES', 200))
+    app.config['PROFILE_TOKEN_MAX_AGE'] = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+    # Server operators' emails; profiles span every company, so only they see them and mint profiling tokens
+    app.config['PROFILE_ADMIN_EMAILS'] = [
+        email.strip().lower() for email in os.environ.get('PROFILE_ADMIN_EMAILS', '').split(',') if email.strip()
+    ]
+    # Threads rendering receipt thumbnails and display images, and their WebP quality
+    app.config['RECEIPT_DERIVATIVE_WORKERS'] = int(os.environ.get('RECEIPT_DERIVATIVE_WORKERS', 2))
+    app.config['RECEIPT_DERIVATIVE_QUALITY'] = int(os.environ.get('RECEIPT_DERIVATIVE_QUALITY', 80))
+    # Scanned receipts no expense uses are deleted by receipts-purge-orphans once this old
+    app.config['RECEIPT_ORPHAN_TTL_HOURS'] = float(os.environ.get('RECEIPT_ORPHAN_TTL_HOURS', 24))
+    # Max differing bits (of 64) for two receipt photos to count as the same receipt
+    app.config['DUPLICATE_PHASH_DISTANCE'] = int(os.environ.get('DUPLICATE_PHASH_DISTANCE', 6))
+    app.config['OCR_FORCE_MOCK'] = os.environ.get('OCR_FORCE_MOCK', '').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,160 @@
+"""
+Duplicate-submission fingerprints
+
+Each expense stores a few hashed fingerprints in ExpenseFingerprint, indexed
+by (company_id, value), so checking a new submission is a handful of
+indexed equality lookups rather than a scan:
+
+* ``content`` - SHA-256 of the receipt file, for the exact same upload
+* ``fields`` - hash of the company-currency amount (whole units, to absorb
+  rate rounding), expense date and normalized merchant, for the same
+  receipt typed in again or submitted in another currency
+* ``phash`` - a 64-bit difference hash of the receipt image split into
+  8-bit bands; a re-photographed receipt shares at least one band with the
+  original whenever the hashes differ in fewer than 8 bits, and candidates
+  are confirmed by Hamming distance
+"""
+
+import hashlib
+import re
+from decimal import Decimal, ROUND_HALF_UP
+
+from flask import current_app
+
+from extensions import db
+from models import Expense, ExpenseFingerprint
+
+PHASH_BANDS = 8
+BAND_BITS = 64 // PHASH_BANDS
+MERCHANT_SUFFIXES = {'inc', 'llc', 'ltd', 'limited', 'gmbh', 'co', 'corp', 'company', 'plc', 'sa', 'ag', 'pvt'}
+REASONS = {
+    'content': 'same receipt file',
+    'fields': 'same amount, date and merchant',
+    'phash': 'similar receipt photo',
+}
+
+
+def normalize_merchant(merchant):
+    """Lowercase words without punctuation or company-form suffixes"""
+    words = re.findall(r'\w+', (merchant or '').lower())
+    return ' '.join(word for word in words if word not in MERCHANT_SUFFIXES)
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def fields_fingerprint(amount, on_date, merchant):
+    """Hash of (amount to whole units, date, merchant); None without a merchant to anchor it"""
+    merchant = normalize_merchant(merchant)
+    if amount is None or on_date is None or not merchant:
+        return None
+    whole = Decimal(str(amount)).quantize(Decimal('1'), rounding=ROUND_HALF_UP)
+    return _digest(f'{whole}|{on_date.isoformat()}|{merchant}')
+
+
+def content_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def difference_hash(path):
+    """64-bit dHash of an image, or None if the file is not a readable image"""
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(path) as image:
+            pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except (UnidentifiedImageError, OSError):
+        return None
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def phash_bands(value):
+    mask = (1 << BAND_BITS) - 1
+    return [f'{band}:{(value >> (band * BAND_BITS)) & mask:02x}' for band in range(PHASH_BANDS)]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def compute_fingerprints(receipt_path=None, amount=None, expense_date=None, merchant=None):
+    """(kind, value, detail) tuples for whatever inputs are available"""
+    fingerprints = []
+    if receipt_path:
+        fingerprints.append(('content', content_fingerprint(receipt_path), None))
+        image_hash = difference_hash(receipt_path)
+        if image_hash is not None:
+            full = f'{image_hash:016x}'
+            fingerprints.extend(('phash', f'phash:{band}', full) for band in phash_bands(image_hash))
+    fields = fields_fingerprint(amount, expense_date, merchant)
+    if fields:
+        fingerprints.append(('fields', fields, None))
+    return fingerprints
+
+
+def find_duplicates(company_id, fingerprints, exclude_expense_id=None):
+    """
+    Existing expenses in the company matching any fingerprint.
+
+    Returns a list of {'expense_id', 'reasons'} dicts, most recent first.
+    """
+    if not fingerprints:
+        return []
+
+    query = ExpenseFingerprint.query.filter(
+        ExpenseFingerprint.company_id == company_id,
+        ExpenseFingerprint.value.in_({value for _, value, _ in fingerprints})
+    )
+    if exclude_expense_id is not None:
+        query = query.filter(ExpenseFingerprint.expense_id != exclude_expense_id)
+
+    image_hashes = {int(detail, 16) for kind, _, detail in fingerprints if kind == 'phash'}
+    max_distance = current_app.config.get('DUPLICATE_PHASH_DISTANCE', 6)
+
+    matches = {}
+    for row in query:
+        if row.kind == 'phash' and not any(hamming(h, int(row.detail, 16)) <= max_distance for h in image_hashes):
+            continue
+        matches.setdefault(row.expense_id, set()).add(row.kind)
+
+    return [
+        {'expense_id': expense_id, 'reasons': [REASONS[kind] for kind in REASONS if kind in kinds]}
+        for expense_id, kinds in sorted(matches.items(), reverse=True)
+    ]
+
+
+def describe_duplicates(duplicates):
+    """Add title/date/status of each matched expense for display"""
+    if not duplicates:
+        return []
+    expenses = {e.id: e for e in Expense.query.filter(Expense.id.in_([d['expense_id'] for d in duplicates]))}
+    described = []
+    for duplicate in duplicates:
+        expense = expenses.get(duplicate['expense_id'])
+        if expense is None:
+            continue
+        described.append(dict(
+            duplicate,
+            title=expense.title,
+            expense_date=expense.expense_date.isoformat(),
+            status=expense.status.value,
+        ))
+    return described
+
+
+def record_fingerprints(expense, fingerprints):
+    """Add the expense's fingerprint rows to the current transaction"""
+    for kind, value, detail in fingerprints:
+        db.session.add(ExpenseFingerprint(
+            company_id=expense.company_id, expense_id=expense.id, kind=kind, value=value, detail=detail,
+        ))
@@ -0,0 +1,219 @@
+"""
+Template fragment caching
+
+Wrap an expensive part of a template in ``{% cache 'name', vary... %}``
+... ``{% endcache %}`` to keep its rendered HTML in an in-process LRU. Keys
+combine the fragment name, the current user, the ``vary`` values and the
+company's data version. Committing a change to any company-owned row bumps
+that version, so every cached fragment for the company goes stale at once
+and no view has to invalidate anything explicitly. Add ``if condition``
+after the arguments to render uncached when the condition is false.
+
+Views pass expensive values as ``Deferred`` so the queries behind a cached
+fragment only run on a miss. Fragments and versions live in the CACHE_URL
+backend: with a shared one, a commit in any worker invalidates the company's
+fragments in all of them. Entries also expire after FRAGMENT_CACHE_TTL.
+"""
+
+import hashlib
+import os
+import threading
+from collections import defaultdict
+
+from flask import current_app, has_app_context, has_request_context
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+
+from cache_backends import LocalCache, Namespace, cache_backend
+from db_routing import RoutingSession
+from models import Approval, ApprovalRule, Company, Expense, ExpenseCategory, User
+
+DIRTY_COMPANIES_KEY = 'fragment_cache_dirty_companies'
+COMPANY_OWNED = (Expense, User, ExpenseCategory, ApprovalRule)
+
+
+class Deferred:
+    """A view value computed on first use, so a cache hit never runs its queries"""
+
+    def __init__(self, compute):
+        self._compute = compute
+        self._done = False
+        self._result = None
+
+    def _value(self):
+        if not self._done:
+            self._result = self._compute()
+            self._done = True
+        return self._result
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._value(), name)
+
+    def __getitem__(self, key):
+        return self._value()[key]
+
+    def __iter__(self):
+        return iter(self._value())
+
+    def __len__(self):
+        return len(self._value())
+
+    def __bool__(self):
+        return bool(self._value())
+
+
+class FragmentCache:
+    """Rendered fragments in a cache backend, with per-company versions and hit metrics"""
+
+    def __init__(self, max_size=5000, ttl=30, backend=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend if backend is not None else LocalCache(max_size=max_size)
+        self.versions = Namespace(self.backend, 'fragments')
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    @property
+    def evictions(self):
+        return getattr(self.backend, 'evictions', None)
+
+    def version(self, company_id):
+        return self.versions.version(company_id)
+
+    def bump(self, company_id):
+        """Make every cached fragment for the company stale"""
+        self.versions.bump(company_id)
+
+    @staticmethod
+    def _key(key):
+        # Keys hold arbitrary vary values; hash them into a backend-safe string
+        return 'fragment:' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, name, key):
+        html = self.backend.get(self._key(key))
+        with self._lock:
+            self._stats[name]['hits' if html is not None else 'misses'] += 1
+        return html
+
+    def set(self, key, html):
+        self.backend.set(self._key(key), str(html), ttl=self.ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Hit/miss counts and hit rate, overall and per fragment name"""
+        with self._lock:
+            fragments = {name: dict(counts) for name, counts in self._stats.items()}
+        size = self.backend.size()
+        hits = sum(counts['hits'] for counts in fragments.values())
+        misses = sum(counts['misses'] for counts in fragments.values())
+        for counts in fragments.values():
+            total = counts['hits'] + counts['misses']
+            counts['hit_rate'] = round(counts['hits'] / total, 3) if total else None
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+            'evictions': self.evictions,
+            'fragments': fragments,
+        }
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja ``{% cache name[, vary...] [if condition] %}...{% endcache %}`` tag"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression(with_condexpr=False)]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression(with_condexpr=False))
+        enabled = parser.parse_expression() if parser.stream.skip_if('name:if') else nodes.Const(True)
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        call = self.call_method('_render', [enabled, nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, enabled, args, caller):
+        cache = current_app.extensions.get('fragment_cache') if has_app_context() else None
+        if not enabled or cache is None or not has_request_context() or not current_user.is_authenticated:
+            return caller()
+
+        name, vary = args[0], tuple(args[1:])
+        company_id = current_user.company_id
+        version = cache.version(company_id)
+        if version is None:
+            return caller()
+        key = (name, company_id, version, current_user.id) + vary
+        html = cache.get(name, key)
+        if html is None:
+            html = caller()
+            cache.set(key, html)
+        return Markup(html)
+
+
+def _company_of(obj):
+    if isinstance(obj, Company):
+        return obj.id
+    if isinstance(obj, COMPANY_OWNED):
+        return obj.company_id
+    if isinstance(obj, Approval):
+        expense = obj.expense
+        return expense.company_id if expense is not None else None
+    return None
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_dirty_companies(session, flush_context):
+    dirty = session.info.setdefault(DIRTY_COMPANIES_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        company_id = _company_of(obj)
+        if company_id is not None:
+            dirty.add(company_id)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _bump_dirty_companies(session):
+    dirty = session.info.pop(DIRTY_COMPANIES_KEY, None)
+    if dirty and has_app_context():
+        for company_id in dirty:
+            bump_company_version(company_id)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_dirty_companies(session):
+    session.info.pop(DIRTY_COMPANIES_KEY, None)
+
+
+def bump_company_version(company_id):
+    """For writes that bypass the ORM flush (bulk UPDATE/INSERT statements)"""
+    cache = current_app.extensions.get('fragment_cache')
+    if cache is not None:
+        cache.bump(company_id)
+
+
+def get_fragment_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def init_fragment_cache(app):
+    app.extensions['fragment_cache'] = FragmentCache(
+        max_size=app.config.get('FRAGMENT_CACHE_SIZE', 5000),
+        ttl=app.config.get('FRAGMENT_CACHE_TTL', 30),
+        backend=cache_backend(app, max_size=app.config.get('FRAGMENT_CACHE_SIZE', 5000)),
+    )
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+    # Compiled templates survive restarts, so a cold worker skips parsing and compiling
+    bytecode_dir = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
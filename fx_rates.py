@@ -0,0 +1,333 @@
+"""
+Historical exchange rates
+
+Daily rates live in the CurrencyRate table and are bulk-loaded from rate files
+(ECB-style wide CSVs or long from/to/date/rate CSVs) with the
+``flask fx-load-rates`` command. For lookups, each currency pair is held in
+memory as a date-sorted array and searched with bisect, so finding the rate
+for an expense date is O(log n) and falls back to the nearest prior business
+day when the date itself has no rate (weekends, holidays).
+"""
+
+import csv
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import event, insert
+
+from db_routing import RoutingSession
+from extensions import db
+from http_client import UpstreamError, get_outbound_client
+from models import CurrencyRate
+
+# session.info key for rates recorded in the current transaction
+PENDING_RATES_KEY = 'fx_pending_rates'
+
+
+class ExchangeRateUnavailable(Exception):
+    """No trustworthy exchange rate could be obtained"""
+
+
+class RateTable:
+    """Per-pair, date-sorted rate arrays with bisect lookup"""
+
+    def __init__(self, base_currency='EUR', max_lookback_days=7):
+        self.base_currency = base_currency
+        self.max_lookback_days = max_lookback_days
+        self._pairs = {}
+
+    def __len__(self):
+        return sum(len(dates) for dates, _ in self._pairs.values())
+
+    def add(self, from_currency, to_currency, on_date, rate):
+        """Add one rate; call sort() before lookups if rows were not added in date order"""
+        dates, rates = self._pairs.setdefault((from_currency, to_currency), ([], []))
+        dates.append(on_date.toordinal())
+        rates.append(float(rate))
+
+    def sort(self):
+        for key, (dates, rates) in self._pairs.items():
+            if any(dates[i] > dates[i + 1] for i in range(len(dates) - 1)):
+                ordered = sorted(zip(dates, rates))
+                self._pairs[key] = ([d for d, _ in ordered], [r for _, r in ordered])
+
+    def insert(self, from_currency, to_currency, on_date, rate):
+        """Insert one rate in date order, keeping an existing rate for that day"""
+        dates, rates = self._pairs.setdefault((from_currency, to_currency), ([], []))
+        target = on_date.toordinal()
+        index = bisect_right(dates, target)
+        if index and dates[index - 1] == target:
+            return
+        dates.insert(index, target)
+        rates.insert(index, float(rate))
+
+    def _lookup(self, from_currency, to_currency, on_date, lookback):
+        pair = self._pairs.get((from_currency, to_currency))
+        if not pair:
+            return None
+        dates, rates = pair
+        target = on_date.toordinal()
+        index = bisect_right(dates, target) - 1
+        if index < 0 or target - dates[index] > lookback:
+            return None
+        return rates[index]
+
+    def rate_on(self, from_currency, to_currency, on_date, max_lookback_days=None):
+        """Rate for on_date (or the nearest prior business day), direct, inverted or via the base currency"""
+        if from_currency == to_currency:
+            return 1.0
+        lookback = self.max_lookback_days if max_lookback_days is None else max_lookback_days
+
+        rate = self._lookup(from_currency, to_currency, on_date, lookback)
+        if rate is not None:
+            return rate
+
+        inverse = self._lookup(to_currency, from_currency, on_date, lookback)
+        if inverse:
+            return 1.0 / inverse
+
+        base = self.base_currency
+        base_to = 1.0 if to_currency == base else self._lookup(base, to_currency, on_date, lookback)
+        base_from = 1.0 if from_currency == base else self._lookup(base, from_currency, on_date, lookback)
+        if base_to is not None and base_from:
+            return base_to / base_from
+        return None
+
+
+def load_rate_table(base_currency='EUR', max_lookback_days=7):
+    """Build a RateTable from every CurrencyRate row"""
+    table = RateTable(base_currency, max_lookback_days)
+    rows = db.session.query(
+        CurrencyRate.from_currency, CurrencyRate.to_currency, CurrencyRate.date, CurrencyRate.rate
+    ).order_by(CurrencyRate.from_currency, CurrencyRate.to_currency, CurrencyRate.date)
+    for from_currency, to_currency, on_date, rate in rows:
+        table.add(from_currency, to_currency, on_date, rate)
+    return table
+
+
+class RateTableHolder:
+    """Process-wide RateTable, rebuilt after `max_age` seconds or on invalidate()"""
+
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+        self._table = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._table is None or time.monotonic() - self._loaded_at > self.max_age:
+            with self._lock:
+                if self._table is None or time.monotonic() - self._loaded_at > self.max_age:
+                    self._table = load_rate_table(
+                        current_app.config['FX_BASE_CURRENCY'], current_app.config['FX_MAX_LOOKBACK_DAYS']
+                    )
+                    self._loaded_at = time.monotonic()
+        return self._table
+
+    def invalidate(self):
+        with self._lock:
+            self._table = None
+
+    def observe(self, from_currency, to_currency, on_date, rate):
+        """Add a newly recorded rate to the loaded table without a full reload"""
+        with self._lock:
+            if self._table is not None:
+                self._table.insert(from_currency, to_currency, on_date, rate)
+
+
+def get_rate_table():
+    return current_app.extensions['fx_rates'].get()
+
+
+def get_exchange_rate(from_currency, to_currency):
+    """Get the current exchange rate between two currencies from the live API"""
+    if from_currency == to_currency:
+        return 1.0
+
+    try:
+        data = get_outbound_client().get_json_cached(
+            f'rates:{from_currency}', f"{current_app.config['EXCHANGE_RATE_API_URL']}/{from_currency}",
+            fresh_for=current_app.config['EXCHANGE_RATE_FRESH_SECONDS'],
+            stale_for=current_app.config['EXCHANGE_RATE_STALE_SECONDS']
+        )
+    except UpstreamError as e:
+        print(f"Error fetching exchange rate: {e}")
+        raise ExchangeRateUnavailable(f'Exchange rate {from_currency}->{to_currency} is unavailable') from e
+
+    rate = data.get('rates', {}).get(to_currency)
+    if rate is None:
+        raise ExchangeRateUnavailable(f'No exchange rate published for {from_currency}->{to_currency}')
+    return rate
+
+
+def get_rate_for_date(from_currency, to_currency, on_date, record=False):
+    """
+    Exchange rate in effect on `on_date`.
+
+    Today's date uses the live API unless today's rate is already stored;
+    with record=True the live rate is saved as today's rate (the caller
+    commits). Past dates use the historical table, falling back to the
+    nearest prior business day. Only dates within FX_LIVE_RATE_DAYS of today
+    may fall back to the live rate; older dates with no history raise
+    ExchangeRateUnavailable rather than silently using today's rate.
+    """
+    if from_currency == to_currency:
+        return 1.0
+
+    table = get_rate_table()
+    today = date.today()
+
+    if on_date >= today and table.rate_on(from_currency, to_currency, today, max_lookback_days=0) is None:
+        try:
+            rate = get_exchange_rate(from_currency, to_currency)
+            if record:
+                record_rate(from_currency, to_currency, today, rate)
+            return rate
+        except ExchangeRateUnavailable:
+            pass  # Fall back to the most recent stored rate
+
+    rate = table.rate_on(from_currency, to_currency, min(on_date, today))
+    if rate is not None:
+        return rate
+
+    if (today - on_date).days <= current_app.config['FX_LIVE_RATE_DAYS']:
+        return get_exchange_rate(from_currency, to_currency)
+
+    raise ExchangeRateUnavailable(
+        f'No historical exchange rate for {from_currency}->{to_currency} on {on_date.isoformat()}'
+    )
+
+
+def _insert_ignoring_duplicates():
+    """INSERT that skips rows already present for (from, to, date), where the dialect supports it"""
+    dialect = db.session.get_bind(mapper=CurrencyRate).dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(CurrencyRate).on_conflict_do_nothing(
+        index_elements=['from_currency', 'to_currency', 'date']
+    )
+
+
+def record_rate(from_currency, to_currency, on_date, rate):
+    """Store one observed rate if none exists for that day"""
+    stmt = _insert_ignoring_duplicates()
+    if stmt is None:
+        return
+    db.session.execute(stmt, [{
+        'from_currency': from_currency, 'to_currency': to_currency,
+        'date': on_date, 'rate': rate, 'created_at': datetime.utcnow(),
+    }])
+    # The loaded table only learns the rate once it is committed
+    db.session.info.setdefault(PENDING_RATES_KEY, []).append((from_currency, to_currency, on_date, rate))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _observe_pending(session):
+    pending = session.info.pop(PENDING_RATES_KEY, None)
+    if not pending or not has_app_context():
+        return
+    holder = current_app.extensions.get('fx_rates')
+    if holder is not None:
+        for row in pending:
+            holder.observe(*row)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_RATES_KEY, None)
+
+
+def parse_rate_file(path, base_currency='EUR'):
+    """
+    Yield (from_currency, to_currency, date, rate) from a rate CSV.
+
+    Accepts the ECB wide layout (``Date,USD,JPY,...`` with one row per day,
+    rates quoted against `base_currency`, ``N/A`` for missing values) or a long
+    layout with ``date,from_currency,to_currency,rate`` columns.
+    """
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader)]
+        lowered = [column.lower() for column in header]
+
+        if {'date', 'from_currency', 'to_currency', 'rate'} <= set(lowered):
+            index = {name: lowered.index(name) for name in ('date', 'from_currency', 'to_currency', 'rate')}
+            for row in reader:
+                if not row:
+                    continue
+                yield (
+                    row[index['from_currency']].strip().upper(),
+                    row[index['to_currency']].strip().upper(),
+                    datetime.strptime(row[index['date']].strip(), '%Y-%m-%d').date(),
+                    float(row[index['rate']]),
+                )
+            return
+
+        currencies = header[1:]
+        for row in reader:
+            if not row or not row[0].strip():
+                continue
+            on_date = datetime.strptime(row[0].strip(), '%Y-%m-%d').date()
+            for currency, value in zip(currencies, row[1:]):
+                value = value.strip()
+                if not currency or not value or value.upper() == 'N/A':
+                    continue
+                yield base_currency, currency.upper(), on_date, float(value)
+
+
+def bulk_load_rates(rows, batch_size=1000):
+    """Insert rate rows in batches, skipping days already stored; returns rows submitted"""
+    stmt = _insert_ignoring_duplicates()
+    existing = None
+    if stmt is None:
+        stmt = insert(CurrencyRate)
+        existing = set(db.session.query(CurrencyRate.from_currency, CurrencyRate.to_currency, CurrencyRate.date))
+
+    now = datetime.utcnow()
+    total = 0
+    batch = []
+    for from_currency, to_currency, on_date, rate in rows:
+        if existing is not None:
+            if (from_currency, to_currency, on_date) in existing:
+                continue
+            existing.add((from_currency, to_currency, on_date))
+        batch.append({
+            'from_currency': from_currency, 'to_currency': to_currency,
+            'date': on_date, 'rate': rate, 'created_at': now,
+        })
+        if len(batch) >= batch_size:
+            db.session.execute(stmt, batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+
+    if batch:
+        db.session.execute(stmt, batch)
+        db.session.commit()
+        total += len(batch)
+
+    current_app.extensions['fx_rates'].invalidate()
+    return total
+
+
+def init_fx_rates(app):
+    app.extensions['fx_rates'] = RateTableHolder(max_age=app.config.get('FX_TABLE_MAX_AGE', 3600))
+
+    @app.cli.command('fx-load-rates')
+    @click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+    @click.option('--base', default=None, help='Base currency of wide (ECB-style) files')
+    @click.option('--batch-size', default=1000, show_default=True)
+    def load_rates_command(paths, base, batch_size):
+        """Bulk-load daily exchange rate CSV files into CurrencyRate"""
+        base = (base or app.config['FX_BASE_CURRENCY']).upper()
+        for path in paths:
+            count = bulk_load_rates(parse_rate_file(path, base), batch_size=batch_size)
+            print(f"Processed {count} rate rows from {path}")
@@ -0,0 +1,256 @@
+"""
+Shared outbound HTTP client
+
+Every call to an external API goes through one pooled keep-alive session with
+a per-call deadline covering the connect, the response and the whole body. A per-host circuit breaker stops calling an upstream
+that keeps failing, and cached lookups are served stale-while-revalidate so
+callers get the last good value at once while a refresh runs in the
+background.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from flask import current_app
+
+from cache_backends import LocalCache, cache_backend
+
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class UpstreamError(Exception):
+    """An external service call failed or returned an unusable response"""
+
+
+class CircuitOpenError(UpstreamError):
+    """The upstream's circuit breaker is open; the call was not attempted"""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one trial call through after `reset_timeout`"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+class StaleWhileRevalidateCache:
+    """
+    Cache where entries are fresh for `fresh_for` seconds, then served stale
+    for up to `stale_for` more seconds while one background refresh runs.
+    Entries live in a cache backend, so workers sharing one share the data.
+    """
+
+    def __init__(self, max_workers=2, backend=None):
+        self.backend = backend if backend is not None else LocalCache(max_size=1024)
+        self._keys = set()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='swr-refresh')
+
+    def get(self, key, loader, fresh_for, stale_for):
+        entry = self.backend.get(f'swr:{key}')
+
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < fresh_for:
+                return value
+            if age < fresh_for + stale_for:
+                self._refresh_in_background(key, loader, fresh_for + stale_for)
+                return value
+
+        value = loader()
+        self.put(key, value, ttl=fresh_for + stale_for)
+        return value
+
+    def put(self, key, value, ttl=None):
+        # Wall-clock timestamps, since other processes read the entry too
+        self.backend.set(f'swr:{key}', (value, time.time()), ttl=ttl)
+        with self._lock:
+            self._keys.add(key)
+
+    def peek(self, key):
+        entry = self.backend.get(f'swr:{key}')
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            keys, self._keys = self._keys, set()
+        for key in keys:
+            self.backend.delete(f'swr:{key}')
+
+    def _refresh_in_background(self, key, loader, ttl):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.put(key, loader(), ttl=ttl)
+            except Exception as e:
+                print(f"Background refresh of {key} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(refresh)
+
+
+def _read_until(response, cutoff, url, deadline):
+    """
+    Read a streamed response body, failing once the monotonic `cutoff`
+    passes. The read timeout only bounds each socket read, so a server
+    trickling bytes would otherwise hold the caller indefinitely.
+    """
+    chunks = []
+    while True:
+        remaining = cutoff - time.monotonic()
+        if remaining <= 0:
+            raise UpstreamError(f"Deadline of {deadline}s exceeded for {url}")
+        connection = response.raw.connection
+        if connection is not None and connection.sock is not None:
+            connection.sock.settimeout(remaining)
+        chunk = response.raw.read1(READ_CHUNK_BYTES, decode_content=True)
+        if not chunk:
+            return b''.join(chunks)
+        chunks.append(chunk)
+
+
+class OutboundClient:
+    """Pooled, deadline-bounded JSON client with per-host circuit breakers"""
+
+    def __init__(self, connect_timeout=3.0, deadline=5.0, pool_size=10,
+                 failure_threshold=5, reset_timeout=30.0, cache_backend=None):
+        self.connect_timeout = connect_timeout
+        self.deadline = deadline
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache = StaleWhileRevalidateCache(backend=cache_backend)
+        self._breakers = {}
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    # Imported here so processes that never call out don't pay for requests
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def breaker_for(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+        return breaker
+
+    def get_json(self, url, deadline=None):
+        """GET a JSON document; raises UpstreamError on failure or when the circuit is open"""
+        import requests
+        from urllib3.exceptions import HTTPError
+
+        deadline = deadline or self.deadline
+        breaker = self.breaker_for(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+        cutoff = time.monotonic() + deadline
+        try:
+            response = self.session.get(url, timeout=(min(self.connect_timeout, deadline), deadline), stream=True)
+            try:
+                body = _read_until(response, cutoff, url, deadline)
+            finally:
+                response.close()
+            if response.status_code >= 500:
+                raise UpstreamError(f"{url} returned {response.status_code}")
+            data = json.loads(body)
+        except (requests.RequestException, HTTPError, OSError, ValueError, UpstreamError) as e:
+            breaker.record_failure()
+            if isinstance(e, UpstreamError):
+                raise
+            raise UpstreamError(f"Request to {url} failed: {e}") from e
+
+        breaker.record_success()
+        if response.status_code != 200:
+            raise UpstreamError(f"{url} returned {response.status_code}")
+        return data
+
+    def get_json_cached(self, key, url, fresh_for, stale_for, deadline=None):
+        """get_json with stale-while-revalidate caching under `key`"""
+        return self.cache.get(key, lambda: self.get_json(url, deadline=deadline), fresh_for, stale_for)
+
+
+def init_http_client(app):
+    app.extensions['outbound_client'] = OutboundClient(
+        connect_timeout=app.config.get('HTTP_CONNECT_TIMEOUT', 3.0),
+        deadline=app.config.get('HTTP_DEADLINE', 5.0),
+        pool_size=app.config.get('HTTP_POOL_SIZE', 10),
+        failure_threshold=app.config.get('HTTP_BREAKER_THRESHOLD', 5),
+        reset_timeout=app.config.get('HTTP_BREAKER_RESET', 30.0),
+        cache_backend=cache_backend(app, max_size=1024),
+    )
+
+
+def get_outbound_client():
+    return current_app.extensions['outbound_client']
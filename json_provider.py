@@ -0,0 +1,158 @@
+"""
+Fast JSON responses
+
+``FastJSONProvider`` replaces Flask's JSON provider with orjson (falling back
+to the standard library when it isn't installed). Views can return Decimal,
+date, datetime and enum values (UserRole, ExpenseStatus) directly: decimals
+become JSON numbers, dates ISO 8601 strings and enums their value.
+
+``stream_json_array`` sends long lists a batch at a time instead of building
+the whole document in memory, and ``compress_response`` gzips (or, with the
+Brotli package, brotli-compresses) JSON bodies above JSON_COMPRESS_MIN_SIZE
+for clients that accept it.
+"""
+
+import gzip
+import json
+import zlib
+from datetime import date
+from decimal import Decimal
+from enum import Enum
+
+from flask import Response, current_app, request, stream_with_context
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON_MIMETYPES = ('application/json', 'application/problem+json')
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, date):
+        return value.isoformat()
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps_bytes(obj):
+    """Compact UTF-8 JSON for `obj`"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by dumps_bytes"""
+
+    mimetype = 'application/json'
+
+    def dumps(self, obj, **kwargs):
+        # Callers passing options (the session serializer, indent=...) get the stdlib encoder
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return json.dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        # object_hook is how the session serializer restores tuples, Markup and datetimes
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+def stream_json_array(items, serialize, key=None, extra=None, batch_size=200):
+    """
+    Response streaming `[serialize(item), ...]`, or ``{key: [...], **extra}``
+    when `key` is given, encoding `batch_size` items per chunk.
+    """
+    head, tail = b'[', b']'
+    if key is not None:
+        head = b'{' + dumps_bytes(key) + b':['
+        tail = b']' + (b',' + dumps_bytes(extra)[1:] if extra else b'}')
+
+    def generate():
+        yield head
+        separator = b''
+        batch = []
+        for item in items:
+            batch.append(dumps_bytes(serialize(item)))
+            if len(batch) >= batch_size:
+                yield separator + b','.join(batch)
+                separator, batch = b',', []
+        if batch:
+            yield separator + b','.join(batch)
+        yield tail
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def negotiate_encoding(accept_encodings):
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compress_chunks(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk if isinstance(chunk, bytes) else chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def compress_response(response):
+    """after_request hook: compress JSON bodies the client can decode"""
+    if (response.mimetype not in JSON_MIMETYPES
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+
+    encoding = negotiate_encoding(request.accept_encodings)
+    level = current_app.config['JSON_COMPRESS_LEVEL']
+    if response.is_streamed:
+        # Size is unknown up front, and streamed lists are large by construction
+        if encoding is None:
+            return response
+        encoding = 'gzip'
+        response.response = _compress_chunks(response.response, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['JSON_COMPRESS_MIN_SIZE'] or encoding is None:
+            response.vary.add('Accept-Encoding')
+            return response
+        if encoding == 'br':
+            response.set_data(brotli.compress(body, quality=min(level, 11)))
+        else:
+            response.set_data(gzip.compress(body, compresslevel=level))
+
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_json(app):
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
@@ -0,0 +1,10 @@
+"""
+Offline load-testing harness for the Expense Management System
+
+Runs concurrent virtual users against the app while the external country and
+exchange-rate APIs are replaced by local mock servers and OCR is forced to
+MockReceiptOCR, so load tests need neither network access nor Tesseract.
+
+Usage:
+    python -m loadtest --users 20 --iterations 5
+"""
@@ -0,0 +1,173 @@
+"""
+Scripted user journeys driven over HTTP against a running app
+"""
+
+import base64
+import random
+import time
+import uuid
+from datetime import date, timedelta
+
+import requests
+
+DEFAULT_PASSWORD = 'loadtest123'
+
+# 1x1 white PNG; MockReceiptOCR ignores the content
+RECEIPT_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=='
+)
+
+EXPENSE_TITLES = ['Client dinner', 'Taxi to airport', 'Hotel stay', 'Printer paper', 'Conference ticket']
+CURRENCIES = ['USD', 'EUR', 'GBP', 'INR']
+# Older expense dates need stored historical rates (FX_LIVE_RATE_DAYS), which the mock exchange API can't supply
+EXPENSE_MAX_AGE_DAYS = 3
+
+
+class JourneyError(Exception):
+    """Raised when a journey step gets an unexpected response"""
+
+
+class VirtualUser:
+    """A logged-in browser-like session that records timings for each request"""
+
+    def __init__(self, base_url, recorder, email=None, password=DEFAULT_PASSWORD):
+        self.base_url = base_url.rstrip('/')
+        self.recorder = recorder
+        self.email = email
+        self.password = password
+        self.session = requests.Session()
+
+    def request(self, method, path, route=None, expected=(200,), **kwargs):
+        """Send a request and record its latency under a route template name"""
+        route = route or path
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', 30)
+
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, **kwargs)
+        except requests.RequestException as e:
+            self.recorder.record(f"{method} {route}", time.perf_counter() - started, ok=False)
+            raise JourneyError(f"{method} {path} failed: {e}")
+
+        ok = response.status_code in expected
+        self.recorder.record(f"{method} {route}", time.perf_counter() - started, ok=ok)
+        if not ok:
+            raise JourneyError(f"{method} {path} returned {response.status_code}")
+        return response
+
+    def login(self):
+        """Journey: log in with JSON credentials"""
+        self.request('POST', '/login', json={'email': self.email, 'password': self.password})
+        self.request('GET', '/dashboard')
+
+    def submit_expense(self, with_ocr=True):
+        """Journey: optionally scan a receipt, then submit an expense; returns the expense id"""
+        self.request('GET', '/expenses/new')
+
+        currency = random.choice(CURRENCIES)
+        if with_ocr:
+            files = {'receipt': ('receipt.png', RECEIPT_PNG, 'image/png')}
+            self.request('POST', '/api/ocr/process', files=files)
+            self.request('GET', f'/api/exchange-rate/{currency}/USD', route='/api/exchange-rate/<from>/<to>')
+
+        payload = {
+            'title': random.choice(EXPENSE_TITLES),
+            'description': 'Generated by loadtest',
+            'amount': f"{random.uniform(10, 2000):.2f}",
+            'currency': currency,
+            'expense_date': (date.today() - timedelta(days=random.randint(0, EXPENSE_MAX_AGE_DAYS))).isoformat(),
+            'category_id': self.category_id,
+        }
+        response = self.request('POST', '/expenses/new', json=payload)
+        return response.json()['expense_id']
+
+    def open_expense_detail(self, expense_id):
+        """Journey: open the expense list and the detail modal for one expense"""
+        self.request('GET', '/expenses')
+        response = self.request('GET', f'/api/expenses/{expense_id}', route='/api/expenses/<id>')
+        return response.json()
+
+    def approve_ready(self, expense_id, approver_name):
+        """Approve this user's ready approval on an expense; returns True if one was found"""
+        self.request('GET', '/approvals')
+        detail = self.open_expense_detail(expense_id)
+        for approval in detail['approvals']:
+            if approval['approver'] == approver_name and approval['status'] == 'pending' and approval['is_ready']:
+                self.request(
+                    'POST', f"/approvals/{approval['id']}/approve", route='/approvals/<id>/approve',
+                    json={'comments': 'Approved by loadtest'}
+                )
+                return True
+        return False
+
+    @property
+    def category_id(self):
+        if not hasattr(self, '_category_id'):
+            html = self.request('GET', '/expenses/new').text
+            options = select_options(html, 'category_id')
+            if not options:
+                raise JourneyError('No expense categories available')
+            self._category_id = options[0][0]
+        return self._category_id
+
+
+def select_options(html, name):
+    """Return (value, label) pairs with non-empty values from a <select name=...>"""
+    start = html.find(f'name="{name}"')
+    if start == -1:
+        return []
+    end = html.find('</select>', start)
+    options = []
+    for chunk in html[start:end].split('<option value="')[1:]:
+        value, rest = chunk.split('"', 1)
+        label = rest.split('>', 1)[1].split('</option>', 1)[0].strip()
+        if value:
+            options.append((value, label))
+    return options
+
+
+def seed_company(base_url, recorder, employees, levels=3):
+    """
+    Register a company and build a management chain over HTTP.
+
+    Returns (admin, approver_chain, employees) where approver_chain lists
+    (email, full_name) bottom-up from the employees' direct manager to the admin.
+    """
+    tag = uuid.uuid4().hex[:8]
+    admin = VirtualUser(base_url, recorder, email=f'admin-{tag}@loadtest.local')
+    admin.request('POST', '/register', json={
+        'email': admin.email,
+        'password': DEFAULT_PASSWORD,
+        'first_name': 'Load',
+        'last_name': f'Admin{tag}',
+        'company_name': f'Loadtest {tag}',
+        'country': 'United States',
+    })
+
+    admin_name = f'Load Admin{tag}'
+    chain = [(admin.email, admin_name)]
+    html = admin.request('GET', '/users/new').text
+    manager_id = next(value for value, label in select_options(html, 'manager_id') if label.startswith(admin_name))
+
+    for level in range(1, levels):
+        email = f'manager{level}-{tag}@loadtest.local'
+        response = admin.request('POST', '/users/new', json={
+            'email': email, 'password': DEFAULT_PASSWORD,
+            'first_name': 'Level', 'last_name': f'{level}Manager{tag}',
+            'role': 'manager', 'manager_id': manager_id,
+        })
+        manager_id = response.json()['user_id']
+        chain.insert(0, (email, f'Level {level}Manager{tag}'))
+
+    employee_emails = []
+    for i in range(employees):
+        email = f'employee{i}-{tag}@loadtest.local'
+        admin.request('POST', '/users/new', json={
+            'email': email, 'password': DEFAULT_PASSWORD,
+            'first_name': 'Emp', 'last_name': f'{i}{tag}',
+            'role': 'employee', 'manager_id': manager_id,
+        })
+        employee_emails.append(email)
+
+    return admin, chain, employee_emails
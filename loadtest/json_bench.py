@@ -0,0 +1,116 @@
+"""
+JSON serialization benchmark: the old jsonify path against FastJSONProvider
+
+Encodes a synthetic list of expenses three ways and reports time and size:
+
+- ``stdlib``: float()/isoformat()/.value in the view, then Flask's default provider
+- ``fast``: raw Decimal/date/enum values through ``dumps_bytes``
+- ``stream``: the same values through ``stream_json_array``, as /api/expenses/export sends them
+
+Usage:
+    python -m loadtest.json_bench --rows 20000 --repeat 5
+"""
+
+import argparse
+import gzip
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from json_provider import dumps_bytes, stream_json_array
+from models import ExpenseStatus
+
+
+def fake_expenses(count, seed=7):
+    rng = random.Random(seed)
+    statuses = list(ExpenseStatus)
+    start = date(2025, 1, 1)
+    rows = []
+    for i in range(count):
+        amount = Decimal(rng.randint(100, 500000)) / 100
+        rows.append({
+            'id': i + 1,
+            'title': f'Client visit {i}',
+            'merchant': rng.choice(['Uber', 'Marriott', 'Starbucks', 'Indigo', 'Amazon']),
+            'amount': amount,
+            'currency': 'INR',
+            'amount_in_company_currency': amount,
+            'expense_date': start + timedelta(days=i % 365),
+            'status': rng.choice(statuses),
+            'employee': 'Employee Name',
+            'category': 'Travel',
+            'created_at': datetime(2025, 1, 1) + timedelta(minutes=i),
+        })
+    return rows
+
+
+def legacy_row(row):
+    """What the views used to build by hand before handing the dict to jsonify"""
+    return dict(
+        row,
+        amount=float(row['amount']),
+        amount_in_company_currency=float(row['amount_in_company_currency']),
+        expense_date=row['expense_date'].isoformat(),
+        status=row['status'].value,
+        created_at=row['created_at'].isoformat(),
+    )
+
+
+def run(rows, repeat):
+    app = Flask(__name__)
+    legacy = DefaultJSONProvider(app)
+
+    def encode_stdlib():
+        # Compact separators, as jsonify uses outside debug mode
+        body = {'expenses': [legacy_row(row) for row in rows]}
+        return legacy.dumps(body, separators=(',', ':')).encode('utf-8')
+
+    def encode_fast():
+        return dumps_bytes({'expenses': rows})
+
+    def encode_stream():
+        with app.test_request_context():
+            response = stream_json_array(rows, lambda row: row, key='expenses')
+            return b''.join(response.response)
+
+    results = []
+    for name, encode in (('stdlib', encode_stdlib), ('fast', encode_fast), ('stream', encode_stream)):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = encode()
+            best = min(best, time.perf_counter() - started)
+        started = time.perf_counter()
+        compressed = gzip.compress(body, compresslevel=6)
+        results.append({
+            'name': name,
+            'ms': best * 1000,
+            'bytes': len(body),
+            'gzip_bytes': len(compressed),
+            'gzip_ms': (time.perf_counter() - started) * 1000,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5, help='report the best of this many runs')
+    args = parser.parse_args(argv)
+
+    results = run(fake_expenses(args.rows), args.repeat)
+    baseline = results[0]['ms']
+    print(f"{args.rows} expenses, best of {args.repeat}")
+    print(f"{'encoder':<8} {'ms':>9} {'speedup':>8} {'bytes':>11} {'gzip bytes':>11} {'gzip ms':>9}")
+    for row in results:
+        print(f"{row['name']:<8} {row['ms']:>9.1f} {baseline / row['ms']:>7.1f}x "
+              f"{row['bytes']:>11} {row['gzip_bytes']:>11} {row['gzip_ms']:>9.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
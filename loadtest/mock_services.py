@@ -0,0 +1,448 @@
+"""
+Local stand-ins for the external services used by the app
+
+Each HTTP mock runs a threaded server on localhost and can inject latency and
+failures so load tests can exercise slow or flaky upstreams. MockPubSub is a
+minimal pub/sub server for running several app processes against one event
+broker, MockSMTP accepts and records the notification dispatcher's mail, and
+MockRedis serves the subset of the Redis protocol used by the shared cache.
+"""
+
+import fnmatch
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+COUNTRIES = [
+    {'name': {'common': 'United States'}, 'currencies': {'USD': {'name': 'United States dollar'}}},
+    {'name': {'common': 'India'}, 'currencies': {'INR': {'name': 'Indian rupee'}}},
+    {'name': {'common': 'United Kingdom'}, 'currencies': {'GBP': {'name': 'British pound'}}},
+    {'name': {'common': 'Germany'}, 'currencies': {'EUR': {'name': 'Euro'}}},
+    {'name': {'common': 'France'}, 'currencies': {'EUR': {'name': 'Euro'}}},
+    {'name': {'common': 'Canada'}, 'currencies': {'CAD': {'name': 'Canadian dollar'}}},
+    {'name': {'common': 'Australia'}, 'currencies': {'AUD': {'name': 'Australian dollar'}}},
+    {'name': {'common': 'Japan'}, 'currencies': {'JPY': {'name': 'Japanese yen'}}},
+]
+
+# Units of each currency per 1 USD
+USD_RATES = {
+    'USD': 1.0,
+    'EUR': 0.92,
+    'GBP': 0.79,
+    'INR': 83.2,
+    'CAD': 1.36,
+    'AUD': 1.52,
+    'JPY': 149.5,
+}
+
+
+class MockService:
+    """Threaded HTTP server with injectable latency and failure rate"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, failure_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.request_count = 0
+        self.failure_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                service._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _handle(self, handler):
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failure_count += 1
+
+        if delay:
+            time.sleep(delay / 1000.0)
+
+        if fail:
+            self._send_json(handler, 503, {'error': 'Injected failure'})
+            return
+
+        status, payload = self.handle_path(handler.path)
+        self._send_json(handler, status, payload)
+
+    def _send_json(self, handler, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def handle_path(self, path):
+        """Return (status, payload) for a request path"""
+        raise NotImplementedError
+
+
+class MockCountriesAPI(MockService):
+    """Stand-in for restcountries.com's /v3.1/all endpoint"""
+
+    def handle_path(self, path):
+        if path.split('?', 1)[0].rstrip('/') == '/v3.1/all':
+            return 200, COUNTRIES
+        return 404, {'error': 'Not found'}
+
+    @property
+    def api_url(self):
+        """Value for the COUNTRIES_API_URL setting"""
+        return f"{self.url}/v3.1/all?fields=name,currencies"
+
+
+class MockExchangeRateAPI(MockService):
+    """Stand-in for exchangerate-api.com's /v4/latest/<base> endpoint"""
+
+    def handle_path(self, path):
+        parts = path.split('?', 1)[0].strip('/').split('/')
+        if len(parts) != 3 or parts[:2] != ['v4', 'latest']:
+            return 404, {'error': 'Not found'}
+
+        base = parts[2].upper()
+        if base not in USD_RATES:
+            return 404, {'error': f'Unsupported currency {base}'}
+
+        base_per_usd = USD_RATES[base]
+        return 200, {
+            'base': base,
+            'date': time.strftime('%Y-%m-%d'),
+            'rates': {code: round(rate / base_per_usd, 6) for code, rate in USD_RATES.items()}
+        }
+
+    @property
+    def api_url(self):
+        """Value for the EXCHANGE_RATE_API_URL setting"""
+        return f"{self.url}/v4/latest"
+
+
+class MockPubSub:
+    """
+    JSON-lines pub/sub server for EVENT_BROKER_URL.
+
+    Clients send ``{"op": "subscribe", "channel": ...}`` to receive every later
+    message on a channel, or ``{"op": "publish", "channel": ..., "data": ...}``
+    to broadcast one.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.published_count = 0
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        pubsub = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                pubsub._serve(self)
+
+        ThreadingTCPServer.allow_reuse_address = True
+        self.server = ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"pubsub://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, ()))
+
+    def _serve(self, handler):
+        subscribed = []
+        try:
+            for line in handler.rfile:
+                try:
+                    command = json.loads(line)
+                except ValueError:
+                    continue
+                channel = command.get('channel')
+                if command.get('op') == 'subscribe':
+                    with self._lock:
+                        self._subscribers.setdefault(channel, set()).add(handler)
+                    subscribed.append(channel)
+                elif command.get('op') == 'publish':
+                    self._broadcast(channel, command.get('data'))
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                for channel in subscribed:
+                    self._subscribers.get(channel, set()).discard(handler)
+
+    def _broadcast(self, channel, data):
+        message = (json.dumps({'channel': channel, 'data': data}) + '\n').encode('utf-8')
+        with self._lock:
+            self.published_count += 1
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.wfile.write(message)
+                subscriber.wfile.flush()
+            except OSError:
+                pass
+
+
+class MockSMTP:
+    """
+    Minimal SMTP server that records messages instead of delivering them.
+
+    With `failure_rate` set, that share of transactions is refused with a
+    temporary 451 error so dispatcher retries can be exercised.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, failure_rate=0.0, seed=None):
+        self.failure_rate = failure_rate
+        self.messages = []
+        self.failure_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        smtp = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                smtp._serve(self)
+
+        ThreadingTCPServer.allow_reuse_address = True
+        self.server = ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def host(self):
+        return self.server.server_address[0]
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self, handler):
+        def reply(line):
+            handler.wfile.write(f"{line}\r\n".encode('utf-8'))
+            handler.wfile.flush()
+
+        reply('220 mock-smtp ready')
+        mail_from, recipients = None, []
+        for raw in handler.rfile:
+            command = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                reply('250 mock-smtp')
+            elif verb == 'MAIL':
+                with self._lock:
+                    fail = self._random.random() < self.failure_rate
+                    if fail:
+                        self.failure_count += 1
+                if fail:
+                    reply('451 Injected temporary failure')
+                    continue
+                mail_from, recipients = command.split(':', 1)[1].strip(), []
+                reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                reply('250 OK')
+            elif verb == 'DATA':
+                reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                for data_line in handler.rfile:
+                    if data_line in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                with self._lock:
+                    self.messages.append({
+                        'from': mail_from, 'to': recipients, 'data': b''.join(lines).decode('utf-8', 'replace'),
+                    })
+                reply('250 Message accepted')
+            elif verb in ('RSET', 'NOOP'):
+                mail_from, recipients = None, []
+                reply('250 OK')
+            elif verb == 'QUIT':
+                reply('221 Bye')
+                return
+            else:
+                reply('502 Command not implemented')
+
+
+class MockRedis:
+    """
+    In-memory Redis stand-in for CACHE_URL=redis://...
+
+    Speaks RESP and supports the commands RedisCache sends: PING, AUTH,
+    SELECT, GET, MGET, SET (with EX/PX), DEL, INCR/INCRBY, SCAN, DBSIZE and
+    FLUSHDB. Expiry is checked on access.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.command_count = 0
+        self._data = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+        redis = self
+
+        class Handler(StreamRequestHandler):
+            def handle(self):
+                redis._serve(self)
+
+        ThreadingTCPServer.allow_reuse_address = True
+        self.server = ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _read_command(self, rfile):
+        header = rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(rfile.readline()[1:])
+            args.append(rfile.read(length + 2)[:-2])
+        return args
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    def _serve(self, handler):
+        def bulk(value):
+            return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+        try:
+            while True:
+                args = self._read_command(handler.rfile)
+                if args is None:
+                    return
+                with self._lock:
+                    self.command_count += 1
+                    reply = self._execute(args[0].upper().decode(), args[1:], bulk)
+                handler.wfile.write(reply)
+                handler.wfile.flush()
+        except OSError:
+            pass
+
+    def _execute(self, command, args, bulk):
+        if command in ('PING', 'AUTH', 'SELECT'):
+            return b'+OK\r\n' if command != 'PING' else b'+PONG\r\n'
+        if command == 'GET':
+            entry = self._live(args[0])
+            return bulk(entry and entry[0])
+        if command == 'MGET':
+            values = [(self._live(key) or (None,))[0] for key in args]
+            return b'*%d\r\n' % len(values) + b''.join(bulk(value) for value in values)
+        if command == 'SET':
+            expires_at = None
+            if len(args) >= 4:
+                unit = 1000 if args[2].upper() == b'PX' else 1
+                expires_at = time.monotonic() + int(args[3]) / unit
+            self._data[args[0]] = (args[1], expires_at)
+            return b'+OK\r\n'
+        if command == 'DEL':
+            return b':%d\r\n' % sum(self._data.pop(key, None) is not None for key in args)
+        if command in ('INCR', 'INCRBY'):
+            entry = self._live(args[0])
+            value = int(entry[0] if entry else 0) + (int(args[1]) if command == 'INCRBY' else 1)
+            self._data[args[0]] = (str(value).encode(), entry[1] if entry else None)
+            return b':%d\r\n' % value
+        if command == 'SCAN':
+            pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+            keys = [key for key in list(self._data) if self._live(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return b'*2\r\n' + bulk(b'0') + b'*%d\r\n' % len(keys) + b''.join(bulk(key) for key in keys)
+        if command == 'DBSIZE':
+            return b':%d\r\n' % len(self._data)
+        if command == 'FLUSHDB':
+            self._data.clear()
+            return b'+OK\r\n'
+        return b'-ERR unknown command ' + command.encode() + b'\r\n'
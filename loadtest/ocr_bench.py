@@ -0,0 +1,179 @@
+"""
+OCR benchmark: per-stage timings and field accuracy of ReceiptOCR on a synthetic corpus
+
+Runs every receipt of a corpus (see ``loadtest.receipt_corpus``) through
+the stages of ``ReceiptOCR.process_receipt`` one at a time and times each:
+image load, ``preprocess_image``, the Tesseract call and every
+``extract_*``/``categorize_expense`` function. The extracted amount,
+currency, date, merchant and category are scored against the manifest, per
+field and broken down by what varied (currency, date format, amount style,
+noise, font), next to throughput in images per second.
+
+Without a Tesseract install, ``--text truth`` is used: the extractors get the
+receipt's exact text, which times them and scores them without OCR errors.
+
+Usage:
+    python -m loadtest.ocr_bench --count 100
+    python -m loadtest.ocr_bench --corpus receipts-corpus --text ocr --breakdown
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+
+from loadtest.receipt_corpus import generate_corpus, load_manifest
+from loadtest.stats import percentile
+
+STAGES = ('load', 'preprocess_image', 'tesseract', 'extract_amount', 'extract_currency', 'extract_date',
+          'extract_merchant', 'categorize_expense')
+FIELDS = ('amount', 'currency', 'date', 'merchant', 'category')
+# Receipt properties accuracy is broken down by with --breakdown
+VARIATIONS = ('currency', 'date_format', 'amount_style', 'noise', 'font')
+# Properties of the image only, which can't affect results when the extractors get the exact text
+IMAGE_VARIATIONS = ('noise', 'font')
+
+
+def tesseract_available():
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception:
+        return False
+    return True
+
+
+def field_matches(field, extracted, entry):
+    if field == 'amount':
+        return extracted is not None and abs(extracted - float(entry['amount'])) < 0.005
+    if field == 'date':
+        return extracted is not None and extracted.isoformat() == entry['date']
+    if field == 'merchant':
+        return ' '.join(extracted.lower().split()) == entry['merchant'].lower()
+    return extracted == entry[field]
+
+
+def run_receipt(ocr, directory, entry, use_ocr):
+    """Time each stage on one receipt; returns ({stage: seconds}, {field: extracted value})"""
+    from PIL import Image
+
+    timings = {}
+
+    def timed(stage, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        timings[stage] = time.perf_counter() - started
+        return result
+
+    if use_ocr:
+        import pytesseract
+
+        def load():
+            image = Image.open(os.path.join(directory, entry['file']))
+            image.load()
+            return image
+
+        image = timed('preprocess_image', ocr.preprocess_image, timed('load', load))
+        text = timed('tesseract', pytesseract.image_to_string, image)
+    else:
+        text = entry['text']
+    extracted = {
+        'amount': timed('extract_amount', ocr.extract_amount, text),
+        'currency': timed('extract_currency', ocr.extract_currency, text),
+        'date': timed('extract_date', ocr.extract_date, text),
+        'merchant': timed('extract_merchant', ocr.extract_merchant, text),
+        'category': timed('categorize_expense', ocr.categorize_expense, text),
+    }
+    return timings, extracted
+
+
+def run(directory, entries, use_ocr, repeat=1):
+    """Stage timings (seconds lists), per-field correct counts and per-variation counts over the corpus"""
+    from ocr_utils import ReceiptOCR
+
+    ocr = ReceiptOCR()
+    samples = defaultdict(list)
+    per_image = []
+    correct = dict.fromkeys(FIELDS, 0)
+    by_variation = defaultdict(lambda: [0, 0])  # (variation, value, field) -> [correct, seen]
+    for entry in entries:
+        best = None
+        for _ in range(repeat):
+            timings, extracted = run_receipt(ocr, directory, entry, use_ocr)
+            if best is None or sum(timings.values()) < sum(best.values()):
+                best = timings
+        for stage, seconds in best.items():
+            samples[stage].append(seconds)
+        per_image.append(sum(best.values()))
+        for field in FIELDS:
+            ok = field_matches(field, extracted[field], entry)
+            correct[field] += ok
+            for variation in VARIATIONS:
+                counts = by_variation[(variation, str(entry.get(variation)), field)]
+                counts[0] += ok
+                counts[1] += 1
+    return {'samples': dict(samples), 'per_image': per_image, 'correct': correct,
+            'by_variation': dict(by_variation), 'images': len(entries)}
+
+
+def stage_rows(samples):
+    rows = []
+    for stage in STAGES:
+        values = sorted(samples.get(stage, ()))
+        if values:
+            rows.append({'stage': stage, 'total_ms': sum(values) * 1000, 'mean_ms': statistics.fmean(values) * 1000,
+                         'p95_ms': percentile(values, 95) * 1000})
+    return rows
+
+
+def print_report(result, text_source, breakdown=False):
+    images = result['images']
+    total = sum(result['per_image'])
+    print(f"{images} receipts, text from {'Tesseract' if text_source == 'ocr' else 'the ground truth'}")
+    print(f"{'stage':<20} {'total ms':>10} {'mean ms':>9} {'p95 ms':>9} {'share':>6}")
+    for row in stage_rows(result['samples']):
+        print(f"{row['stage']:<20} {row['total_ms']:>10.1f} {row['mean_ms']:>9.3f} {row['p95_ms']:>9.3f} "
+              f"{row['total_ms'] / (total * 1000) * 100 if total else 0:>5.1f}%")
+    print(f"throughput: {images / total if total else 0:.1f} images/s "
+          f"(p95 {percentile(sorted(result['per_image']), 95) * 1000:.1f} ms per image)")
+
+    print(f"{'field':<10} {'correct':>8} {'accuracy':>9}")
+    for field in FIELDS:
+        print(f"{field:<10} {result['correct'][field]:>8} {result['correct'][field] / images * 100:>8.1f}%")
+    if breakdown:
+        print(f"{'variation':<32} {'field':<10} {'accuracy':>9}")
+        for (variation, value, field), (ok, seen) in sorted(result['by_variation'].items()):
+            if ok < seen and (text_source == 'ocr' or variation not in IMAGE_VARIATIONS):
+                print(f"{variation + '=' + value:<32} {field:<10} {ok / seen * 100:>8.1f}% ({ok}/{seen})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--corpus', help='directory written by loadtest.receipt_corpus (default: generate one)')
+    parser.add_argument('--count', type=int, default=100, help='receipts to generate without --corpus')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--text', choices=('auto', 'ocr', 'truth'), default='auto',
+                        help='run Tesseract, or give the extractors the exact text (auto: OCR if installed)')
+    parser.add_argument('--repeat', type=int, default=1, help='keep the fastest of this many runs per receipt')
+    parser.add_argument('--breakdown', action='store_true', help='show accuracy misses per receipt property')
+    args = parser.parse_args(argv)
+
+    text_source = args.text
+    if text_source == 'auto':
+        text_source = 'ocr' if tesseract_available() else 'truth'
+        if text_source == 'truth':
+            print("Tesseract not found, timing and scoring the extractors on the exact receipt text")
+    elif text_source == 'ocr' and not tesseract_available():
+        print("FAIL: --text ocr needs the tesseract binary on PATH")
+        return 1
+
+    directory = args.corpus or tempfile.mkdtemp(prefix='receipts-corpus-')
+    entries = load_manifest(directory) if args.corpus else generate_corpus(directory, args.count, args.seed)
+    print_report(run(directory, entries, text_source == 'ocr', args.repeat), text_source, args.breakdown)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,198 @@
+"""
+Synthetic receipt images with ground truth, for benchmarking ReceiptOCR
+
+Each receipt is drawn with PIL from a seeded random layout: a merchant from
+one of the expense categories, a few line items, tax and a total in one of
+seven currencies, and a date in one of several formats. Fonts, sizes,
+amount styles and degradation (blur, noise, rotation, JPEG artefacts) vary
+from image to image. ``manifest.json`` records what each image says, so
+extracted fields can be scored against it.
+
+TrueType fonts are picked up from the usual system font directories. With
+none installed, PIL's built-in bitmap font is scaled to size instead, and
+symbols it can't draw (€, ₹) are written as currency codes.
+
+Usage:
+    python -m loadtest.receipt_corpus --out receipts-corpus --count 200 --seed 7
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+from datetime import date, timedelta
+
+MANIFEST = 'manifest.json'
+FONT_DIRS = ('/usr/share/fonts', '/usr/local/share/fonts', '/Library/Fonts', '/System/Library/Fonts',
+             os.path.expanduser('~/.fonts'), 'C:\\Windows\\Fonts')
+
+# Merchants and line items per category; categorize_expense should land on the key
+MERCHANTS = {
+    'Meals': (['Blue Door Cafe', 'Saffron Restaurant', 'Harbour Dining Co', 'Morning Cafe & Bakery'],
+              ['Lunch special', 'Espresso', 'Dinner for two', 'Breakfast set', 'Sparkling water']),
+    'Travel': (['City Taxi Service', 'Grand Plaza Hotel', 'SkyHigh Airline', 'QuickFuel Gas Station'],
+               ['Airport transfer', 'Room night', 'Flight change fee', 'Fuel 40L', 'Parking']),
+    'Office Supplies': (['Staples', 'Paper & Pen Depot', 'Office Supplies Hub'],
+                        ['A4 paper ream', 'Printer toner', 'Gel pen box', 'Desk organiser']),
+    'Software': (['Adobe Systems', 'CloudDesk SaaS', 'Microsoft Store'],
+                 ['Annual license', 'Subscription - 1 seat', 'Storage add-on']),
+    'Training': (['Skyline Training Institute', 'DevCon Conference', 'Leadership Workshop Ltd'],
+                 ['Workshop seat', 'Course materials', 'Seminar pass']),
+}
+
+# (code, symbols seen on receipts, decimal places)
+CURRENCIES = (
+    ('USD', ['$', 'US$'], 2),
+    ('EUR', ['€'], 2),
+    ('GBP', ['£'], 2),
+    ('INR', ['₹', 'Rs.'], 2),
+    ('JPY', ['¥'], 0),
+    ('CAD', ['C$'], 2),
+    ('AUD', ['A$'], 2),
+)
+
+DATE_FORMATS = ('%m/%d/%Y', '%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%B %d, %Y', '%d %B %Y', '%d.%m.%Y', '%d %b %y')
+
+
+def find_fonts(limit=8):
+    """Paths of up to `limit` TrueType fonts from the system font directories"""
+    paths = []
+    for directory in FONT_DIRS:
+        paths += glob.glob(os.path.join(directory, '**', '*.ttf'), recursive=True)
+    return sorted(set(paths))[:limit]
+
+
+def format_amount(value, places, style):
+    """'1234.50', '1,234.50' or the European '1.234,50'"""
+    text = f'{value:,.{places}f}' if style != 'plain' else f'{value:.{places}f}'
+    if style == 'european':
+        text = text.replace(',', ' ').replace('.', ',').replace(' ', '.')
+    return text
+
+
+def receipt_content(rng):
+    """Ground truth and the text lines of one receipt"""
+    category = rng.choice(sorted(MERCHANTS))
+    merchants, items = MERCHANTS[category]
+    merchant = rng.choice(merchants)
+    currency, symbols, places = rng.choice(CURRENCIES)
+    symbol = rng.choice(symbols + [currency])
+    style = rng.choice(['plain', 'plain', 'grouped', 'european' if currency == 'EUR' else 'grouped'])
+    scale = 150 if currency == 'JPY' else 2 if currency == 'INR' else 1
+    day = date(2023, 1, 1) + timedelta(days=rng.randrange(1000))
+    date_format = rng.choice(DATE_FORMATS)
+
+    def money(value):
+        text = format_amount(value, places, style)
+        return f'{text} {symbol}' if symbol == currency or (style == 'european' and rng.random() < 0.5) \
+            else f'{symbol}{text}'
+
+    lines = [merchant, f'{rng.randint(1, 999)} {rng.choice(["Market St", "High Road", "MG Road", "Rue Neuve"])}',
+             f'Date: {day.strftime(date_format)}', '']
+    subtotal = 0
+    for name in rng.sample(items, rng.randint(1, min(4, len(items)))):
+        price = round(rng.uniform(2, 400) * scale, places)
+        subtotal += price
+        lines.append(f'{name:<24}{money(price):>12}')
+    tax = round(subtotal * rng.choice([0, 0.05, 0.08, 0.18]), places)
+    total = round(subtotal + tax, places)
+    lines += ['', f'{"Subtotal":<24}{money(subtotal):>12}', f'{"Tax":<24}{money(tax):>12}',
+              f'{"TOTAL":<24}{money(total):>12}', '', 'Thank you for your visit!']
+    truth = {
+        'merchant': merchant,
+        'amount': f'{total:.{places}f}',
+        'currency': currency,
+        'date': day.isoformat(),
+        'category': category,
+        'date_format': date_format,
+        'amount_style': style,
+        'symbol': symbol,
+    }
+    return truth, lines
+
+
+def _drawable(text, font):
+    """Replace characters a bitmap font can't draw with their currency codes"""
+    if font is not None:
+        return text
+    for symbol, code in (('€', 'EUR'), ('₹', 'INR')):
+        text = text.replace(symbol, code)
+    return text
+
+
+def render_receipt(lines, rng, font_path=None, width=None):
+    """Draw the lines on a paper-coloured image and degrade it; returns (image, rendering details)"""
+    from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+    width = width or rng.choice([360, 480, 640, 900])
+    size = max(10, int(width / rng.uniform(22, 30)))
+    font = ImageFont.truetype(font_path, size) if font_path else None
+    bitmap = ImageFont.load_default()
+    # The bitmap font is about 11px high, so it is drawn small and scaled up to the chosen size
+    draw_font, zoom = (font, 1) if font else (bitmap, max(1, round(size / 11)))
+    line_height = int(size * 1.35) if font else 14
+    margin = max(6, width // (20 * zoom))
+    paper = rng.randint(225, 255)
+
+    canvas = Image.new('L', (width // zoom, line_height * (len(lines) + 2) + margin * 2), paper)
+    draw = ImageDraw.Draw(canvas)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), _drawable(line, font), fill=rng.randint(0, 60),
+                  font=draw_font)
+    image = canvas.resize((canvas.width * zoom, canvas.height * zoom), Image.Resampling.NEAREST) if zoom > 1 \
+        else canvas
+
+    noise = rng.choice(['clean', 'blur', 'speckle', 'rotate', 'jpeg'])
+    if noise == 'blur':
+        image = image.filter(ImageFilter.GaussianBlur(rng.uniform(0.6, 1.4)))
+    elif noise == 'speckle':
+        grain = Image.effect_noise(image.size, rng.uniform(20, 45))
+        image = Image.blend(image, grain, rng.uniform(0.15, 0.3))
+    elif noise == 'rotate':
+        image = image.rotate(rng.uniform(-3, 3), resample=Image.Resampling.BICUBIC, expand=True, fillcolor=paper)
+    return image.convert('RGB'), {'font': os.path.basename(font_path) if font_path else 'bitmap',
+                                  'font_size': size, 'width': image.width, 'noise': noise}
+
+
+def generate_corpus(directory, count=100, seed=7, fonts=None):
+    """Write `count` receipts and their manifest to `directory`; returns the manifest entries"""
+    rng = random.Random(seed)
+    fonts = find_fonts() if fonts is None else fonts
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    for i in range(count):
+        truth, lines = receipt_content(rng)
+        image, details = render_receipt(lines, rng, rng.choice(fonts) if fonts else None)
+        extension = 'jpg' if details['noise'] == 'jpeg' else 'png'
+        filename = f'receipt-{i:04d}.{extension}'
+        if extension == 'jpg':
+            image.save(os.path.join(directory, filename), quality=rng.randint(25, 50))
+        else:
+            image.save(os.path.join(directory, filename))
+        entries.append(dict(truth, **details, file=filename, text='\n'.join(lines)))
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump({'seed': seed, 'receipts': entries}, f, indent=1, ensure_ascii=False)
+    return entries
+
+
+def load_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)['receipts']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--out', default='receipts-corpus')
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    entries = generate_corpus(args.out, args.count, args.seed)
+    fonts = sorted({entry['font'] for entry in entries})
+    print(f"Wrote {len(entries)} receipts to {args.out} using {len(fonts)} font(s): {', '.join(fonts)}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+"""
+Load-test runner: boots mocks (and optionally the app), then drives virtual users
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from loadtest.journeys import JourneyError, VirtualUser, seed_company
+from loadtest.mock_services import MockCountriesAPI, MockExchangeRateAPI
+from loadtest.stats import LatencyRecorder
+
+
+def start_app_server(countries_url, exchange_rate_url, host='127.0.0.1', port=0, database_url=None):
+    """
+    Serve the app in-process against the given mock service URLs.
+
+    Configuration is read from the environment when the app is imported, so
+    this must run before anything else imports ``extensions``.
+    """
+    if database_url is None:
+        db_dir = tempfile.mkdtemp(prefix='expense-loadtest-')
+        database_url = f"sqlite:///{os.path.join(db_dir, 'loadtest.db')}"
+
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['COUNTRIES_API_URL'] = countries_url
+    os.environ['EXCHANGE_RATE_API_URL'] = exchange_rate_url
+    os.environ['OCR_FORCE_MOCK'] = '1'
+    # Every simulated user connects from this one address
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    from app import app, db
+
+    with app.app_context():
+        db.create_all()
+    return serve_app(app, host, port)
+
+
+def serve_app(app, host='127.0.0.1', port=0):
+    """Serve an app with a threaded WSGI server in a background thread; returns (server, base URL)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server(host, port, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def run_virtual_user(base_url, recorder, employee_email, chain, iterations, with_ocr):
+    """One virtual user: submit expenses and push each through the approval chain"""
+    employee = VirtualUser(base_url, recorder, email=employee_email)
+    approvers = [(VirtualUser(base_url, recorder, email=email), name) for email, name in chain]
+
+    employee.login()
+    for approver, _ in approvers:
+        approver.login()
+
+    completed = 0
+    failures = []
+    for _ in range(iterations):
+        try:
+            expense_id = employee.submit_expense(with_ocr=with_ocr)
+            employee.open_expense_detail(expense_id)
+            for approver, name in approvers:
+                approver.approve_ready(expense_id, name)
+            completed += 1
+        except JourneyError as e:
+            failures.append(str(e))
+    return completed, failures
+
+
+def run_load_test(base_url, users=10, iterations=5, levels=3, with_ocr=True, recorder=None):
+    """Seed one company with `users` employees and run them concurrently"""
+    recorder = recorder or LatencyRecorder()
+    # Seeding is setup, not load: keep its timings out of the report
+    _, chain, employees = seed_company(base_url, LatencyRecorder(), employees=users, levels=levels)
+
+    recorder.start()
+    completed = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=users) as executor:
+        futures = [
+            executor.submit(run_virtual_user, base_url, recorder, email, chain, iterations, with_ocr)
+            for email in employees
+        ]
+        for future in as_completed(futures):
+            done, errors = future.result()
+            completed += done
+            failures.extend(errors)
+    recorder.finish()
+
+    return recorder, completed, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline load test for the Expense Management System')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=5, help='expenses submitted per virtual user')
+    parser.add_argument('--levels', type=int, default=3, help='approval levels above each employee')
+    parser.add_argument('--no-ocr', action='store_true', help='skip the receipt scan step')
+    parser.add_argument('--target', help='base URL of an already running app (otherwise one is started)')
+    parser.add_argument('--database-url', help='database for the in-process app (default: temporary SQLite file)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='mock upstream latency')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random extra mock latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of mock calls that fail')
+    parser.add_argument('--seed', type=int, help='random seed for repeatable runs')
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    mock_options = dict(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        failure_rate=args.failure_rate, seed=args.seed)
+    with MockCountriesAPI(**mock_options) as countries, MockExchangeRateAPI(**mock_options) as rates:
+        server = None
+        if args.target:
+            base_url = args.target
+            print("Using running app; start it with:")
+            print(f"  COUNTRIES_API_URL={countries.api_url}")
+            print(f"  EXCHANGE_RATE_API_URL={rates.api_url}")
+            print("  OCR_FORCE_MOCK=1")
+        else:
+            server, base_url = start_app_server(countries.api_url, rates.api_url, database_url=args.database_url)
+            print(f"Started app at {base_url}")
+
+        try:
+            recorder, completed, failures = run_load_test(
+                base_url, users=args.users, iterations=args.iterations,
+                levels=args.levels, with_ocr=not args.no_ocr
+            )
+        finally:
+            if server is not None:
+                server.shutdown()
+
+        print()
+        print(recorder.format_report())
+        print()
+        print(f"Journeys completed: {completed}/{args.users * args.iterations}")
+        print(f"Mock countries API: {countries.request_count} calls, {countries.failure_count} injected failures")
+        print(f"Mock exchange API: {rates.request_count} calls, {rates.failure_count} injected failures")
+        if failures:
+            print(f"\nFirst failures ({len(failures)} total):")
+            for failure in failures[:10]:
+                print(f"  - {failure}")
+
+    return 0 if not failures else 1
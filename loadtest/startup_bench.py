@@ -0,0 +1,100 @@
+"""
+Cold-start benchmark: import, create_app() and the first request, in fresh interpreters
+
+Each run starts a new Python process that imports ``app``, builds the app
+with ``create_app()`` and serves ``GET /login`` through the test client,
+timing each step. It also reports any OCR or HTTP modules loaded by then;
+those should only be imported when a receipt is scanned or an upstream API
+is called. Exits non-zero when the median total exceeds ``--budget-ms`` or
+a deferred module was loaded, so CI can fail on regressions.
+
+Usage:
+    python -m loadtest.startup_bench --runs 5 --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Modules that must not be imported before they are needed
+DEFERRED_MODULES = ('pytesseract', 'PIL', 'ocr_utils', 'requests', 'urllib3')
+DEFAULT_BUDGET_MS = 1500
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+response = app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - started) * 1000,
+    'create_ms': (created - imported) * 1000,
+    'first_request_ms': (served - created) * 1000,
+    'total_ms': (served - started) * 1000,
+    'deferred_loaded': [name for name in %r if name in sys.modules],
+}))
+''' % (DEFERRED_MODULES,)
+
+
+def probe_once(env=None):
+    """Time one cold start in a fresh interpreter; returns the probe's measurements"""
+    db_dir = tempfile.mkdtemp(prefix='expense-startup-')
+    child_env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(db_dir, 'startup.db')}")
+    child_env.update(env or {})
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=PROJECT_ROOT, env=child_env,
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run(runs, env=None):
+    samples = [probe_once(env) for _ in range(runs)]
+    summary = {
+        key: statistics.median(sample[key] for sample in samples)
+        for key in ('import_ms', 'create_ms', 'first_request_ms', 'total_ms')
+    }
+    summary['deferred_loaded'] = sorted({name for sample in samples for name in sample['deferred_loaded']})
+    summary['statuses'] = sorted({sample['status'] for sample in samples})
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float,
+                        default=float(os.environ.get('STARTUP_BUDGET_MS', DEFAULT_BUDGET_MS)),
+                        help='fail if the median import-to-first-request time is above this')
+    args = parser.parse_args(argv)
+
+    summary = run(args.runs)
+    print(f"Cold start, median of {args.runs} runs")
+    for key in ('import_ms', 'create_ms', 'first_request_ms', 'total_ms'):
+        print(f"  {key[:-3]:<14} {summary[key]:8.1f} ms")
+
+    failed = False
+    if summary['total_ms'] > args.budget_ms:
+        print(f"FAIL: {summary['total_ms']:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if summary['deferred_loaded']:
+        print(f"FAIL: loaded at startup: {', '.join(summary['deferred_loaded'])}")
+        failed = True
+    if summary['statuses'] != [200]:
+        print(f"FAIL: first request returned {summary['statuses']}")
+        failed = True
+    if not failed:
+        print(f"OK: within the {args.budget_ms:.0f} ms budget")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,87 @@
+"""
+Latency and throughput bookkeeping for load-test runs
+"""
+
+import math
+import threading
+import time
+from collections import defaultdict
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class LatencyRecorder:
+    """Thread-safe collector of per-route request timings"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+        self._errors = defaultdict(int)
+        self.started_at = None
+        self.finished_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+
+    def record(self, route, elapsed, ok=True):
+        with self._lock:
+            self._samples[route].append(elapsed)
+            if not ok:
+                self._errors[route] += 1
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return 0.0
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def summary(self):
+        """Per-route counts, error counts, throughput and p50/p95/p99 in milliseconds"""
+        duration = self.duration or 1e-9
+        with self._lock:
+            routes = {route: sorted(samples) for route, samples in self._samples.items()}
+            errors = dict(self._errors)
+
+        rows = []
+        for route, samples in sorted(routes.items()):
+            rows.append({
+                'route': route,
+                'requests': len(samples),
+                'errors': errors.get(route, 0),
+                'throughput': len(samples) / duration,
+                'p50_ms': percentile(samples, 50) * 1000,
+                'p95_ms': percentile(samples, 95) * 1000,
+                'p99_ms': percentile(samples, 99) * 1000,
+            })
+        return rows
+
+    def format_report(self):
+        rows = self.summary()
+        total = sum(row['requests'] for row in rows)
+        total_errors = sum(row['errors'] for row in rows)
+
+        lines = [
+            f"{'Route':<40} {'Reqs':>7} {'Errs':>6} {'Req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+            '-' * 94,
+        ]
+        for row in rows:
+            lines.append(
+                f"{row['route']:<40} {row['requests']:>7} {row['errors']:>6} {row['throughput']:>8.1f} "
+                f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+            )
+        lines.append('-' * 94)
+        lines.append(
+            f"Total: {total} requests, {total_errors} errors in {self.duration:.1f}s "
+            f"({total / (self.duration or 1e-9):.1f} req/s)"
+        )
+        return '\n'.join(lines)
@@ -27,6 +27,11 @@ class Company(db.Model):
     name = db.Column(db.String(100), nullable=False)
     country = db.Column(db.String(50), nullable=False)
     currency = db.Column(db.String(3), nullable=False)
+    # Hours an approver has before an approval escalates; None uses APPROVAL_SLA_HOURS, 0 disables
+    approval_sla_hours = db.Column(db.Integer)
+    # Dedicated database (a TENANT_DATABASE_URLS name); None is the shared one. Locked while moving.
+    database_name = db.Column(db.String(50))
+    database_locked = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     users = db.relationship('User', backref='company', lazy=True)
@@ -48,7 +53,7 @@ class User(UserMixin, db.Model):
     subordinates = db.relationship('User', backref=db.backref('manager', remote_side=[id]))
     
     submitted_expenses = db.relationship('Expense', foreign_keys='Expense.employee_id', backref='employee', lazy=True)
-    approvals = db.relationship('Approval', backref='approver', lazy=True)
+    approvals = db.relationship('Approval', foreign_keys='Approval.approver_id', backref='approver', lazy=True)
 
     @property
     def full_name(self):
@@ -64,6 +69,8 @@ class ExpenseCategory(db.Model):
     expenses = db.relationship('Expense', backref='category', lazy=True)
 
 class Expense(db.Model):
+    archived = False
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -73,7 +80,10 @@ class Expense(db.Model):
     exchange_rate = db.Column(db.Numeric(10, 6))
     expense_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.Enum(ExpenseStatus), default=ExpenseStatus.DRAFT)
-    receipt_filename = db.Column(db.String(255))
+    receipt_filename = db.Column(db.String(255), index=True)
+    merchant = db.Column(db.String(200))
+    ocr_text = db.Column(db.Text)
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('expense.id'))
     
     employee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
@@ -83,6 +93,9 @@ class Expense(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     approvals = db.relationship('Approval', backref='expense', lazy=True, cascade='all, delete-orphan')
+    fingerprints = db.relationship('ExpenseFingerprint', backref='expense', lazy=True, cascade='all, delete-orphan')
+    steps = db.relationship('ApprovalStep', backref='expense', lazy=True, cascade='all, delete-orphan',
+                            order_by='ApprovalStep.sequence')
 
 class ApprovalRule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -116,8 +129,29 @@ class Approval(db.Model):
     comments = db.Column(db.Text)
     sequence = db.Column(db.Integer, nullable=False)
     approved_at = db.Column(db.DateTime)
+    # Set while pending in an active step; escalates to the approver's manager once passed
+    due_at = db.Column(db.DateTime, index=True)
+    escalated_from_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class ApprovalStep(db.Model):
+    """Decision counters for the approvals sharing one sequence number of an expense"""
+    id = db.Column(db.Integer, primary_key=True)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False)
+    sequence = db.Column(db.Integer, nullable=False)
+    rule_id = db.Column(db.Integer, db.ForeignKey('approval_rule.id'))
+    status = db.Column(db.String(20), nullable=False, default='waiting')  # waiting, active, approved, rejected, skipped
+    total = db.Column(db.Integer, nullable=False)
+    required = db.Column(db.Integer, nullable=False)
+    approved_count = db.Column(db.Integer, nullable=False, default=0)
+    rejected_count = db.Column(db.Integer, nullable=False, default=0)
+    # HYBRID rules: this approver's approval alone closes the step
+    specific_approver_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    specific_status = db.Column(db.String(20))
+    closed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.UniqueConstraint('expense_id', 'sequence', name='uq_approval_step_sequence'),)
+
 class CurrencyRate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     from_currency = db.Column(db.String(3), nullable=False)
@@ -127,3 +161,131 @@ class CurrencyRate(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     __table_args__ = (db.UniqueConstraint('from_currency', 'to_currency', 'date'),)
+
+class CurrencyConversionJob(db.Model):
+    """Background re-denomination of a company's expenses after its base currency changes"""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False, index=True)
+    from_currency = db.Column(db.String(3), nullable=False)
+    to_currency = db.Column(db.String(3), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    last_expense_id = db.Column(db.Integer, nullable=False, default=0)
+    processed_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    worker_id = db.Column(db.String(64))
+    heartbeat_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+    @property
+    def progress(self):
+        if not self.total_count:
+            return 100 if self.status == 'completed' else 0
+        return min(100, int(self.processed_count * 100 / self.total_count))
+
+class NotificationOutbox(db.Model):
+    """Email notification written in the same transaction as the change it reports"""
+    id = db.Column(db.Integer, primary_key=True)
+    recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_notification_outbox_due', 'status', 'next_attempt_at'),)
+
+    @property
+    def data(self):
+        return json.loads(self.payload)
+
+class ExpenseFingerprint(db.Model):
+    """Hashed receipt/field fingerprint used to spot duplicate submissions"""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)
+    value = db.Column(db.String(64), nullable=False)
+    detail = db.Column(db.String(64))
+
+    __table_args__ = (db.Index('ix_expense_fingerprint_lookup', 'company_id', 'value'),)
+
+class ExpenseEvent(db.Model):
+    """Append-only log of expense and approval status transitions; the id is the consumer offset"""
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, nullable=False, index=True)
+    # No foreign keys: history outlives the expense and approval rows it describes
+    expense_id = db.Column(db.Integer, nullable=False, index=True)
+    approval_id = db.Column(db.Integer)
+    actor_id = db.Column(db.Integer)
+    kind = db.Column(db.String(30), nullable=False)
+    from_status = db.Column(db.String(20))
+    to_status = db.Column(db.String(20))
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    @property
+    def data(self):
+        return json.loads(self.payload) if self.payload else {}
+
+class EventConsumerOffset(db.Model):
+    """Last ExpenseEvent id processed by a named consumer"""
+    consumer = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+def _archive_columns(model, foreign_keys=None, indexed=()):
+    """
+    Copies of a live table's columns for its archive table, plus archived_at.
+    `foreign_keys` maps a column name to a new target, or None to drop its key.
+    """
+    foreign_keys = foreign_keys or {}
+    columns = []
+    for column in model.__table__.columns:
+        if column.name in foreign_keys:
+            targets = [foreign_keys[column.name]] if foreign_keys[column.name] else []
+        else:
+            targets = [fk.target_fullname for fk in column.foreign_keys]
+        columns.append(db.Column(
+            column.name, column.type.copy(), *[db.ForeignKey(target) for target in targets],
+            primary_key=column.primary_key, nullable=column.nullable, autoincrement=False,
+            index=column.name in indexed
+        ))
+    columns.append(db.Column('archived_at', db.DateTime, nullable=False))
+    return columns
+
+class ArchivedExpense(db.Model):
+    """Finalized expense moved out of the live table; same columns as Expense plus archived_at"""
+    __table__ = db.Table('expense_archive', db.metadata, *_archive_columns(
+        Expense, {'duplicate_of_id': None}, indexed=('employee_id', 'company_id', 'created_at', 'receipt_filename')
+    ))
+    archived = True
+
+    employee = db.relationship('User')
+    company = db.relationship('Company')
+    category = db.relationship('ExpenseCategory')
+    approvals = db.relationship('ArchivedApproval', backref='expense', lazy=True)
+    steps = db.relationship('ArchivedApprovalStep', lazy=True, order_by='ArchivedApprovalStep.sequence')
+
+class ArchivedApproval(db.Model):
+    __table__ = db.Table('approval_archive', db.metadata, *_archive_columns(
+        Approval, {'expense_id': 'expense_archive.id'}, indexed=('expense_id',)
+    ))
+
+    approver = db.relationship('User', foreign_keys='ArchivedApproval.approver_id')
+
+class ArchivedApprovalStep(db.Model):
+    __table__ = db.Table('approval_step_archive', db.metadata, *_archive_columns(
+        ApprovalStep, {'expense_id': 'expense_archive.id'}, indexed=('expense_id',)
+    ))
+
+class ArchivedExpenseFingerprint(db.Model):
+    __table__ = db.Table('expense_fingerprint_archive', db.metadata, *_archive_columns(
+        ExpenseFingerprint, {'expense_id': 'expense_archive.id'}, indexed=('expense_id',)
+    ))
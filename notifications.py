@@ -0,0 +1,265 @@
+"""
+Email notifications through a transactional outbox
+
+Views call ``enqueue_notification`` inside the transaction that changes an
+approval, so a notification row exists exactly when the change commits and
+no request ever waits on SMTP. The ``flask notifications-dispatch`` worker
+drains due rows in batches, sends one digest per recipient covering all of
+their pending items, retries failures with exponential backoff and moves
+rows that keep failing to the ``dead`` status.
+"""
+
+import json
+import smtplib
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import click
+from flask import current_app
+from sqlalchemy import or_
+
+from extensions import db
+from models import NotificationOutbox, User
+
+SUBJECTS = {
+    'approval.activated': 'Expense waiting for your approval',
+    'expense.status': 'Expense status changed',
+}
+
+
+def enqueue_notification(session, recipient_id, kind, **data):
+    """
+    Add an outbox row to the session's current transaction.
+
+    Rows only become due after NOTIFY_DIGEST_SECONDS so that a burst of
+    changes for one recipient goes out as a single digest.
+    """
+    delay = current_app.config.get('NOTIFY_DIGEST_SECONDS', 0)
+    session.add(NotificationOutbox(
+        recipient_id=recipient_id,
+        kind=kind,
+        payload=json.dumps(data),
+        next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+    ))
+
+
+def describe(kind, data):
+    """One line of digest text for an outbox item"""
+    title = data.get('title', f"Expense #{data.get('expense_id')}")
+    if kind == 'approval.activated' and data.get('escalated_from'):
+        return f'"{title}" was escalated to you after waiting on {data["escalated_from"]}.'
+    if kind == 'approval.activated':
+        return f'"{title}" is waiting for your approval.'
+    if kind == 'expense.status':
+        return f'"{title}" is now {data.get("status", "").replace("_", " ")}.'
+    return f'"{title}": {kind}'
+
+
+def build_digest(recipient, items, sender_address):
+    """One email covering every (kind, data) item for a recipient"""
+    message = EmailMessage()
+    message['From'] = sender_address
+    message['To'] = recipient.email
+    if len(items) == 1:
+        message['Subject'] = SUBJECTS.get(items[0][0], 'Expense update')
+    else:
+        message['Subject'] = f'{len(items)} expense updates'
+
+    lines = [f'Hello {recipient.first_name},', '']
+    lines += [f'- {describe(kind, data)}' for kind, data in items]
+    lines += ['', 'Sign in to Expense Management to review them.']
+    message.set_content('\n'.join(lines))
+    return message
+
+
+def retry_delay(attempts, base_seconds, max_seconds=3600):
+    """Exponential backoff after the given number of failed attempts"""
+    return min(max_seconds, base_seconds * 2 ** max(0, attempts - 1))
+
+
+class SmtpSender:
+    """Sends messages over one SMTP connection per batch"""
+
+    def __init__(self, host='localhost', port=25, username=None, password=None, use_tls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def send(self, message):
+        if self._connection is None:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password)
+            self._connection = connection
+        try:
+            self._connection.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            self._connection = None
+            raise
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._connection = None
+
+
+def sender_from_config(config):
+    return SmtpSender(
+        host=config['SMTP_HOST'],
+        port=config['SMTP_PORT'],
+        username=config.get('SMTP_USERNAME'),
+        password=config.get('SMTP_PASSWORD'),
+        use_tls=config.get('SMTP_USE_TLS', False),
+    )
+
+
+def claim_batch(batch_size, lease_seconds):
+    """
+    Lock up to batch_size due rows for this dispatcher, plus the same
+    recipients' other not-yet-due first attempts so they join the digest.
+    Safe with several dispatchers running.
+    """
+    now = datetime.utcnow()
+    unlocked = or_(NotificationOutbox.locked_until.is_(None), NotificationOutbox.locked_until < now)
+    due = db.session.query(NotificationOutbox.id, NotificationOutbox.recipient_id).filter(
+        NotificationOutbox.status == 'pending',
+        NotificationOutbox.next_attempt_at <= now,
+        unlocked
+    ).order_by(NotificationOutbox.recipient_id, NotificationOutbox.id).limit(batch_size).all()
+    if not due:
+        return []
+
+    ids = {row_id for row_id, _ in due}
+    ids.update(row_id for (row_id,) in db.session.query(NotificationOutbox.id).filter(
+        NotificationOutbox.recipient_id.in_({recipient_id for _, recipient_id in due}),
+        NotificationOutbox.status == 'pending',
+        NotificationOutbox.attempts == 0,
+        unlocked
+    ))
+
+    token = uuid.uuid4().hex
+    NotificationOutbox.query.filter(NotificationOutbox.id.in_(ids), unlocked).update({
+        'locked_until': now + timedelta(seconds=lease_seconds),
+        'claim_token': token,
+    }, synchronize_session=False)
+    db.session.commit()
+    return NotificationOutbox.query.filter_by(claim_token=token).order_by(NotificationOutbox.id).all()
+
+
+def dispatch_batch(sender, batch_size=None):
+    """
+    Send one batch of due notifications as per-recipient digests.
+
+    Returns (sent, failed) counts of outbox rows.
+    """
+    config = current_app.config
+    rows = claim_batch(batch_size or config['NOTIFY_BATCH_SIZE'], config['NOTIFY_LEASE_SECONDS'])
+    if not rows:
+        return 0, 0
+
+    by_recipient = defaultdict(list)
+    for row in rows:
+        by_recipient[row.recipient_id].append(row)
+    recipients = {user.id: user for user in User.query.filter(User.id.in_(by_recipient)).all()}
+
+    sent = failed = 0
+    now = datetime.utcnow()
+    for recipient_id, items in by_recipient.items():
+        recipient = recipients.get(recipient_id)
+        try:
+            if recipient is None or not recipient.is_active:
+                raise ValueError(f'Recipient {recipient_id} no longer exists or is inactive')
+            sender.send(build_digest(recipient, [(row.kind, row.data) for row in items], config['MAIL_FROM']))
+        except (smtplib.SMTPException, OSError, ValueError) as e:
+            print(f"Error sending notifications to user {recipient_id}: {e}")
+            for row in items:
+                row.attempts += 1
+                row.last_error = str(e)[:1000]
+                if row.attempts >= config['NOTIFY_MAX_ATTEMPTS'] or isinstance(e, ValueError):
+                    row.status = 'dead'
+                else:
+                    row.next_attempt_at = now + timedelta(
+                        seconds=retry_delay(row.attempts, config['NOTIFY_RETRY_BASE_SECONDS'])
+                    )
+            failed += len(items)
+        else:
+            for row in items:
+                row.status = 'sent'
+                row.sent_at = now
+                row.attempts += 1
+            sent += len(items)
+        for row in items:
+            row.locked_until = None
+            row.claim_token = None
+        # Commit per recipient so a crash can't resend digests that already went out
+        db.session.commit()
+
+    return sent, failed
+
+
+def dispatch_pending(sender, max_batches=None):
+    """Drain every due notification; returns total (sent, failed)"""
+    totals = [0, 0]
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        sent, failed = dispatch_batch(sender)
+        if not sent and not failed:
+            break
+        totals[0] += sent
+        totals[1] += failed
+        batches += 1
+    return tuple(totals)
+
+
+def requeue_dead(recipient_id=None):
+    """Give dead-lettered notifications a fresh set of attempts"""
+    query = NotificationOutbox.query.filter_by(status='dead')
+    if recipient_id is not None:
+        query = query.filter_by(recipient_id=recipient_id)
+    count = query.update({
+        'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow(), 'last_error': None,
+    }, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def init_notifications(app):
+    @app.cli.command('notifications-dispatch')
+    @click.option('--interval', type=float, default=0, help='Keep dispatching every N seconds')
+    def dispatch_command(interval):
+        """Send pending notification digests from the outbox"""
+        with app.app_context():
+            while True:
+                with sender_from_config(app.config) as sender:
+                    sent, failed = dispatch_pending(sender)
+                if sent or failed or not interval:
+                    print(f"Sent {sent} notifications, {failed} failed")
+                db.session.remove()
+                if not interval:
+                    break
+                time.sleep(interval)
+
+    @app.cli.command('notifications-requeue-dead')
+    @click.option('--user-id', type=int, default=None)
+    def requeue_command(user_id):
+        """Retry dead-lettered notifications"""
+        with app.app_context():
+            print(f"Requeued {requeue_dead(user_id)} notifications")
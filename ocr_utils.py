@@ -238,8 +238,11 @@ class MockReceiptOCR:
         }
 
 # Factory function to get appropriate OCR instance
-def get_ocr_instance():
+def get_ocr_instance(force_mock=False):
     """Get OCR instance based on availability of tesseract"""
+    if force_mock:
+        return MockReceiptOCR()
+    
     try:
         # Try to import and use real OCR
         import pytesseract
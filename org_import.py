@@ -0,0 +1,320 @@
+"""
+Bulk org-chart import
+
+Imports a company's users from a CSV or JSON org chart in one transaction.
+Managers are referenced by email and may be other rows in the same file or
+existing users of the company. The reporting graph is checked for unknown
+managers and cycles in a single O(n) walk, users are inserted level by level
+so every manager row exists before its reports, and the slow PBKDF2
+password hashing is spread across a process pool. Web uploads share one
+long-lived pool per app, so a request never pays for starting processes
+after the first import.
+"""
+
+import csv
+import io
+import json
+import multiprocessing
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from sqlalchemy import func, insert
+from werkzeug.security import generate_password_hash
+
+from extensions import db
+from fragment_cache import bump_company_version
+from models import Company, User, UserRole
+from tenancy import mirror_company
+
+FIELDS = ('email', 'first_name', 'last_name', 'role', 'manager_email', 'password')
+REQUIRED_FIELDS = ('email', 'first_name', 'last_name')
+MANAGER_ROLES = (UserRole.MANAGER, UserRole.ADMIN)
+
+
+class ImportFormatError(ValueError):
+    """The uploaded file could not be read as an org chart"""
+
+
+def parse_org_chart(content, filename=''):
+    """
+    Read org-chart rows from CSV or JSON text.
+
+    JSON may be a list of user objects or ``{"users": [...]}``. Returns a list
+    of dicts with FIELDS keys, numbered from 1 in `row`.
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    if filename.lower().endswith('.json') or content.lstrip().startswith(('[', '{')):
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise ImportFormatError(f'Invalid JSON: {e}') from e
+        if isinstance(data, dict):
+            data = data.get('users')
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise ImportFormatError('JSON org chart must be a list of user objects')
+        records = data
+    else:
+        reader = csv.DictReader(io.StringIO(content))
+        if not reader.fieldnames or 'email' not in [name.strip().lower() for name in reader.fieldnames]:
+            raise ImportFormatError('CSV org chart needs a header row with at least an email column')
+        records = [{(key or '').strip().lower(): value for key, value in record.items()} for record in reader]
+
+    rows = []
+    for number, record in enumerate(records, start=1):
+        row = {field: str(record.get(field) or '').strip() for field in FIELDS}
+        row['email'] = row['email'].lower()
+        row['manager_email'] = row['manager_email'].lower()
+        row['row'] = number
+        rows.append(row)
+    return rows
+
+
+def order_by_hierarchy(rows, known_managers, failed=()):
+    """
+    Group valid rows into insert levels and report broken reporting lines.
+
+    `known_managers` maps existing manager emails to their user ids and
+    `failed` holds emails of rows already rejected. A row whose manager is
+    neither in the file nor known is an orphan; rows whose manager chain
+    loops back on itself are a cycle; rows reporting (directly or not) to a
+    broken row fail too. Each row is visited once, so this is O(n).
+    Returns (levels, errors) where levels[0] reports to existing users
+    or nobody, levels[1] to rows in levels[0], and so on.
+    """
+    by_email = {row['email']: row for row in rows}
+    depth = {}
+    errors = {}
+
+    for start in rows:
+        path = []
+        on_path = set()
+        email = start['email']
+
+        # Walk up the manager chain until reaching a resolved row, a root or a problem
+        while email not in depth and email not in errors:
+            if email in on_path:
+                cycle = path[path.index(email):]
+                for member in cycle:
+                    errors[member] = f"Reporting cycle: {' -> '.join(cycle + [email])}"
+                break
+            path.append(email)
+            on_path.add(email)
+            manager_email = by_email[email]['manager_email']
+            if not manager_email or (manager_email in known_managers and manager_email not in by_email):
+                depth[email] = 0
+                break
+            if manager_email in failed:
+                errors[email] = f'Manager {manager_email} could not be imported'
+                break
+            if manager_email not in by_email:
+                errors[email] = f'Unknown manager {manager_email}'
+                break
+            email = manager_email
+
+        # Unwind: every row below the stopping point inherits its result
+        for below in reversed(path):
+            if below in depth or below in errors:
+                continue
+            manager_email = by_email[below]['manager_email']
+            if manager_email in errors:
+                errors[below] = f'Manager {manager_email} could not be imported'
+            else:
+                depth[below] = depth[manager_email] + 1
+
+    levels = []
+    for row in rows:
+        if row['email'] in depth:
+            level = depth[row['email']]
+            while len(levels) <= level:
+                levels.append([])
+            levels[level].append(row)
+    return levels, errors
+
+
+class PasswordHashers:
+    """Process pool kept for the app's lifetime; started on first use so processes that never import skip it"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned rather than forked: forking a threaded web worker copies locks other threads hold
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def map(self, passwords, chunksize=16):
+        return list(self.pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def hash_passwords(passwords, workers=None, chunksize=16, hashers=None):
+    """Hash passwords in `hashers`, or a pool of its own; small batches are hashed inline"""
+    if workers == 0 or len(passwords) < chunksize:
+        return [generate_password_hash(password) for password in passwords]
+    if hashers is not None:
+        return hashers.map(passwords, chunksize=chunksize)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(generate_password_hash, passwords, chunksize=chunksize))
+
+
+def _validate_rows(rows, company_id):
+    """Per-row field, role and duplicate checks; returns ({email: error}, existing manager ids)"""
+    errors = {}
+    seen = set()
+    for row in rows:
+        missing = [field for field in REQUIRED_FIELDS if not row[field]]
+        if missing:
+            errors[row['email'] or f"row {row['row']}"] = f"Missing {', '.join(missing)}"
+            continue
+        if '@' not in row['email']:
+            errors[row['email']] = 'Invalid email'
+            continue
+        if row['email'] in seen:
+            errors[row['email']] = 'Email appears more than once in the file'
+            continue
+        seen.add(row['email'])
+        try:
+            row['role'] = UserRole(row['role'].lower() or UserRole.EMPLOYEE.value)
+        except ValueError:
+            errors[row['email']] = f"Unknown role {row['role']}"
+        if row['manager_email'] == row['email']:
+            errors[row['email']] = 'User cannot be their own manager'
+
+    emails = [row['email'] for row in rows if row['email']]
+    for (email,) in db.session.query(User.email).filter(func.lower(User.email).in_(emails)):
+        errors.setdefault(email.lower(), 'Email already registered')
+
+    manager_emails = {row['manager_email'] for row in rows if row['manager_email']}
+    known_managers = {}
+    not_managers = set()
+    for user_id, email, role in db.session.query(User.id, User.email, User.role).filter(
+        User.company_id == company_id, func.lower(User.email).in_(manager_emails)
+    ):
+        if role in MANAGER_ROLES:
+            known_managers[email.lower()] = user_id
+        else:
+            not_managers.add(email.lower())
+
+    by_email = {row['email']: row for row in rows}
+    for row in rows:
+        manager = by_email.get(row['manager_email'])
+        if row['manager_email'] in not_managers or (
+            manager is not None and isinstance(manager['role'], UserRole) and manager['role'] not in MANAGER_ROLES
+        ):
+            errors.setdefault(row['email'], f"Manager {row['manager_email']} is not a manager or admin")
+
+    return errors, known_managers
+
+
+def import_org_chart(rows, company_id, skip_invalid=False, workers=None):
+    """
+    Validate and insert org-chart rows for a company in one transaction.
+
+    With skip_invalid=False nothing is inserted if any row has an error.
+    Rows without a password get a random one, returned in the result so the
+    admin can pass it on. Passwords are hashed in the app's shared pool
+    unless `workers` asks for a pool of that size (0 hashes inline).
+    Returns a dict with `created`, `users` and `errors`.
+    """
+    errors, known_managers = _validate_rows(rows, company_id)
+    candidates = [row for row in rows if row['email'] and row['email'] not in errors]
+    levels, hierarchy_errors = order_by_hierarchy(candidates, known_managers, failed=set(errors))
+    errors.update(hierarchy_errors)
+
+    row_numbers = {}
+    for row in rows:
+        row_numbers.setdefault(row['email'] or f"row {row['row']}", row['row'])
+    result = {
+        'created': 0,
+        'users': [],
+        'errors': sorted(
+            ({'row': row_numbers.get(email), 'email': email, 'error': error} for email, error in errors.items()),
+            key=lambda item: item['row'] or 0
+        ),
+    }
+    if errors and not skip_invalid:
+        return result
+
+    ordered = [row for level in levels for row in level]
+    generated = {}
+    for row in ordered:
+        if not row['password']:
+            generated[row['email']] = row['password'] = secrets.token_urlsafe(12)
+    hashers = None
+    if workers is None:
+        workers, hashers = current_app.config.get('IMPORT_HASH_WORKERS'), current_app.extensions['import_hashers']
+    hashes = dict(zip(
+        (row['email'] for row in ordered),
+        hash_passwords([row['password'] for row in ordered], workers=workers, hashers=hashers)
+    ))
+
+    ids = dict(known_managers)
+    try:
+        for level in levels:
+            inserted = db.session.execute(insert(User).returning(User.id, User.email), [{
+                'email': row['email'],
+                'password_hash': hashes[row['email']],
+                'first_name': row['first_name'],
+                'last_name': row['last_name'],
+                'role': row['role'],
+                'company_id': company_id,
+                'manager_id': ids.get(row['manager_email']),
+                'is_active': True,
+            } for row in level])
+            ids.update({email: user_id for user_id, email in inserted})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    bump_company_version(company_id)
+    # The bulk INSERT bypasses the flush that refreshes a dedicated database's copies of the users
+    mirror_company(company_id)
+
+    for row in ordered:
+        user = {'row': row['row'], 'email': row['email'], 'user_id': ids[row['email']]}
+        if row['email'] in generated:
+            user['generated_password'] = generated[row['email']]
+        result['users'].append(user)
+    result['users'].sort(key=lambda user: user['row'])
+    result['created'] = len(ordered)
+    return result
+
+
+def init_org_import(app):
+    app.extensions['import_hashers'] = PasswordHashers(app.config.get('IMPORT_HASH_WORKERS') or None)
+
+    @app.cli.command('users-import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--company-id', type=int, required=True)
+    @click.option('--skip-invalid', is_flag=True, help='Import valid rows even if some rows have errors')
+    @click.option('--workers', type=int, default=None, help='Hashing processes (0 hashes inline)')
+    def import_users_command(path, company_id, skip_invalid, workers):
+        """Import users from a CSV or JSON org chart"""
+        with open(path, 'rb') as f:
+            rows = parse_org_chart(f.read(), path)
+        with app.app_context():
+            if db.session.get(Company, company_id) is None:
+                raise click.BadParameter(f'No company with id {company_id}', param_hint='--company-id')
+            result = import_org_chart(rows, company_id, skip_invalid=skip_invalid, workers=workers)
+        for error in result['errors']:
+            print(f"Row {error['row']} ({error['email']}): {error['error']}")
+        for user in result['users']:
+            if 'generated_password' in user:
+                print(f"{user['email']}: initial password {user['generated_password']}")
+        print(f"Imported {result['created']} of {len(rows)} users")
@@ -0,0 +1,278 @@
+"""
+Sampling profiler for production requests
+
+A fraction of requests (PROFILE_SAMPLE_RATE) is profiled at random, and a
+server operator can profile one specific request by sending the signed
+token from the Profiles page in the ``X-Profile-Token`` header. While a profiled
+request runs, a background thread records the request thread's stack every
+PROFILE_INTERVAL_MS. Requests that aren't profiled pay only for the
+sampling decision.
+
+Each profile is written to PROFILE_DIR in two forms: a speedscope file
+(open it at https://www.speedscope.app) and collapsed stacks for
+flamegraph.pl. A small summary is written next to them, and the
+Profiles page aggregates the summaries per endpoint. Only the newest
+PROFILE_MAX_FILES profiles are kept. Profiles cover every company, so the
+page is limited to the operators listed in PROFILE_ADMIN_EMAILS rather than
+company admins.
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+from flask_login import current_user
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+PROFILE_HEADER = 'X-Profile-Token'
+SUFFIXES = ('.speedscope.json', '.folded', '.summary.json')
+# Endpoints never profiled: static files and the profile pages themselves
+SKIPPED_ENDPOINTS = ('static', 'assets', 'admin.profiles', 'admin.profile_file')
+
+
+class StackSampler:
+    """Records the stacks of one thread from a background thread every `interval` seconds"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # tuple of frames, root first -> samples
+        self.started_at = self.stopped_at = None
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='request-profiler')
+
+    def _run(self):
+        own_file = __file__
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code.co_filename != own_file:
+                    stack.append((getattr(code, 'co_qualname', code.co_name), code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+        self.stopped_at = time.perf_counter()
+
+    @property
+    def duration_ms(self):
+        return ((self.stopped_at or time.perf_counter()) - self.started_at) * 1000
+
+    @property
+    def sample_count(self):
+        return sum(self.stacks.values())
+
+
+def frame_label(frame):
+    name, filename, line = frame
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def speedscope_document(sampler, name):
+    """The samples as a speedscope 'sampled' profile, one weighted sample per distinct stack"""
+    frames, index = [], {}
+    samples, weights = [], []
+    interval_ms = sampler.interval * 1000
+    for stack, count in sampler.stacks.most_common():
+        ids = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame[0], 'file': frame[1], 'line': frame[2]})
+            ids.append(index[frame])
+        samples.append(ids)
+        weights.append(count * interval_ms)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'expense-management',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+def collapsed_stacks(sampler):
+    """flamegraph.pl input: 'root;caller;callee samples' per distinct stack"""
+    return ''.join(
+        ';'.join(frame_label(frame).replace(';', ':') for frame in stack) + f' {count}\n'
+        for stack, count in sampler.stacks.most_common()
+    )
+
+
+def self_time(sampler, limit=15):
+    """[(frame label, samples)] for the frames most often at the top of the stack"""
+    leaves = Counter()
+    for stack, count in sampler.stacks.items():
+        leaves[frame_label(stack[-1])] += count
+    return leaves.most_common(limit)
+
+
+def write_profile(directory, sampler, summary, max_files=200):
+    """Write the speedscope, collapsed-stack and summary files; returns the file stem"""
+    os.makedirs(directory, exist_ok=True)
+    stem = '{}-{}-{}'.format(
+        datetime.utcnow().strftime('%Y%m%dT%H%M%S'),
+        summary['endpoint'].replace('.', '_'),
+        uuid.uuid4().hex[:8],
+    )
+    summary = dict(summary, name=stem, samples=sampler.sample_count, self_time=self_time(sampler))
+    contents = (
+        json.dumps(speedscope_document(sampler, f"{summary['method']} {summary['path']}")),
+        collapsed_stacks(sampler),
+        json.dumps(summary),
+    )
+    for suffix, content in zip(SUFFIXES, contents):
+        tmp = os.path.join(directory, f'.tmp-{stem}{suffix}')
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, os.path.join(directory, stem + suffix))
+    prune_profiles(directory, max_files)
+    return stem
+
+
+def prune_profiles(directory, max_files):
+    stems = sorted(name[:-len(SUFFIXES[-1])] for name in os.listdir(directory) if name.endswith(SUFFIXES[-1]))
+    for stem in stems[:max(0, len(stems) - max_files)]:
+        for suffix in SUFFIXES:
+            try:
+                os.remove(os.path.join(directory, stem + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def load_summaries(directory, company_id=None):
+    """Summaries of stored profiles, newest first; with `company_id`, only that company's and anonymous ones"""
+    if not os.path.isdir(directory):
+        return []
+    summaries = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith(SUFFIXES[-1]) or name.startswith('.'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if company_id is None or summary.get('company_id') in (None, company_id):
+            summaries.append(summary)
+    return summaries
+
+
+def aggregate_by_endpoint(summaries):
+    """Per-endpoint request counts, durations and the frames with the most self time across their profiles"""
+    endpoints = {}
+    for summary in summaries:
+        entry = endpoints.setdefault(summary['endpoint'], {
+            'endpoint': summary['endpoint'], 'profiles': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'frames': Counter()
+        })
+        entry['profiles'] += 1
+        entry['total_ms'] += summary['duration_ms']
+        entry['max_ms'] = max(entry['max_ms'], summary['duration_ms'])
+        for label, samples in summary.get('self_time', []):
+            entry['frames'][label] += samples
+    rows = []
+    for entry in endpoints.values():
+        rows.append(dict(entry, avg_ms=entry['total_ms'] / entry['profiles'], frames=entry['frames'].most_common(5)))
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def is_profile_admin(user):
+    """Whether the user is a server operator listed in PROFILE_ADMIN_EMAILS"""
+    return user.is_authenticated and user.email.lower() in current_app.config.get('PROFILE_ADMIN_EMAILS', ())
+
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='request-profile')
+
+
+def profile_token(app, user_id):
+    """Signed header value that makes a request be profiled, valid for PROFILE_TOKEN_MAX_AGE seconds"""
+    return _serializer(app).dumps({'user': user_id})
+
+
+def valid_profile_token(app, token):
+    try:
+        _serializer(app).loads(token, max_age=app.config.get('PROFILE_TOKEN_MAX_AGE', 3600))
+    except BadSignature:
+        return False
+    return True
+
+
+def _start_profiling():
+    """before_request hook: profile requests carrying a valid token, and a random fraction of the rest"""
+    if request.endpoint in SKIPPED_ENDPOINTS:
+        return
+    config = current_app.config
+    token = request.headers.get(PROFILE_HEADER)
+    if token and valid_profile_token(current_app, token):
+        reason = 'requested'
+    elif config['PROFILE_SAMPLE_RATE'] > 0 and random.random() < config['PROFILE_SAMPLE_RATE']:
+        reason = 'sampled'
+    else:
+        return
+    g.profile_reason = reason
+    g.profile_started_at = datetime.utcnow()
+    g.profile_sampler = StackSampler(threading.get_ident(), config['PROFILE_INTERVAL_MS'] / 1000).start()
+
+
+def _note_status(response):
+    """after_request hook: remember the status for the summary"""
+    if g.get('profile_sampler') is not None:
+        g.profile_status = response.status_code
+    return response
+
+
+def _finish_profiling(exc):
+    """teardown_request hook: stop the sampler and write the profile"""
+    sampler = g.pop('profile_sampler', None)
+    if sampler is None:
+        return
+    sampler.stop()
+    config = current_app.config
+    user = current_user if current_user.is_authenticated else None
+    try:
+        write_profile(config['PROFILE_DIR'], sampler, {
+            'endpoint': request.endpoint or 'unknown',
+            'method': request.method,
+            'path': request.path,
+            'status': g.get('profile_status', 500),
+            'reason': g.get('profile_reason'),
+            'duration_ms': round(sampler.duration_ms, 2),
+            'interval_ms': config['PROFILE_INTERVAL_MS'],
+            'company_id': user.company_id if user is not None else None,
+            'started_at': g.profile_started_at.isoformat(timespec='seconds'),
+        }, max_files=config['PROFILE_MAX_FILES'])
+    except OSError as e:
+        print(f"Writing the profile of {request.path} failed: {e}")
+
+
+def init_profiling(app):
+    app.context_processor(lambda: {'is_profile_admin': is_profile_admin})
+    app.before_request(_start_profiling)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_profiling)
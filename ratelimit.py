@@ -0,0 +1,243 @@
+"""
+Token-bucket rate limiting for expensive and unauthenticated endpoints
+
+Views marked with ``@rate_limited('<name>')`` draw a token from a bucket per
+user, per client IP and/or per company, as configured in RATE_LIMITS, e.g.
+``ocr: "user:10/minute, company:60/minute"``. Each bucket holds up to N
+tokens and refills at N per period, so short bursts pass while sustained
+load is capped. A request is let through only if every one of its buckets
+has a token. Otherwise it gets a 429 with ``Retry-After`` and nothing is
+taken. Anonymous requests use their IP address for ``user`` buckets and skip
+``company`` ones.
+
+Buckets live in this process by default. Set RATE_LIMIT_STORAGE_URL to a
+``redis://`` URL to share them across workers and hosts. A Lua script checks
+and updates all of a request's buckets in one round trip, using the server's
+clock. While Redis can't be reached, requests are let through.
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlsplit
+
+from flask import current_app, flash, jsonify, request
+from flask_login import current_user
+
+from cache_backends import RedisCache, RedisError
+
+SCOPES = ('user', 'ip', 'company')
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class Limit:
+    """A bucket of `capacity` tokens refilled at `capacity / period` tokens per second"""
+
+    def __init__(self, scope, capacity, period):
+        self.scope = scope
+        self.capacity = capacity
+        self.period = period
+        self.rate = capacity / period
+
+    def __repr__(self):
+        return f'Limit({self.scope}:{self.capacity}/{self.period}s)'
+
+
+def parse_limits(spec):
+    """'user:10/minute, ip:100/hour' -> [Limit, ...]; an empty spec means no limits"""
+    limits = []
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            scope, rest = part.split(':', 1)
+            count, period = rest.split('/', 1)
+            scope, period = scope.strip(), period.strip()
+            seconds = PERIODS[period] if period in PERIODS else float(period.rstrip('s'))
+            limit = Limit(scope, int(count), seconds)
+        except (ValueError, KeyError) as e:
+            raise ValueError(f"Invalid rate limit '{part}', expected scope:count/period") from e
+        if scope not in SCOPES or limit.capacity < 1 or seconds <= 0:
+            raise ValueError(f"Invalid rate limit '{part}', expected scope:count/period")
+        limits.append(limit)
+    return limits
+
+
+class LocalBuckets:
+    """In-process buckets; the least recently used are dropped beyond `max_size` (a dropped bucket starts full)"""
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, entries, now=None):
+        """Take one token from every (key, Limit) bucket; returns 0, or the seconds until all have one"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, limit in entries:
+                tokens, updated_at = self._buckets.get(key, (limit.capacity, now))
+                tokens = min(limit.capacity, tokens + max(0.0, now - updated_at) * limit.rate)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / limit.rate)
+                levels.append(tokens)
+            if wait:
+                return wait
+            for (key, _), tokens in zip(entries, levels):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+            return 0.0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# KEYS are the buckets, ARGV their capacity and refill rate in pairs. Returns the wait as a string.
+TAKE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    if tokens < 1 then
+        wait = math.max(wait, (1 - tokens) / rate)
+    end
+    levels[i] = tokens
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[2 * i - 1])
+    local rate = tonumber(ARGV[2 * i])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - 1), 'updated_at', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000) + 1000)
+end
+return '0'
+"""
+
+
+class RedisBuckets:
+    """Buckets shared through Redis; requests are let through while the server is unreachable"""
+
+    def __init__(self, client):
+        self.client = client
+        self._sha = None
+        self._down_until = 0.0
+
+    @classmethod
+    def from_url(cls, url):
+        return cls(RedisCache.from_url(url, prefix='ratelimit:'))
+
+    def _eval(self, keys, args):
+        if self._sha is not None:
+            try:
+                return self.client.execute('EVALSHA', self._sha, len(keys), *keys, *args)
+            except RedisError as e:
+                if not str(e).startswith('NOSCRIPT'):
+                    raise
+        self._sha = self.client.execute('SCRIPT', 'LOAD', TAKE_SCRIPT).decode()
+        return self.client.execute('EVALSHA', self._sha, len(keys), *keys, *args)
+
+    def take(self, entries, now=None):
+        if time.monotonic() < self._down_until:
+            return 0.0
+        keys = [self.client.prefix + key for key, _ in entries]
+        args = []
+        for _, limit in entries:
+            args += [limit.capacity, repr(limit.rate)]
+        try:
+            return float(self._eval(keys, args))
+        except OSError as e:
+            self._down_until = time.monotonic() + self.client.retry_after
+            print(f"Rate limit store unreachable, not limiting for {self.client.retry_after}s: {e}")
+        except RedisError as e:
+            print(f"Rate limit check failed, letting the request through: {e}")
+        return 0.0
+
+    def clear(self):
+        self.client.clear()
+
+
+def buckets_from_url(url):
+    scheme = urlsplit(url or '').scheme
+    if scheme in ('', 'local'):
+        return LocalBuckets()
+    if scheme == 'redis':
+        return RedisBuckets.from_url(url)
+    raise ValueError(f"Unsupported RATE_LIMIT_STORAGE_URL scheme '{scheme}'")
+
+
+class RateLimiter:
+    def __init__(self, limits, buckets):
+        self.limits = limits  # name -> [Limit]
+        self.buckets = buckets
+
+    def bucket_keys(self, name):
+        """(key, Limit) pairs for the current request under the named limits"""
+        user = current_user if current_user.is_authenticated else None
+        entries = []
+        for limit in self.limits.get(name, ()):
+            if limit.scope == 'company':
+                if user is None:
+                    continue
+                subject = f'company:{user.company_id}'
+            elif limit.scope == 'user' and user is not None:
+                subject = f'user:{user.id}'
+            else:
+                subject = f'ip:{request.remote_addr}'
+            entries.append((f'{name}:{limit.capacity}/{limit.period:g}:{subject}', limit))
+        return entries
+
+    def check(self, name):
+        """0 if the request may proceed, else seconds until it may"""
+        entries = self.bucket_keys(name)
+        return self.buckets.take(entries) if entries else 0.0
+
+
+def rate_limited(name, methods=None, page=None):
+    """
+    Apply the RATE_LIMITS entry `name` to a view, optionally only for some
+    HTTP methods. Place it below @login_required so users are known.
+    Non-JSON requests to a view given a `page` function (an HTML form) get
+    that page back with a flashed message instead of a JSON error.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get('rate_limiter')
+            if limiter is not None and (methods is None or request.method in methods):
+                wait = limiter.check(name)
+                if wait:
+                    retry_after = str(max(1, math.ceil(wait)))
+                    if page is not None and not request.is_json:
+                        flash(f'Too many attempts, please try again in {retry_after} seconds')
+                        return page(), 429, {'Retry-After': retry_after}
+                    response = jsonify({'error': 'Too many requests, please slow down'})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = retry_after
+                    return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_rate_limits(app):
+    if not app.config.get('RATE_LIMIT_ENABLED', True):
+        return
+    limits = {name: parse_limits(spec) for name, spec in app.config.get('RATE_LIMITS', {}).items()}
+    app.extensions['rate_limiter'] = RateLimiter(limits, buckets_from_url(app.config.get('RATE_LIMIT_STORAGE_URL')))
@@ -0,0 +1,197 @@
+"""
+Receipt thumbnails and display-size derivatives
+
+Uploaded receipts can be 16 MB photos. As soon as one is stored, a worker
+pool renders two WebP derivatives next to it: a small thumbnail for the
+detail modals and a display-size image for viewing, and the original is
+only downloaded when asked for. Derivatives are written atomically under
+``UPLOAD_FOLDER/derived``; one that is missing (a crash, or a receipt
+uploaded before this existed) is rendered on first request, and
+``flask receipts-derive`` fills them in ahead of time. PDFs have no
+derivatives. Pillow is only imported by the workers.
+
+A scanned receipt is stored before its expense is submitted, so scans that
+never become an expense are left behind. ``flask receipts-purge-orphans``
+deletes receipts, and their derivatives, that no live or archived expense
+uses once they are RECEIPT_ORPHAN_TTL_HOURS old.
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import click
+from flask import current_app
+from sqlalchemy import select
+
+from extensions import db
+from models import ArchivedExpense, Expense
+from tenancy import TENANT_BIND_PREFIX
+
+# Longest edge in pixels of each derivative
+DERIVATIVE_SIZES = {
+    'thumb': 320,
+    'display': 1600,
+}
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+# Names process_ocr gives stored receipts
+RECEIPT_NAME = re.compile(r'^[0-9a-f]{32}_')
+
+
+def has_derivatives(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def derivative_path(upload_folder, filename, kind):
+    return os.path.join(upload_folder, 'derived', f'{filename}.{kind}.webp')
+
+
+def render_derivatives(source, upload_folder, filename, quality=80, sizes=None):
+    """Write every missing WebP derivative of one receipt; returns the kinds written"""
+    from PIL import Image, ImageOps
+
+    sizes = sizes or DERIVATIVE_SIZES
+    wanted = {kind: edge for kind, edge in sizes.items()
+              if not os.path.exists(derivative_path(upload_folder, filename, kind))}
+    if not wanted:
+        return []
+
+    os.makedirs(os.path.join(upload_folder, 'derived'), exist_ok=True)
+    with Image.open(source) as image:
+        # JPEGs decode straight at a fraction of full size when that is still big enough
+        largest = max(wanted.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        written = []
+        # Largest first, so each smaller size is scaled down from the previous one
+        for kind, edge in sorted(wanted.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(upload_folder, 'derived'), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, 'WEBP', quality=quality, method=4)
+            os.replace(tmp, derivative_path(upload_folder, filename, kind))
+            written.append(kind)
+    return written
+
+
+class DerivativeWorkers:
+    """Thread pool rendering derivatives off the request path; Pillow releases the GIL while it works"""
+
+    def __init__(self, upload_folder, max_workers=2, quality=80):
+        self.upload_folder = upload_folder
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='receipt-derive')
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, filename):
+        """Queue a receipt for rendering; returns the future, shared with any render already queued"""
+        with self._lock:
+            future = self._in_flight.get(filename)
+            if future is None or future.done():
+                future = self._executor.submit(self._render, filename)
+                self._in_flight[filename] = future
+        return future
+
+    def _render(self, filename):
+        try:
+            return render_derivatives(os.path.join(self.upload_folder, filename), self.upload_folder,
+                                      filename, quality=self.quality)
+        except Exception as e:
+            print(f"Rendering derivatives of {filename} failed: {e}")
+            return []
+        finally:
+            with self._lock:
+                self._in_flight.pop(filename, None)
+
+    def ensure(self, filename, kind, timeout=10):
+        """Path of a derivative, rendering it now if it is missing; None if it can't be made within `timeout`"""
+        path = derivative_path(self.upload_folder, filename, kind)
+        if not os.path.exists(path):
+            try:
+                self.submit(filename).result(timeout=timeout)
+            except FutureTimeoutError:
+                # The render keeps going in the background for the next request
+                return None
+        return path if os.path.exists(path) else None
+
+
+def queue_derivatives(filename):
+    """Start rendering a stored receipt's derivatives in the background"""
+    if has_derivatives(filename):
+        current_app.extensions['receipt_workers'].submit(filename)
+
+
+def referenced_receipts(names, batch_size=500):
+    """Which of `names` a live or archived expense uses, in the shared database or a dedicated one"""
+    names = list(names)
+    found = set()
+    for key, engine in db.engines.items():
+        if key is not None and not key.startswith(TENANT_BIND_PREFIX):
+            continue  # read replicas lag behind their primary
+        with engine.connect() as connection:
+            for table in (Expense.__table__, ArchivedExpense.__table__):
+                for start in range(0, len(names), batch_size):
+                    found.update(connection.execute(select(table.c.receipt_filename).where(
+                        table.c.receipt_filename.in_(names[start:start + batch_size])
+                    )).scalars())
+    return found
+
+
+def purge_orphaned_receipts(upload_folder, max_age_seconds):
+    """Delete receipts older than `max_age_seconds` that no expense uses, with their derivatives; returns how many"""
+    cutoff = time.time() - max_age_seconds
+    candidates = []
+    for name in os.listdir(upload_folder):
+        path = os.path.join(upload_folder, name)
+        if RECEIPT_NAME.match(name) and os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            candidates.append(name)
+    used = referenced_receipts(candidates)
+    removed = 0
+    for name in candidates:
+        if name in used:
+            continue
+        paths = [os.path.join(upload_folder, name)]
+        paths += [derivative_path(upload_folder, name, kind) for kind in DERIVATIVE_SIZES]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        removed += 1
+    return removed
+
+
+def init_receipts(app):
+    app.extensions['receipt_workers'] = DerivativeWorkers(
+        app.config['UPLOAD_FOLDER'],
+        max_workers=app.config.get('RECEIPT_DERIVATIVE_WORKERS', 2),
+        quality=app.config.get('RECEIPT_DERIVATIVE_QUALITY', 80),
+    )
+
+    @app.cli.command('receipts-derive')
+    def derive_command():
+        """Render missing thumbnails and display images for every stored receipt"""
+        folder = app.config['UPLOAD_FOLDER']
+        names = [name for name in sorted(os.listdir(folder))
+                 if has_derivatives(name) and os.path.isfile(os.path.join(folder, name))]
+        workers = app.extensions['receipt_workers']
+        futures = [workers.submit(name) for name in names]
+        rendered = sum(1 for future in futures if future.result())
+        print(f"Rendered derivatives for {rendered} of {len(names)} receipt(s)")
+
+    @app.cli.command('receipts-purge-orphans')
+    @click.option('--older-than-hours', type=float, default=None,
+                  help='Only receipts stored this long ago (default RECEIPT_ORPHAN_TTL_HOURS)')
+    def purge_command(older_than_hours):
+        """Delete scanned receipts, and their derivatives, that no expense uses"""
+        hours = older_than_hours if older_than_hours is not None else app.config['RECEIPT_ORPHAN_TTL_HOURS']
+        with app.app_context():
+            removed = purge_orphaned_receipts(app.config['UPLOAD_FOLDER'], hours * 3600)
+        print(f"Deleted {removed} unused receipt(s)")
@@ -0,0 +1,251 @@
+"""
+Background re-denomination of expenses after a company changes its base currency
+
+Converted amounts are recomputed from each expense's original amount and
+currency at the rate for its expense date, for live and archived expenses
+alike, so history and restored expenses use the new currency too. Archived
+expenses keep their ids, so one id cursor walks both tables even while rows
+move between them. Work runs in id-ordered chunks,
+each in its own short transaction that also advances the job's cursor, so
+the expense table is never write-locked for long and a crashed job resumes
+from the last committed chunk. A heartbeat lease makes sure only one worker
+process runs a job at a time.
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+from flask import current_app
+from sqlalchemy import or_, update
+
+from extensions import db
+from fragment_cache import bump_company_version
+from fx_rates import ExchangeRateUnavailable, get_rate_for_date
+from models import ArchivedExpense, CurrencyConversionJob, Expense
+from tenancy import tenant_scope
+
+ACTIVE_STATUSES = ('pending', 'running')
+CENTS = Decimal('0.01')
+RATE_PLACES = Decimal('0.000001')
+# Tables holding a converted amount per expense
+CONVERTED_MODELS = (Expense, ArchivedExpense)
+
+
+def run_token():
+    """Lease holder id for one run of a job; two runs in the same process never share it"""
+    return f"{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+
+
+def schedule_redenomination(company, from_currency):
+    """
+    Queue a job converting the company's expenses to its current currency.
+
+    Runs in the caller's transaction; any unfinished job for the company is
+    superseded since the new job recomputes every expense anyway.
+    """
+    CurrencyConversionJob.query.filter(
+        CurrencyConversionJob.company_id == company.id,
+        CurrencyConversionJob.status.in_(ACTIVE_STATUSES + ('failed',))
+    ).update({'status': 'superseded'}, synchronize_session=False)
+
+    job = CurrencyConversionJob(
+        company_id=company.id,
+        from_currency=from_currency,
+        to_currency=company.currency,
+        total_count=sum(model.query.filter_by(company_id=company.id).count() for model in CONVERTED_MODELS),
+        # Counts as a fresh lease, so resume_stale_jobs leaves it to the worker launched with it
+        heartbeat_at=datetime.utcnow(),
+    )
+    db.session.add(job)
+    return job
+
+
+def launch_job(job_id, app=None):
+    """Run a job in a background thread"""
+    app = app or current_app._get_current_object()
+    thread = threading.Thread(target=run_job, args=(app, job_id), daemon=True, name=f'redenominate-{job_id}')
+    thread.start()
+    return thread
+
+
+def _claim(job_id, lease_seconds, token):
+    """Take the job's lease for the run `token`; returns False if another live run holds it"""
+    now = datetime.utcnow()
+    claimed = CurrencyConversionJob.query.filter(
+        CurrencyConversionJob.id == job_id,
+        CurrencyConversionJob.status.in_(ACTIVE_STATUSES),
+        or_(
+            CurrencyConversionJob.worker_id.is_(None),
+            CurrencyConversionJob.heartbeat_at < now - timedelta(seconds=lease_seconds),
+        )
+    ).update({'worker_id': token, 'heartbeat_at': now, 'status': 'running'}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def convert_chunk(rows, to_currency, rates):
+    """
+    Compute new converted amounts for a chunk of (id, amount, currency, expense_date) rows.
+
+    `rates` caches one lookup per (currency, date) across chunks.
+    """
+    updates = []
+    for expense_id, amount, currency, expense_date in rows:
+        key = (currency, expense_date)
+        if key not in rates:
+            rates[key] = Decimal(str(get_rate_for_date(currency, to_currency, expense_date))).quantize(RATE_PLACES)
+        rate = rates[key]
+        updates.append({
+            'id': expense_id,
+            'exchange_rate': rate,
+            'amount_in_company_currency': (Decimal(amount) * rate).quantize(CENTS, rounding=ROUND_HALF_UP),
+        })
+    return updates
+
+
+def _next_rows(job, chunk_size):
+    """The next chunk of (model, (id, amount, currency, expense_date)) past the cursor, across live and archive"""
+    rows = []
+    for model in CONVERTED_MODELS:
+        rows += [(model, row) for row in db.session.query(
+            model.id, model.amount, model.currency, model.expense_date
+        ).filter(
+            model.company_id == job.company_id,
+            model.id > job.last_expense_id
+        ).order_by(model.id).limit(chunk_size)]
+    rows.sort(key=lambda item: item[1][0])
+    return rows[:chunk_size]
+
+
+def process_next_chunk(job, rates, chunk_size):
+    """Convert one chunk and advance the cursor in the same transaction; returns rows converted"""
+    rows = _next_rows(job, chunk_size)
+    if not rows:
+        return 0
+
+    for model in CONVERTED_MODELS:
+        chunk = [row for row_model, row in rows if row_model is model]
+        if chunk:
+            db.session.execute(update(model), convert_chunk(chunk, job.to_currency, rates))
+    job.last_expense_id = rows[-1][1][0]
+    job.processed_count += len(rows)
+    job.total_count = max(job.total_count, job.processed_count)
+    job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    # The bulk UPDATE bypasses the flush that normally invalidates cached pages
+    bump_company_version(job.company_id)
+    return len(rows)
+
+
+def run_job(app, job_id):
+    """Worker loop: claim the job, then convert chunk by chunk until done, superseded or failed"""
+    with app.app_context():
+        config = app.config
+        token = run_token()
+        if not _claim(job_id, config['REDENOMINATION_LEASE_SECONDS'], token):
+            db.session.remove()
+            return
+
+        rates = {}
+        company_id = db.session.get(CurrencyConversionJob, job_id).company_id
+        try:
+            with tenant_scope(company_id):
+                while True:
+                    job = db.session.get(CurrencyConversionJob, job_id)
+                    if job.status != 'running' or job.worker_id != token:
+                        return
+
+                    if not process_next_chunk(job, rates, config['REDENOMINATION_CHUNK_SIZE']):
+                        job.status = 'completed'
+                        job.completed_at = datetime.utcnow()
+                        job.worker_id = None
+                        db.session.commit()
+                        return
+
+                    # Give other writers a turn at the database between chunks
+                    time.sleep(config['REDENOMINATION_CHUNK_PAUSE'])
+        except ExchangeRateUnavailable as e:
+            db.session.rollback()
+            _fail(job_id, f'{e}. Load historical rates, then retry.')
+        except Exception as e:
+            db.session.rollback()
+            print(f"Re-denomination job {job_id} failed: {e}")
+            _fail(job_id, str(e))
+        finally:
+            db.session.remove()
+
+
+def _fail(job_id, message):
+    job = db.session.get(CurrencyConversionJob, job_id)
+    job.status = 'failed'
+    job.error = message
+    job.worker_id = None
+    db.session.commit()
+
+
+def retry_job(job):
+    """Make a failed job resumable from its cursor (caller commits, then launches)"""
+    job.status = 'pending'
+    job.error = None
+    job.worker_id = None
+    job.heartbeat_at = datetime.utcnow()
+
+
+def resume_stale_jobs(company_id=None, app=None):
+    """Relaunch unfinished jobs whose worker has stopped heartbeating (e.g. after a crash)"""
+    lease = (app or current_app).config['REDENOMINATION_LEASE_SECONDS']
+    query = CurrencyConversionJob.query.filter(
+        CurrencyConversionJob.status.in_(ACTIVE_STATUSES),
+        or_(
+            CurrencyConversionJob.heartbeat_at.is_(None),
+            CurrencyConversionJob.heartbeat_at < datetime.utcnow() - timedelta(seconds=lease),
+        )
+    )
+    if company_id is not None:
+        query = query.filter(CurrencyConversionJob.company_id == company_id)
+
+    job_ids = [job.id for job in query.all()]
+    for job_id in job_ids:
+        launch_job(job_id, app=app)
+    return job_ids
+
+
+def latest_job(company_id):
+    return CurrencyConversionJob.query.filter(
+        CurrencyConversionJob.company_id == company_id,
+        CurrencyConversionJob.status != 'superseded'
+    ).order_by(CurrencyConversionJob.id.desc()).first()
+
+
+def job_to_dict(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'from_currency': job.from_currency,
+        'to_currency': job.to_currency,
+        'processed': job.processed_count,
+        'total': job.total_count,
+        'progress': job.progress,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+    }
+
+
+def init_redenomination(app):
+    @app.cli.command('redenomination-resume')
+    def resume_command():
+        """Run unfinished currency re-denomination jobs to completion in the foreground"""
+        with app.app_context():
+            job_ids = [job.id for job in CurrencyConversionJob.query.filter(
+                CurrencyConversionJob.status.in_(ACTIVE_STATUSES)
+            ).all()]
+        for job_id in job_ids:
+            print(f"Resuming job {job_id}")
+            run_job(app, job_id)
+        print(f"Processed {len(job_ids)} job(s)")
@@ -0,0 +1,237 @@
+"""
+Full-text expense search
+
+Expense title, description, merchant, OCR text, employee name and category
+are indexed in an SQLite FTS5 table or, on PostgreSQL, a weighted tsvector
+table with a GIN index. Database triggers keep the index current on every
+insert, update and delete (including renames of the employee or category),
+so no application code has to remember to reindex. Results are ranked
+(bm25 / ts_rank_cd) and paginated with an opaque (rank, id) cursor. Other
+databases get an unranked substring match over the same fields instead.
+"""
+
+import base64
+import json
+import re
+
+from sqlalchemy import Float, Integer, event, literal, or_, select, text
+
+from extensions import db
+from models import Expense, ExpenseCategory, User
+
+MAX_QUERY_TERMS = 10
+# Dialects with a full-text index; the rest fall back to LIKE
+FULL_TEXT_DIALECTS = ('sqlite', 'postgresql')
+
+SQLITE_FIELDS = ('title', 'description', 'merchant', 'ocr_text', 'employee_name', 'category')
+# bm25 column weights, in SQLITE_FIELDS order
+SQLITE_WEIGHTS = (10.0, 4.0, 8.0, 1.0, 4.0, 4.0)
+
+SQLITE_DOCUMENT = """
+    new.title, new.description, new.merchant, new.ocr_text,
+    (SELECT first_name || ' ' || last_name FROM "user" WHERE id = new.employee_id),
+    (SELECT name FROM expense_category WHERE id = new.category_id)
+"""
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS expense_fts USING fts5("
+    + ', '.join(SQLITE_FIELDS) + ", tokenize='porter unicode61 remove_diacritics 2')",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_fts_insert AFTER INSERT ON expense BEGIN
+        INSERT INTO expense_fts(rowid, {', '.join(SQLITE_FIELDS)}) VALUES (new.id, {SQLITE_DOCUMENT});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS expense_fts_update
+        AFTER UPDATE OF title, description, merchant, ocr_text, employee_id, category_id ON expense BEGIN
+        DELETE FROM expense_fts WHERE rowid = old.id;
+        INSERT INTO expense_fts(rowid, {', '.join(SQLITE_FIELDS)}) VALUES (new.id, {SQLITE_DOCUMENT});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS expense_fts_delete AFTER DELETE ON expense BEGIN
+        DELETE FROM expense_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS expense_fts_employee_rename AFTER UPDATE OF first_name, last_name ON "user" BEGIN
+        UPDATE expense_fts SET employee_name = new.first_name || ' ' || new.last_name
+        WHERE rowid IN (SELECT id FROM expense WHERE employee_id = new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS expense_fts_category_rename AFTER UPDATE OF name ON expense_category BEGIN
+        UPDATE expense_fts SET category = new.name
+        WHERE rowid IN (SELECT id FROM expense WHERE category_id = new.id);
+    END""",
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM expense_fts",
+    f"""INSERT INTO expense_fts(rowid, {', '.join(SQLITE_FIELDS)})
+        SELECT e.id, e.title, e.description, e.merchant, e.ocr_text,
+               u.first_name || ' ' || u.last_name, c.name
+        FROM expense e
+        JOIN "user" u ON u.id = e.employee_id
+        LEFT JOIN expense_category c ON c.id = e.category_id""",
+]
+
+POSTGRES_DDL = [
+    """CREATE TABLE IF NOT EXISTS expense_search (
+        expense_id integer PRIMARY KEY REFERENCES expense(id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS ix_expense_search_document ON expense_search USING GIN (document)",
+    """CREATE OR REPLACE FUNCTION expense_search_document(target integer) RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('english', coalesce(e.title, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(e.merchant, '')), 'A')
+            || setweight(to_tsvector('english', coalesce(e.description, '')), 'B')
+            || setweight(to_tsvector('simple', u.first_name || ' ' || u.last_name), 'B')
+            || setweight(to_tsvector('english', coalesce(c.name, '')), 'B')
+            || setweight(to_tsvector('english', coalesce(e.ocr_text, '')), 'D')
+        FROM expense e
+        JOIN "user" u ON u.id = e.employee_id
+        LEFT JOIN expense_category c ON c.id = e.category_id
+        WHERE e.id = target
+    $$ LANGUAGE sql STABLE""",
+    """CREATE OR REPLACE FUNCTION expense_search_refresh() RETURNS trigger AS $$
+    BEGIN
+        IF TG_TABLE_NAME = 'expense' THEN
+            INSERT INTO expense_search (expense_id, document) VALUES (NEW.id, expense_search_document(NEW.id))
+            ON CONFLICT (expense_id) DO UPDATE SET document = EXCLUDED.document;
+        ELSIF TG_TABLE_NAME = 'user' THEN
+            UPDATE expense_search SET document = expense_search_document(expense_id)
+            WHERE expense_id IN (SELECT id FROM expense WHERE employee_id = NEW.id);
+        ELSE
+            UPDATE expense_search SET document = expense_search_document(expense_id)
+            WHERE expense_id IN (SELECT id FROM expense WHERE category_id = NEW.id);
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS expense_search_expense ON expense",
+    """CREATE TRIGGER expense_search_expense
+        AFTER INSERT OR UPDATE OF title, description, merchant, ocr_text, employee_id, category_id ON expense
+        FOR EACH ROW EXECUTE FUNCTION expense_search_refresh()""",
+    'DROP TRIGGER IF EXISTS expense_search_employee_rename ON "user"',
+    """CREATE TRIGGER expense_search_employee_rename AFTER UPDATE OF first_name, last_name ON "user"
+        FOR EACH ROW EXECUTE FUNCTION expense_search_refresh()""",
+    "DROP TRIGGER IF EXISTS expense_search_category_rename ON expense_category",
+    """CREATE TRIGGER expense_search_category_rename AFTER UPDATE OF name ON expense_category
+        FOR EACH ROW EXECUTE FUNCTION expense_search_refresh()""",
+]
+
+POSTGRES_REBUILD = [
+    """INSERT INTO expense_search (expense_id, document)
+        SELECT id, expense_search_document(id) FROM expense
+        ON CONFLICT (expense_id) DO UPDATE SET document = EXCLUDED.document""",
+]
+
+
+class InvalidCursor(ValueError):
+    """The pagination cursor could not be decoded"""
+
+
+def _statements(dialect, ddl=True):
+    if dialect == 'sqlite':
+        return SQLITE_DDL if ddl else SQLITE_REBUILD
+    if dialect == 'postgresql':
+        return POSTGRES_DDL if ddl else POSTGRES_REBUILD
+    return []
+
+
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    """Create the index table and triggers whenever the schema is created"""
+    for statement in _statements(connection.dialect.name):
+        connection.exec_driver_sql(statement)
+
+
+def rebuild_search_index(connection):
+    """Create the index if missing and repopulate it from the expense table"""
+    create_search_index(None, connection)
+    for statement in _statements(connection.dialect.name, ddl=False):
+        connection.exec_driver_sql(statement)
+
+
+def search_terms(query):
+    """Word tokens of a free-text query; punctuation and operators are dropped"""
+    return re.findall(r'\w+', query.lower())[:MAX_QUERY_TERMS]
+
+
+def match_expression(terms, dialect):
+    """Prefix-matching AND of all terms in the engine's query syntax"""
+    if dialect == 'postgresql':
+        return ' & '.join(f'{term}:*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _hits(dialect, terms):
+    """Subquery of (expense_id, rank) for matches, lower rank first"""
+    if dialect not in FULL_TEXT_DIALECTS:
+        return _substring_hits(terms)
+    if dialect == 'postgresql':
+        sql = """SELECT expense_id, -ts_rank_cd(document, query) AS rank
+                 FROM expense_search, to_tsquery('english', :match) query
+                 WHERE document @@ query"""
+    else:
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        sql = f"""SELECT rowid AS expense_id, bm25(expense_fts, {weights}) AS rank
+                  FROM expense_fts WHERE expense_fts MATCH :match"""
+    return text(sql).bindparams(match=match_expression(terms, dialect)) \
+        .columns(expense_id=Integer, rank=Float).subquery('hits')
+
+
+def _substring_hits(terms):
+    """Unranked matches without an index: every term appears in one of the indexed fields"""
+    fields = (Expense.title, Expense.description, Expense.merchant, Expense.ocr_text,
+              User.first_name + ' ' + User.last_name, ExpenseCategory.name)
+    return select(Expense.id.label('expense_id'), literal(0.0, Float).label('rank')) \
+        .join(User, User.id == Expense.employee_id) \
+        .outerjoin(ExpenseCategory, ExpenseCategory.id == Expense.category_id) \
+        .where(*(or_(*(field.icontains(term, autoescape=True) for field in fields)) for term in terms)) \
+        .subquery('hits')
+
+
+def encode_cursor(rank, expense_id):
+    raw = json.dumps([rank, expense_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        rank, expense_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return float(rank), int(expense_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid search cursor') from e
+
+
+def search_expenses(query, visibility, cursor=None, limit=20, date_from=None, date_to=None):
+    """
+    Ranked expenses matching `query` that satisfy the `visibility` filter.
+
+    Returns (expenses, next_cursor); next_cursor is None on the last page.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], None
+
+    dialect = db.session.get_bind(mapper=Expense).dialect.name
+    hits = _hits(dialect, terms)
+    statement = db.select(Expense, hits.c.rank).join(hits, hits.c.expense_id == Expense.id).where(visibility)
+    if date_from:
+        statement = statement.where(Expense.expense_date >= date_from)
+    if date_to:
+        statement = statement.where(Expense.expense_date <= date_to)
+    if cursor:
+        rank, expense_id = decode_cursor(cursor)
+        statement = statement.where(or_(hits.c.rank > rank, db.and_(hits.c.rank == rank, Expense.id > expense_id)))
+
+    rows = db.session.execute(statement.order_by(hits.c.rank, Expense.id).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0].id)
+    return [expense for expense, _ in rows], next_cursor
+
+
+def init_search(app):
+    @app.cli.command('search-rebuild')
+    def rebuild_command():
+        """Create the full-text index if needed and reindex every expense"""
+        with app.app_context():
+            with db.engine.begin() as connection:
+                rebuild_search_index(connection)
+            print("Search index rebuilt")
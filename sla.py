@@ -0,0 +1,273 @@
+"""
+Approval SLAs: escalate approvals nobody acts on
+
+When an approval step becomes active its pending approvals get a ``due_at``
+from the company's SLA (``Company.approval_sla_hours``, else
+APPROVAL_SLA_HOURS; 0 turns escalation off). Due times are stored on the
+rows, so they survive restarts. ``SlaScheduler`` loads the pending ones into
+a heap once, then sleeps until the earliest is due. Due times committed in
+the same process are pushed onto the heap after commit; ones committed by
+other processes are picked up by a look-ahead query over the indexed
+``due_at`` window. An overdue approval moves to the approver's manager with
+a conditional UPDATE, so when several schedulers run only one of them
+escalates it.
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import event
+
+from db_routing import RoutingSession
+from events import queue_event
+from expense_log import record_transition
+from extensions import db
+from models import Approval, ApprovalStep, User
+from notifications import enqueue_notification
+
+PENDING_SLA_KEY = 'pending_sla_due'
+
+
+def sla_hours(company):
+    if company is not None and company.approval_sla_hours is not None:
+        return company.approval_sla_hours
+    return current_app.config.get('APPROVAL_SLA_HOURS', 48)
+
+
+def due_time(company, start=None):
+    """When an approval activated at `start` becomes overdue, or None if the company has no SLA"""
+    hours = sla_hours(company)
+    if not hours or hours <= 0:
+        return None
+    return (start or datetime.utcnow()) + timedelta(hours=hours)
+
+
+def start_sla(session, approval, company):
+    """Give a flushed, newly active approval its due time; it is scheduled once the transaction commits"""
+    approval.due_at = due_time(company)
+    if approval.due_at is not None:
+        session.info.setdefault(PENDING_SLA_KEY, []).append((approval.id, approval.due_at))
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _schedule_pending(session):
+    pending = session.info.pop(PENDING_SLA_KEY, None)
+    if not pending or not has_app_context():
+        return
+    scheduler = current_app.extensions.get('sla_scheduler')
+    if scheduler is None or not scheduler.running:
+        return
+    for approval_id, due_at in pending:
+        scheduler.schedule(approval_id, due_at)
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(PENDING_SLA_KEY, None)
+
+
+def escalation_target(approval):
+    """
+    The nearest active manager above the approver who isn't already an
+    approver of the expense, in any step, nor the employee who submitted it
+    """
+    taken = {approver_id for approver_id, in db.session.query(Approval.approver_id).filter_by(
+        expense_id=approval.expense_id
+    )}
+    taken.add(approval.expense.employee_id)
+    visited = set()
+    user = approval.approver
+    while user is not None and user.manager_id and user.id not in visited:
+        visited.add(user.id)
+        user = db.session.get(User, user.manager_id)
+        if user is not None and user.is_active and user.id not in taken:
+            return user
+    return None
+
+
+def escalate(approval_id, due_at, scheduler=None):
+    """Move an overdue approval to the approver's manager; True if this call escalated it"""
+    approval = db.session.get(Approval, approval_id)
+    if approval is None or approval.status != 'pending' or approval.due_at is None:
+        db.session.rollback()
+        return False
+    if approval.due_at != due_at:
+        # Rescheduled since this entry was queued
+        if scheduler is not None:
+            scheduler.schedule(approval.id, approval.due_at)
+        db.session.rollback()
+        return False
+
+    expense = approval.expense
+    previous_id = approval.approver_id
+    target = escalation_target(approval)
+    values = {'due_at': None}
+    if target is not None:
+        values.update(
+            approver_id=target.id,
+            escalated_from_id=approval.escalated_from_id or previous_id,
+            due_at=due_time(expense.company),
+        )
+    claimed = Approval.query.filter(
+        Approval.id == approval.id,
+        Approval.status == 'pending',
+        Approval.approver_id == previous_id,
+        Approval.due_at == due_at
+    ).update(values, synchronize_session=False)
+    if not claimed:
+        # Decided, or escalated by another scheduler, since it was read
+        db.session.rollback()
+        return False
+
+    if target is None:
+        db.session.commit()
+        print(f"Approval {approval_id} is overdue but user {previous_id} has no manager to escalate to")
+        return False
+
+    # A HYBRID step's specific approver hands that authority on too
+    ApprovalStep.query.filter_by(
+        expense_id=expense.id, sequence=approval.sequence, specific_approver_id=previous_id
+    ).update({'specific_approver_id': target.id}, synchronize_session=False)
+    record_transition(db.session, expense, 'approval.escalated', 'pending', 'escalated', approval=approval,
+                      from_approver_id=previous_id, to_approver_id=target.id)
+    previous = db.session.get(User, previous_id)
+    queue_event(db.session, previous_id, 'approval.withdrawn',
+                approval_id=approval.id, expense_id=expense.id, title=expense.title)
+    for publish in (queue_event, enqueue_notification):
+        publish(db.session, target.id, 'approval.activated', approval_id=approval.id, expense_id=expense.id,
+                title=expense.title, escalated_from=previous.full_name if previous else None)
+    db.session.commit()
+
+    if scheduler is not None and values['due_at'] is not None:
+        scheduler.schedule(approval.id, values['due_at'])
+    return True
+
+
+class SlaScheduler:
+    """Min-heap of (due_at, approval_id) served by one thread that sleeps until the earliest entry is due"""
+
+    def __init__(self, app, lookahead=300):
+        self.app = app
+        self.lookahead = lookahead
+        self.escalated = 0
+        self._heap = []
+        self._scheduled = {}  # approval_id -> due_at of its live heap entry
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def schedule(self, approval_id, due_at):
+        with self._cond:
+            if self._scheduled.get(approval_id) == due_at:
+                return
+            # Any older entry for the approval stays in the heap and is dropped when popped
+            self._scheduled[approval_id] = due_at
+            heapq.heappush(self._heap, (due_at, approval_id))
+            self._cond.notify()
+
+    def load(self, until=None):
+        """Push pending approvals with a due time (up to `until`) onto the heap; returns how many"""
+        query = db.session.query(Approval.id, Approval.due_at).filter(
+            Approval.status == 'pending', Approval.due_at.isnot(None)
+        )
+        if until is not None:
+            query = query.filter(Approval.due_at <= until)
+        rows = query.all()
+        db.session.rollback()
+        for approval_id, due_at in rows:
+            self.schedule(approval_id, due_at)
+        return len(rows)
+
+    def pop_due(self, now):
+        """(approval_id, due_at) for entries due by `now`, skipping superseded ones"""
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, approval_id = heapq.heappop(self._heap)
+                if self._scheduled.get(approval_id) == due_at:
+                    del self._scheduled[approval_id]
+                    due.append((approval_id, due_at))
+        return due
+
+    def run_due(self, now=None):
+        """Escalate every approval due by `now`; returns how many were escalated"""
+        count = 0
+        for approval_id, due_at in self.pop_due(now or datetime.utcnow()):
+            try:
+                count += escalate(approval_id, due_at, self)
+            except Exception as e:
+                db.session.rollback()
+                print(f"Escalating approval {approval_id} failed: {e}")
+        self.escalated += count
+        return count
+
+    def serve(self):
+        """Load the heap, then escalate as entries fall due until stop(); needs an app context"""
+        loaded = False
+        next_sync = 0
+        while not self._stopping:
+            try:
+                if time.monotonic() >= next_sync:
+                    # Everything once, then due times written by other processes up to well past the next sync
+                    self.load(until=datetime.utcnow() + timedelta(seconds=2 * self.lookahead) if loaded else None)
+                    loaded = True
+                    next_sync = time.monotonic() + self.lookahead
+                self.run_due()
+            except Exception as e:
+                db.session.rollback()
+                print(f"SLA scheduler error: {e}")
+                next_sync = min(next_sync, time.monotonic() + 5)
+            finally:
+                db.session.remove()
+            with self._cond:
+                timeout = next_sync - time.monotonic()
+                if self._heap:
+                    timeout = min(timeout, (self._heap[0][0] - datetime.utcnow()).total_seconds())
+                if timeout > 0 and not self._stopping:
+                    self._cond.wait(timeout)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+
+        def run():
+            with self.app.app_context():
+                self.serve()
+
+        self._thread = threading.Thread(target=run, daemon=True, name='sla-scheduler')
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def init_sla(app):
+    scheduler = SlaScheduler(app, lookahead=app.config.get('APPROVAL_SLA_LOOKAHEAD', 300))
+    app.extensions['sla_scheduler'] = scheduler
+    if app.config.get('APPROVAL_SLA_SCHEDULER'):
+        scheduler.start()
+
+    @app.cli.command('sla-scheduler')
+    @click.option('--once', is_flag=True, help='Escalate what is overdue now and exit')
+    def scheduler_command(once):
+        """Escalate overdue approvals to the approver's manager"""
+        with app.app_context():
+            if once:
+                scheduler.load(until=datetime.utcnow())
+                print(f"Escalated {scheduler.run_due()} approval(s)")
+                return
+            print("Watching approval SLAs")
+            scheduler.serve()
@@ -478,9 +478,57 @@ const FilterManager = {
     }
 };
 
-// Initialize filters when document is ready
+// Live updates pushed from /api/events
+const EventStream = {
+    // Pages that show data each event type can change
+    refreshPaths: {
+        'approval.activated': ['/approvals', '/dashboard'],
+        'approval.withdrawn': ['/approvals', '/dashboard'],
+        'expense.status': ['/expenses', '/dashboard']
+    },
+
+    messages: {
+        'approval.activated': title => `"${title}" is waiting for your approval`,
+        'approval.withdrawn': title => `"${title}" no longer needs your approval`,
+        'expense.status': (title, event) => `"${title}" is now ${event.status.replace('_', ' ')}`
+    },
+
+    refreshTimer: null,
+
+    connect: function() {
+        const url = $('body').data('events-url');
+        if (!url || !window.EventSource) {
+            return;
+        }
+
+        const source = new EventSource(url);
+        Object.keys(this.refreshPaths).forEach(function(type) {
+            source.addEventListener(type, function(e) {
+                EventStream.handle(type, JSON.parse(e.data));
+            });
+        });
+    },
+
+    handle: function(type, event) {
+        const title = $('<div>').text(event.title).html();
+        ExpenseManager.showToast(this.messages[type](title, event), type === 'approval.activated' ? 'primary' : 'info');
+
+        // Refresh only pages showing the changed data, never over an open modal or a
+        // half-written comment; bursts of events are batched into one reload
+        const editing = $('textarea').filter(function() { return this.value; }).length > 0;
+        if (this.refreshPaths[type].includes(window.location.pathname) && !$('.modal.show').length && !editing) {
+            clearTimeout(this.refreshTimer);
+            this.refreshTimer = setTimeout(function() {
+                window.location.reload();
+            }, 1500);
+        }
+    }
+};
+
+// Initialize filters and live updates when document is ready
 $(document).ready(function() {
     FilterManager.init();
+    EventStream.connect();
 });
 
 // Export functions for global access
@@ -491,3 +539,4 @@ window.CurrencyManager = CurrencyManager;
 window.OCRManager = OCRManager;
 window.UserManager = UserManager;
 window.FilterManager = FilterManager;
+window.EventStream = EventStream;
@@ -0,0 +1,482 @@
+"""
+Tenant database routing
+
+Every company's data lives in the shared database unless it has been moved
+to a dedicated one. TENANT_DATABASE_URLS names those databases
+(``acme=sqlite:///tenants/acme.db,globex=postgresql://...``), and
+``Company.database_name`` says which one a company uses. Users and companies
+stay in the shared database, which login and registration read before any
+company is known. Expenses, approvals, rules, categories, fingerprints,
+the expense event log and the notification outbox (the tables in
+``TENANT_TABLES``) go to the database of the current company, so the events
+and emails a change produces commit in the same transaction as the change.
+In a request that is ``current_user.company_id``; outside one it is set by
+``tenant_scope``, or for a whole worker process by TENANT_DATABASE. Event
+consumer offsets (``DATABASE_TABLES``) follow the log they point into: they
+live in the database the scope works on, but aren't moved with a company.
+
+A dedicated database has the full schema, and keeps read-only copies of its
+company's row and users. Joins, lazy loads and the search index triggers
+that read employee names therefore work there unchanged. The copies are
+refreshed after each commit that changes them.
+
+``flask tenant-move`` moves one company between databases while it stays
+online. It first copies the rows while the company keeps writing. It then
+pauses that company's writes for a short final pass that copies only what
+changed, switches ``database_name``, and deletes the old rows. Every other
+company is unaffected. Ids are only unique within one database, so a move
+is refused if any of the company's ids are already taken in the target.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+
+import click
+from flask import current_app, has_app_context, has_request_context, jsonify
+from flask_login import current_user
+from sqlalchemy import delete, event, inspect, not_, select, text, update
+from sqlalchemy.sql.util import find_tables
+
+from db_routing import RoutingSession, _engine_options
+from extensions import db
+from fragment_cache import bump_company_version
+from models import Company, User
+
+TENANT_BIND_PREFIX = 'tenant_'
+TENANT_COMPANY_KEY = 'tenant_company_id'
+PENDING_MIRROR_KEY = 'pending_tenant_mirror'
+SHARED = 'shared'
+
+# Tables holding one company's data: name -> (column, parent table) linking rows to a
+# company through their parent (or its user), or None for tables with their own company_id. Parents first.
+TENANT_TABLES = {
+    'expense_category': None,
+    'approval_rule': None,
+    'approval_rule_approver': ('rule_id', 'approval_rule'),
+    'expense': None,
+    'approval': ('expense_id', 'expense'),
+    'approval_step': ('expense_id', 'expense'),
+    'expense_fingerprint': None,
+    'expense_archive': None,
+    'approval_archive': ('expense_id', 'expense_archive'),
+    'approval_step_archive': ('expense_id', 'expense_archive'),
+    'expense_fingerprint_archive': None,
+    'expense_event': None,
+    'notification_outbox': ('recipient_id', 'user'),
+}
+# Tables routed like tenant tables but holding no company's rows, so a move leaves them behind
+DATABASE_TABLES = {'event_consumer_offset'}
+
+
+class TenantMovingError(Exception):
+    """The company is being moved to another database and its writes are paused"""
+
+
+class TenantMoveError(Exception):
+    """A company can't be moved to the requested database"""
+
+
+def configure_tenant_binds(app):
+    """Add a ``tenant_<name>`` bind per dedicated database; must run before ``SQLAlchemy(app)`` creates engines"""
+    config = app.config
+    binds = config.setdefault('SQLALCHEMY_BINDS', {})
+    for name, url in config.get('TENANT_DATABASE_URLS', {}).items():
+        options = _engine_options(url, config.get('DB_POOL_SIZE'), config.get('DB_POOL_PRE_PING', True))
+        options['url'] = url
+        binds[TENANT_BIND_PREFIX + name] = options
+
+
+def tenant_tables():
+    return [table for table in db.metadata.sorted_tables if table.name in TENANT_TABLES]
+
+
+class TenantRouter:
+    """
+    Maps companies to dedicated databases. Only companies that have one are
+    loaded, with one query, and the map is reloaded after `ttl` seconds, so
+    a move is seen by every process within that time.
+    """
+
+    def __init__(self, databases, ttl=10.0, worker_database=None):
+        self.databases = set(databases)
+        self.ttl = ttl
+        self.worker_database = worker_database
+        self._companies = {}  # company_id -> (database_name, locked)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def companies(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl:
+                table = Company.__table__
+                with db.engines[None].connect() as connection:
+                    rows = connection.execute(select(
+                        table.c.id, table.c.database_name, table.c.database_locked
+                    ).where(table.c.database_name.isnot(None) | table.c.database_locked)).all()
+                self._companies = {company_id: (name, bool(locked)) for company_id, name, locked in rows}
+                self._loaded_at = time.monotonic()
+            return self._companies
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def database_for(self, company_id):
+        if not self.databases or company_id is None:
+            return None
+        return self.companies().get(company_id, (None, False))[0]
+
+    def is_locked(self, company_id):
+        if not self.databases or company_id is None:
+            return False
+        return self.companies().get(company_id, (None, False))[1]
+
+    def current_database(self, session):
+        """Dedicated database of the company the session is working for, or None for the shared one"""
+        if TENANT_COMPANY_KEY in session.info:
+            return self.database_for(session.info[TENANT_COMPANY_KEY])
+        if has_request_context():
+            return self.database_for(current_company_id(session))
+        return self.worker_database
+
+    def bind_for(self, session, mapper=None, clause=None):
+        """Bind key for a statement touching tenant tables, or None to route it as usual"""
+        if mapper is not None:
+            names = {inspect(mapper).local_table.name}
+        elif clause is not None:
+            names = {table.name for table in find_tables(clause, include_crud=True)}
+        else:
+            return None
+        if names.isdisjoint(TENANT_TABLES) and names.isdisjoint(DATABASE_TABLES):
+            return None
+        database = self.current_database(session)
+        return TENANT_BIND_PREFIX + database if database else None
+
+
+def current_company_id(session=None):
+    """Company the current scope or request works for"""
+    session = session if session is not None else db.session
+    if TENANT_COMPANY_KEY in session.info:
+        return session.info[TENANT_COMPANY_KEY]
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.company_id
+    return None
+
+
+def tenant_router():
+    if not has_app_context():
+        return None
+    router = current_app.extensions.get('tenancy')
+    return router if router is not None and router.databases else None
+
+
+@contextmanager
+def tenant_scope(company_id):
+    """Route tenant tables to `company_id`'s database for work done outside a request"""
+    session = db.session
+    previous = session.info.get(TENANT_COMPANY_KEY)
+    had_previous = TENANT_COMPANY_KEY in session.info
+    session.info[TENANT_COMPANY_KEY] = company_id
+    try:
+        yield
+    finally:
+        if had_previous:
+            session.info[TENANT_COMPANY_KEY] = previous
+        else:
+            session.info.pop(TENANT_COMPANY_KEY, None)
+
+
+def _is_tenant_object(obj):
+    return inspect(obj).mapper.local_table.name in TENANT_TABLES
+
+
+def _check_writable(session):
+    router = tenant_router()
+    if router is not None and router.is_locked(current_company_id(session)):
+        raise TenantMovingError('This company is being moved to another database; try again shortly')
+
+
+@event.listens_for(RoutingSession, 'before_flush')
+def _pause_moving_tenant(session, flush_context, instances):
+    if any(_is_tenant_object(obj) for obj in chain(session.new, session.dirty, session.deleted)):
+        _check_writable(session)
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _pause_moving_tenant_bulk(orm_execute_state):
+    # Bulk statements bypass flush
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if tenant_router() is None:
+        return
+    tables = {table.name for table in find_tables(orm_execute_state.statement, include_crud=True)}
+    if not tables.isdisjoint(TENANT_TABLES):
+        _check_writable(orm_execute_state.session)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _collect_mirrored(session, flush_context):
+    if tenant_router() is None:
+        return
+    pending = session.info.setdefault(PENDING_MIRROR_KEY, {})
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, User):
+            pending.setdefault(obj.company_id, set()).add(obj.id)
+        elif isinstance(obj, Company):
+            pending.setdefault(obj.id, set())
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _refresh_mirrors(session):
+    pending = session.info.pop(PENDING_MIRROR_KEY, None)
+    if not pending:
+        return
+    router = tenant_router()
+    for company_id, user_ids in pending.items():
+        if router is not None and router.database_for(company_id):
+            try:
+                mirror_company(company_id, user_ids or ())
+            except Exception as e:
+                print(f"Refreshing the copies of company {company_id} in its database failed: {e}")
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _discard_mirrored(session):
+    session.info.pop(PENDING_MIRROR_KEY, None)
+
+
+def _engine(database):
+    return db.engines[TENANT_BIND_PREFIX + database if database else None]
+
+
+def _upsert(connection, table, rows):
+    """Insert rows, replacing any with the same id"""
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        columns = {column.name: statement.excluded[column.name] for column in table.columns if column.name != 'id'}
+        connection.execute(statement.on_conflict_do_update(index_elements=['id'], set_=columns), rows)
+        return
+    connection.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+    connection.execute(table.insert(), rows)
+
+
+def _copy_mirrors(source, target, company_id, user_ids=None):
+    """Upsert the company row and its users (or just `user_ids`) from the shared database into `target`"""
+    companies, users = Company.__table__, User.__table__
+    rows = source.execute(select(companies).where(companies.c.id == company_id)).mappings().all()
+    _upsert(target, companies, [dict(row) for row in rows])
+    query = select(users).where(users.c.company_id == company_id).order_by(users.c.id)
+    if user_ids is not None:
+        query = query.where(users.c.id.in_(list(user_ids)))
+    _upsert(target, users, [dict(row) for row in source.execute(query).mappings()])
+
+
+def mirror_company(company_id, user_ids=None):
+    """Refresh the copies of a company's row and users in its dedicated database, if it has one"""
+    router = tenant_router()
+    database = router.database_for(company_id) if router is not None else None
+    if database is None:
+        return
+    with _engine(None).connect() as source, _engine(database).begin() as target:
+        _copy_mirrors(source, target, company_id, None if user_ids is None else set(user_ids))
+
+
+def create_tenant_schema(engine):
+    """Create any missing tables in a dedicated database"""
+    db.metadata.create_all(bind=engine)
+
+
+def _company_rows(table, company_id):
+    """Where clause for a company's rows of a tenant table"""
+    link = TENANT_TABLES.get(table.name)
+    if link is None:
+        return table.c.company_id == company_id
+    column, parent_name = link
+    parent = db.metadata.tables[parent_name]
+    return table.c[column].in_(select(parent.c.id).where(_company_rows(parent, company_id)))
+
+
+def sync_table(source, target, table, company_id, batch_size=1000):
+    """
+    Upsert a company's rows of one table from `source` into `target`,
+    writing only rows that are missing or differ. Returns (ids in the
+    source, rows written). Raises TenantMoveError if an id is already
+    used by another company in the target.
+    """
+    company_rows = _company_rows(table, company_id)
+    seen = set()
+    written = 0
+    last_id = 0
+    while True:
+        rows = source.execute(
+            select(table).where(company_rows, table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return seen, written
+        ids = [row.id for row in rows]
+        last_id = ids[-1]
+        seen.update(ids)
+
+        taken = target.execute(select(table.c.id).where(table.c.id.in_(ids), not_(company_rows)).limit(5)).scalars().all()
+        if taken:
+            raise TenantMoveError(f"{table.name} ids {taken} are already used in the target database")
+        existing = {row.id: row for row in target.execute(select(table).where(table.c.id.in_(ids)))}
+        changed = [row._asdict() for row in rows if existing.get(row.id) != row]
+        _upsert(target, table, changed)
+        target.commit()
+        written += len(changed)
+
+
+def delete_company_rows(connection, table, company_id, keep=(), batch_size=1000):
+    """Delete a company's rows of one table, except ids in `keep`, in batches; returns how many"""
+    company_rows = _company_rows(table, company_id)
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = connection.execute(
+            select(table.c.id).where(company_rows, table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        last_id = ids[-1]
+        doomed = [row_id for row_id in ids if row_id not in keep]
+        if doomed:
+            connection.execute(delete(table).where(table.c.id.in_(doomed)))
+            connection.commit()
+            deleted += len(doomed)
+
+
+def sync_company(source, target, company_id, batch_size=1000):
+    """Make the target's copy of a company's tenant rows match the source; returns rows written and deleted"""
+    tables = tenant_tables()
+    seen = {}
+    written = deleted = 0
+    for table in tables:
+        seen[table.name], count = sync_table(source, target, table, company_id, batch_size)
+        written += count
+    # Rows deleted from the source since an earlier pass; children first
+    for table in reversed(tables):
+        deleted += delete_company_rows(target, table, company_id, keep=seen[table.name], batch_size=batch_size)
+    return written, deleted
+
+
+def _advance_sequences(connection):
+    """Rows were inserted with explicit ids; move PostgreSQL id sequences past them"""
+    if connection.dialect.name != 'postgresql':
+        return
+    for table in tenant_tables():
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('\"{table.name}\"', 'id'), "
+            f"GREATEST((SELECT max(id) FROM \"{table.name}\"), 1))"
+        ))
+    connection.commit()
+
+
+def _set_company(company_id, **values):
+    db.session.execute(update(Company).where(Company.id == company_id).values(**values))
+    db.session.commit()
+    current_app.extensions['tenancy'].invalidate()
+
+
+def move_company(company_id, database, batch_size=1000, settle=1.0, log=print):
+    """
+    Move a company's rows to `database` (a TENANT_DATABASE_URLS name, or
+    None for the shared database) while it stays online. Its writes are
+    paused only for the final pass, which copies what changed during the
+    first one.
+    """
+    router = current_app.extensions['tenancy']
+    company = db.session.get(Company, company_id)
+    if company is None:
+        raise TenantMoveError(f"Company {company_id} does not exist")
+    if database is not None and database not in router.databases:
+        raise TenantMoveError(f"Unknown database '{database}'; configure it in TENANT_DATABASE_URLS")
+    source_name = company.database_name
+    db.session.rollback()
+    if source_name == database:
+        log(f"Company {company_id} is already in the {database or SHARED} database")
+        return
+    # Processes reload the company map at most `ttl` seconds apart
+    wait = router.ttl + settle
+
+    source_engine, target_engine = _engine(source_name), _engine(database)
+    create_tenant_schema(target_engine)
+    if database is not None:
+        with _engine(None).connect() as shared, target_engine.begin() as target:
+            _copy_mirrors(shared, target, company_id)
+    with source_engine.connect() as source, target_engine.connect() as target:
+        written, _ = sync_company(source, target, company_id, batch_size)
+        log(f"Copied {written} row(s) to the {database or SHARED} database; pausing writes for company {company_id}")
+
+        _set_company(company_id, database_locked=True)
+        try:
+            time.sleep(wait)
+            source.rollback()
+            written, deleted = sync_company(source, target, company_id, batch_size)
+            _advance_sequences(target)
+            log(f"Final pass wrote {written} and deleted {deleted} row(s)")
+            _set_company(company_id, database_name=database, database_locked=False)
+        except BaseException:
+            db.session.rollback()
+            _set_company(company_id, database_locked=False)
+            raise
+        bump_company_version(company_id)
+
+        # Stale maps may still read the old copy until they reload
+        time.sleep(wait)
+        removed = sum(delete_company_rows(source, table, company_id, batch_size=batch_size)
+                      for table in reversed(tenant_tables()))
+        if source_name is not None:
+            source.execute(delete(User.__table__).where(User.__table__.c.company_id == company_id))
+            source.execute(delete(Company.__table__).where(Company.__table__.c.id == company_id))
+            source.commit()
+    log(f"Company {company_id} now uses the {database or SHARED} database; removed {removed} old row(s)")
+
+
+def init_tenancy(app):
+    router = TenantRouter(
+        app.config.get('TENANT_DATABASE_URLS', {}),
+        ttl=app.config.get('TENANT_MAP_TTL', 10),
+        worker_database=app.config.get('TENANT_DATABASE') or None,
+    )
+    app.extensions['tenancy'] = router
+
+    @app.errorhandler(TenantMovingError)
+    def tenant_moving(e):
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, int(router.ttl)))
+        return response
+
+    @app.cli.command('tenant-move')
+    @click.argument('company_id', type=int)
+    @click.argument('database')
+    @click.option('--batch-size', type=int, default=None)
+    @click.option('--settle', type=float, default=1.0,
+                  help='Extra seconds to wait, beyond TENANT_MAP_TTL, for in-flight writes to finish')
+    def move_command(company_id, database, batch_size, settle):
+        """Move a company to a dedicated database, or back with DATABASE=shared"""
+        with app.app_context():
+            try:
+                move_company(company_id, None if database == SHARED else database,
+                             batch_size or app.config.get('TENANT_MOVE_BATCH_SIZE', 1000), settle=settle)
+            except TenantMoveError as e:
+                raise click.ClickException(str(e))
+
+    @app.cli.command('tenant-databases')
+    def databases_command():
+        """List the dedicated databases and the companies in each"""
+        with app.app_context():
+            companies = router.companies()
+        for name in sorted(router.databases):
+            ids = sorted(company_id for company_id, (database, _) in companies.items() if database == name)
+            print(f"{name}: {', '.join(map(str, ids)) or 'no companies'}")
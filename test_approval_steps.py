@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Tests for approval step quorum evaluation
+"""
+
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from app import create_app
+from approval_steps import (
+    STEP_ACTIVE, STEP_APPROVED, STEP_REJECTED, STEP_WAITING, build_steps, required_approvals, step_outcome,
+)
+from extensions import db
+from models import (
+    Approval, ApprovalRule, ApprovalRuleApprover, ApprovalRuleType, ApprovalStep, Company, Expense,
+    ExpenseCategory, ExpenseStatus, User, UserRole,
+)
+from routes import create_approval_workflow, decide_approval
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'steps.db'}",
+        'ASSETS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def test_required_approvals():
+    assert required_approvals(3) == 3
+    assert required_approvals(3, 60) == 2
+    assert required_approvals(4, 50) == 2
+    assert required_approvals(5, 1) == 1
+    assert required_approvals(2, 100) == 2
+
+
+def test_quorum_closes_early():
+    assert step_outcome(2, 3, 1, 0) is None
+    assert step_outcome(2, 3, 2, 0) == STEP_APPROVED
+    # Two rejections out of three leave the 2-approval quorum unreachable
+    assert step_outcome(2, 3, 1, 1) is None
+    assert step_outcome(2, 3, 0, 2) == STEP_REJECTED
+
+
+def test_hybrid_specific_approver():
+    assert step_outcome(3, 3, 1, 0, 'approved') == STEP_APPROVED
+    # Quorum lost, but the specific approver can still approve the step alone
+    assert step_outcome(3, 3, 0, 1, 'pending') is None
+    assert step_outcome(3, 3, 0, 2, 'rejected') == STEP_REJECTED
+
+
+def test_build_steps():
+    approvals = [SimpleNamespace(sequence=s, approver_id=a)
+                 for s, a in ((1, 1), (2, 2), (2, 3), (2, 4), (3, 5), (3, 9))]
+    rules = {
+        2: SimpleNamespace(id=5, rule_type=ApprovalRuleType.PERCENTAGE, percentage_required=50,
+                           specific_approver_id=None),
+        3: SimpleNamespace(id=6, rule_type=ApprovalRuleType.HYBRID, percentage_required=None,
+                           specific_approver_id=9),
+    }
+    steps = build_steps(1, approvals, rules)
+    assert [(s.sequence, s.status, s.required, s.total) for s in steps] == [
+        (1, STEP_ACTIVE, 1, 1), (2, STEP_WAITING, 2, 3), (3, STEP_WAITING, 2, 2),
+    ]
+    assert (steps[2].rule_id, steps[2].specific_approver_id, steps[2].specific_status) == (6, 9, 'pending')
+    # The HYBRID approver 7 has no approval in step 3, so the step is a plain percentage step
+    rules[3].specific_approver_id = 7
+    assert build_steps(1, approvals, rules)[2].specific_approver_id is None
+
+
+def test_hybrid_step_with_specific_approver_in_chain_rejects(app):
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    users = {}
+    for name, role in (('boss', UserRole.MANAGER), ('a1', UserRole.MANAGER), ('a2', UserRole.MANAGER),
+                       ('emp', UserRole.EMPLOYEE)):
+        users[name] = User(email=f'{name}@example.com', password_hash='x', first_name=name, last_name='User',
+                           role=role, company_id=company.id)
+        db.session.add(users[name])
+    db.session.flush()
+    users['emp'].manager_id = users['boss'].id
+    category = ExpenseCategory(name='Travel', company_id=company.id)
+    rule = ApprovalRule(name='Board', rule_type=ApprovalRuleType.HYBRID, min_amount=0, percentage_required=50,
+                        specific_approver_id=users['boss'].id, company_id=company.id)
+    db.session.add_all([category, rule])
+    db.session.flush()
+    db.session.add_all([ApprovalRuleApprover(rule_id=rule.id, approver_id=users[name].id, sequence=i)
+                        for i, name in enumerate(('a1', 'a2', 'boss'))])
+    expense = Expense(title='Trip', amount=100, currency='INR', amount_in_company_currency=100,
+                      expense_date=date(2025, 1, 1), status=ExpenseStatus.DRAFT,
+                      employee_id=users['emp'].id, company_id=company.id, category_id=category.id)
+    db.session.add(expense)
+    db.session.flush()
+    create_approval_workflow(expense)
+    db.session.commit()
+
+    def decide(name, decision):
+        approval = Approval.query.filter_by(expense_id=expense.id, approver_id=users[name].id).one()
+        step = ApprovalStep.query.filter_by(expense_id=expense.id, sequence=approval.sequence).one()
+        decide_approval(approval, step, decision, None, users[name].id)
+        db.session.commit()
+        return step
+
+    decide('boss', STEP_APPROVED)
+    decide('a1', STEP_REJECTED)
+    step = decide('a2', STEP_REJECTED)
+    assert (step.total, step.specific_approver_id, step.status) == (2, None, STEP_REJECTED)
+    assert db.session.get(Expense, expense.id).status == ExpenseStatus.REJECTED
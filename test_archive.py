@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Tests for the expense archive tables
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from archive import (
+    ARCHIVED_MODELS, RestoreConflictError, archivable_ids, archive_batch, expense_history_page, restore_expense,
+)
+from extensions import db
+from models import (
+    Approval, ArchivedApproval, ArchivedExpense, Company, Expense, ExpenseCategory, ExpenseStatus, User, UserRole,
+)
+
+
+def test_archive_tables_mirror_live_tables():
+    for live, archived, key in ARCHIVED_MODELS:
+        live_columns = [column.name for column in live.__table__.columns]
+        assert [column.name for column in archived.__table__.columns] == live_columns + ['archived_at']
+        assert key in live_columns
+
+
+def test_archive_foreign_keys():
+    targets = {fk.parent.name: fk.target_fullname for fk in ArchivedApproval.__table__.foreign_keys}
+    assert targets['expense_id'] == 'expense_archive.id'
+    assert targets['approver_id'] == 'user.id'
+    # Duplicates may point at a live or an archived expense
+    assert not ArchivedExpense.__table__.c.duplicate_of_id.foreign_keys
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'archive.db'}", 'ASSETS_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def admin(app):
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    user = User(email='admin@example.com', password_hash='x', first_name='Ada', last_name='Admin',
+                role=UserRole.ADMIN, company_id=company.id)
+    db.session.add_all([user, ExpenseCategory(name='Travel', company_id=company.id)])
+    db.session.commit()
+    return user
+
+
+def add_expense(user, title, status=ExpenseStatus.APPROVED, days_old=400):
+    old = datetime.utcnow() - timedelta(days=days_old)
+    expense = Expense(title=title, amount=10, currency='INR', amount_in_company_currency=10,
+                      expense_date=old.date(), status=status, employee_id=user.id, company_id=user.company_id,
+                      category_id=ExpenseCategory.query.first().id, created_at=old, updated_at=old)
+    db.session.add(expense)
+    db.session.flush()
+    db.session.add(Approval(expense_id=expense.id, approver_id=user.id, status='approved', sequence=1))
+    db.session.commit()
+    return expense.id
+
+
+def test_archive_and_restore_move_every_row(admin):
+    first, second, newest = (add_expense(admin, title) for title in ('first', 'second', 'newest'))
+    cutoff = datetime.utcnow() - timedelta(days=365)
+
+    # The newest expense owns the newest expense and approval rows, so it stays live
+    assert archive_batch(cutoff) == 2
+    assert archive_batch(cutoff) == 0
+    assert [e.id for e in Expense.query] == [newest]
+    assert {a.expense_id for a in ArchivedApproval.query} == {first, second}
+
+    assert restore_expense(first, actor_id=admin.id).title == 'first'
+    assert Approval.query.filter_by(expense_id=first).count() == 1
+    assert db.session.get(ArchivedExpense, first) is None
+    assert restore_expense(first) is None
+
+    # The restore counts as an update, so the next run leaves it live
+    assert first not in [expense_id for expense_id, _ in archivable_ids(cutoff, 10)]
+    assert archive_batch(cutoff) == 0
+    assert db.session.get(Expense, first) is not None
+
+
+def test_expense_owning_newest_child_row_stays_live(admin):
+    first, second = add_expense(admin, 'first'), add_expense(admin, 'second')
+    add_expense(admin, 'open', status=ExpenseStatus.DRAFT)
+    db.session.add(Approval(expense_id=first, approver_id=admin.id, status='approved', sequence=2))
+    db.session.commit()
+
+    assert archive_batch(datetime.utcnow() - timedelta(days=365)) == 1
+    assert db.session.get(ArchivedExpense, second) is not None
+    assert db.session.get(Expense, first) is not None
+
+
+def test_restore_refuses_reused_ids(app, admin):
+    archived = add_expense(admin, 'archived')
+    newest = add_expense(admin, 'newest')
+    archive_batch(datetime.utcnow() - timedelta(days=365))
+    # Deleting the newest rows frees their ids, and the next approval takes the archived one's id
+    Approval.query.filter_by(expense_id=newest).delete()
+    db.session.delete(db.session.get(Expense, newest))
+    db.session.commit()
+    add_expense(admin, 'reuses the ids', status=ExpenseStatus.DRAFT)
+
+    with pytest.raises(RestoreConflictError):
+        restore_expense(archived)
+    assert db.session.get(ArchivedExpense, archived) is not None
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(admin.id)
+        response = client.post(f'/api/expenses/{archived}/restore')
+    assert response.status_code == 409
+
+
+def test_history_page_merges_live_and_archived(admin):
+    ids = [add_expense(admin, f'expense {i}', days_old=400 - i) for i in range(4)]
+    archive_batch(datetime.utcnow() - timedelta(days=365), batch_size=2)
+
+    page = expense_history_page(admin, 1, 3)
+    assert page.total == 4
+    assert [(e.id, isinstance(e, ArchivedExpense)) for e in page.items] == [
+        (ids[3], False), (ids[2], False), (ids[1], True)]
+    assert [e.id for e in expense_history_page(admin, 2, 3).items] == [ids[0]]
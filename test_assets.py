@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for the static asset pipeline
+"""
+
+import gzip
+import json
+
+from werkzeug.http import parse_accept_header
+
+from assets import build_assets, minify_css, minify_js, pick_encoding
+
+
+def test_js_literals_and_comments():
+    source = '''
+        // greeting
+        var url = "http://example.com/a  b"; /* block */
+        const html = `<b>  ${ items.map(i => `<i>${ i }</i>`).join(' ') }  </b>`;
+        var re = /\\/\\/[a-z]+/g, half = total / 2;
+    '''
+    assert minify_js(source) == (
+        'var url="http://example.com/a  b";'
+        "const html=`<b>  ${items.map(i=>`<i>${i}</i>`).join(' ')}  </b>`;"
+        'var re=/\\/\\/[a-z]+/g,half=total/2;'
+    )
+
+
+def test_js_keeps_tokens_and_line_breaks_apart():
+    assert minify_js('a - -b') == 'a- -b'
+    assert minify_js('return typeof x') == 'return typeof x'
+    # Dropping this line break would change automatic semicolon insertion
+    assert minify_js('let a = b\n(c || d).run()') == 'let a=b\n(c||d).run()'
+
+
+def test_css_minification():
+    source = '''
+        /* theme */
+        .card :hover,
+        .card > .title {
+            content: "a  ;  b";
+            margin: 0 auto;
+        }
+    '''
+    assert minify_css(source) == '.card :hover,.card>.title{content:"a  ;  b";margin:0 auto}'
+
+
+def test_build_writes_hashed_and_compressed_files(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'js').mkdir(parents=True)
+    (static / 'js' / 'app.js').write_text('function  add(a, b) {\n    return a + b;\n}\n')
+    (static / 'logo.svg').write_text('<svg/>')
+    out = tmp_path / 'build'
+
+    manifest = build_assets(str(static), str(out))
+    target = manifest['js/app.js']
+    assert list(manifest) == ['js/app.js']
+    assert target.startswith('js/app.') and target.endswith('.js')
+    assert (out / target).read_text() == 'function add(a,b){return a+b;}'
+    assert gzip.decompress((out / (target + '.gz')).read_bytes()) == (out / target).read_bytes()
+    assert json.loads((out / 'manifest.json').read_text()) == manifest
+
+    # Same content, same name
+    assert build_assets(str(static), str(out)) == manifest
+
+
+def test_pick_encoding():
+    accept = parse_accept_header('gzip, deflate, br')
+    assert pick_encoding(accept, {'.gz', '.br'}) == ('br', '.br')
+    assert pick_encoding(accept, {'.gz'}) == ('gzip', '.gz')
+    assert pick_encoding(parse_accept_header('identity'), {'.gz', '.br'}) == (None, '')
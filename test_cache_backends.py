@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Tests for the pluggable cache backends
+"""
+
+import time
+
+import pytest
+
+from cache_backends import FileSystemCache, LocalCache, Namespace, RedisCache, backend_from_url
+from loadtest.mock_services import MockRedis
+from models import UserRole
+from user_cache import CompanySnapshot, UserCache, UserSnapshot
+
+
+@pytest.fixture
+def redis_server():
+    with MockRedis() as server:
+        yield server
+
+
+def test_local_cache_lru_ttl_and_counters():
+    cache = LocalCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=0.05)
+    cache.get('a')
+    cache.set('c', 3)  # evicts b
+    assert cache.get_many(['a', 'b', 'c']) == [1, None, 3]
+    assert cache.evictions == 1
+    cache.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+    assert cache.incr('v') == 1 and cache.incr('v', 2) == 3 and cache.counter('v') == 3
+
+
+def test_filesystem_cache_is_shared_between_instances(tmp_path):
+    first, second = FileSystemCache(str(tmp_path)), FileSystemCache(str(tmp_path))
+    first.set('rates', {'USD': 1.0})
+    first.set('short', 'x', ttl=0.01)
+    assert second.get('rates') == {'USD': 1.0}
+    time.sleep(0.02)
+    assert second.get('short') is None
+    first.incr('version:1')
+    assert second.incr('version:1') == 2
+
+    first.max_entries = 1
+    first.prune()
+    assert first.size() == 1
+
+
+def test_redis_cache_against_stand_in(redis_server):
+    cache = backend_from_url(redis_server.url)
+    other = RedisCache.from_url(redis_server.url)
+    cache.set('countries', ['India'], ttl=5)
+    assert other.get_many(['countries', 'missing']) == [['India'], None]
+    other.delete('countries')
+    assert cache.get('countries') is None
+    assert cache.incr('n') == 1 and other.counter('n') == 1
+
+    cache.clear()
+    assert other.counter('n') == 0
+
+
+def test_redis_outage_is_a_miss():
+    cache = RedisCache(port=1, retry_after=60)
+    cache.set('k', 'v')
+    assert cache.get('k') is None
+    assert cache.counter('k') is None
+
+
+def test_namespace_bump_in_one_worker_invalidates_all(redis_server):
+    worker_a = Namespace(RedisCache.from_url(redis_server.url), 'stats')
+    worker_b = Namespace(RedisCache.from_url(redis_server.url), 'stats')
+    worker_a.set(1, 'dashboard', {'total': 3})
+    worker_a.set(2, 'dashboard', {'total': 9})
+    assert worker_b.get(1, 'dashboard') == {'total': 3}
+
+    worker_b.bump(1)
+    assert worker_a.get(1, 'dashboard') is None
+    assert worker_a.get(2, 'dashboard') == {'total': 9}
+
+
+def test_user_cache_company_invalidation_across_workers(tmp_path):
+    worker_a = UserCache(backend=FileSystemCache(str(tmp_path)))
+    worker_b = UserCache(backend=FileSystemCache(str(tmp_path)))
+    worker_a.set(UserSnapshot(
+        id=1, email='user1@example.com', first_name='Ada', last_name='Lovelace', role=UserRole.ADMIN,
+        company_id=10, manager_id=None, active=True, company=CompanySnapshot(10, 'Acme', 'India', 'INR'),
+    ))
+    assert worker_b.get(1).email == 'user1@example.com'
+    worker_b.invalidate_company(10)
+    assert worker_a.get(1) is None
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for read/write routing between a primary and a replica SQLite file
+"""
+
+import os
+import tempfile
+
+from flask import Flask, jsonify
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+
+from db_routing import RoutingSession, configure_binds, init_db_routing, read_only, sync_sqlite_replica
+
+
+def create_routing_app(tmpdir):
+    primary = os.path.join(tmpdir, 'primary.db')
+    replica = os.path.join(tmpdir, 'replica.db')
+
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'test'
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{primary}'
+    app.config['DB_REPLICA_URLS'] = [f'sqlite:///{replica}']
+    app.config['DB_READ_YOUR_WRITES_SECONDS'] = 60
+    app.config['DB_POOL_SIZE'] = 3
+    configure_binds(app)
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+    init_db_routing(app, db)
+
+    class Note(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        body = db.Column(db.String(50))
+
+    @app.route('/count')
+    @read_only
+    def count():
+        return jsonify({'count': Note.query.count()})
+
+    @app.route('/count/primary')
+    def count_primary():
+        return jsonify({'count': db.session.execute(text('SELECT COUNT(*) FROM note')).scalar()})
+
+    @app.route('/write', methods=['POST'])
+    def write():
+        db.session.add(Note(body='x'))
+        db.session.commit()
+        return jsonify({'ok': True})
+
+    with app.app_context():
+        db.create_all()
+        db.session.add(Note(body='synced'))
+        db.session.commit()
+    sync_sqlite_replica(primary, replica)
+
+    return app, db, primary, replica
+
+
+def test_read_only_views_use_replica():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app, db, primary, replica = create_routing_app(tmpdir)
+        with app.app_context():
+            # A row the replica has not seen yet
+            db.session.execute(text("INSERT INTO note (body) VALUES ('unsynced')"))
+            db.session.commit()
+
+        client = app.test_client()
+        assert client.get('/count').get_json()['count'] == 1
+        assert client.get('/count/primary').get_json()['count'] == 2
+
+        sync_sqlite_replica(primary, replica)
+        assert client.get('/count').get_json()['count'] == 2
+
+        with app.app_context():
+            db.engines['replica_0'].dispose()
+            db.engines[None].dispose()
+
+
+def test_read_your_writes_window():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app, db, primary, replica = create_routing_app(tmpdir)
+        writer = app.test_client()
+        other = app.test_client()
+
+        writer.post('/write')
+        # The writer sticks to the primary; everyone else reads the lagging replica
+        assert writer.get('/count').get_json()['count'] == 2
+        assert other.get('/count').get_json()['count'] == 1
+
+        with app.app_context():
+            db.engines['replica_0'].dispose()
+            db.engines[None].dispose()
+
+
+def test_engine_options_per_bind():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app, db, primary, replica = create_routing_app(tmpdir)
+        with app.app_context():
+            assert db.engines[None].pool.size() == 3
+            assert db.engines[None].pool._pre_ping
+            with db.engines['replica_0'].connect() as conn:
+                assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+                assert conn.exec_driver_sql('PRAGMA query_only').scalar() == 1
+            db.engines['replica_0'].dispose()
+            db.engines[None].dispose()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the event broker and server-sent event formatting
+"""
+
+import json
+import time
+
+from events import LocalBroker, PubSubBroker, format_sse, stream_events
+from loadtest.mock_services import MockPubSub
+
+
+def test_publish_reaches_only_the_users_streams():
+    broker = LocalBroker()
+    mine = broker.subscribe(1)
+    other = broker.subscribe(2)
+
+    broker.publish(1, {'type': 'approval.activated', 'approval_id': 5})
+    assert mine.get(timeout=1)['approval_id'] == 5
+    assert other.get(timeout=0.01) is None
+
+    mine.close()
+    other.close()
+    assert broker.subscriber_count() == 0
+
+
+def test_reconnect_replays_events_after_last_event_id():
+    broker = LocalBroker()
+    broker.publish(1, {'type': 'expense.status', 'status': 'pending_approval'})
+    broker.publish(1, {'type': 'expense.status', 'status': 'approved'})
+    first_id = broker._recent[1][0]['id']
+
+    subscription = broker.subscribe(1, last_event_id=first_id)
+    assert subscription.get(timeout=1)['status'] == 'approved'
+    assert subscription.get(timeout=0.01) is None
+
+
+def test_stream_frames_and_keepalive():
+    broker = LocalBroker()
+    subscription = broker.subscribe(1)
+    broker.publish(1, {'type': 'expense.status', 'status': 'rejected'})
+
+    frames = list(stream_events(subscription, keepalive=0.05, max_duration=0.12, retry_ms=1000))
+    assert frames[0] == 'retry: 1000\n\n'
+    assert frames[1].startswith('id: ') and 'event: expense.status\n' in frames[1]
+    assert json.loads(frames[1].split('data: ', 1)[1])['status'] == 'rejected'
+    assert ': keepalive\n\n' in frames[2:]
+    assert broker.subscriber_count() == 0
+
+
+def test_format_sse():
+    assert format_sse({'id': 3, 'type': 'x'}) == 'id: 3\nevent: x\ndata: {"id": 3, "type": "x"}\n\n'
+
+
+def test_pubsub_broker_relays_between_processes():
+    with MockPubSub() as server:
+        sender = PubSubBroker(server.url)
+        receiver = PubSubBroker(server.url)
+        subscription = receiver.subscribe(7)
+
+        deadline = time.monotonic() + 5
+        while server.subscriber_count('expense-events') < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        sender.publish(7, {'type': 'approval.activated', 'approval_id': 9})
+        assert subscription.get(timeout=5)['approval_id'] == 9
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Tests for buffering expense events until commit
+"""
+
+from types import SimpleNamespace
+
+from expense_log import PENDING_LOG_KEY, _discard_pending, record_transition
+from models import ExpenseStatus
+
+
+def test_transitions_are_buffered_on_the_session():
+    session = SimpleNamespace(info={})
+    expense = SimpleNamespace(id=7, company_id=3)
+    approval = SimpleNamespace(id=11)
+
+    record_transition(session, expense, 'approval.status', 'pending', 'approved', approval=approval, actor_id=2)
+    record_transition(session, expense, 'expense.status', ExpenseStatus.PENDING_APPROVAL, ExpenseStatus.APPROVED,
+                      actor_id=2, note='last step')
+
+    pending = session.info[PENDING_LOG_KEY]
+    assert [(row['kind'], row['from_status'], row['to_status']) for row in pending] == [
+        ('approval.status', 'pending', 'approved'),
+        ('expense.status', 'pending_approval', 'approved'),
+    ]
+    assert pending[0]['approval_id'] == 11 and pending[0]['payload'] is None
+    assert pending[1]['approval_id'] is None and pending[1]['payload'] == '{"note": "last step"}'
+    assert all(row['expense_id'] == 7 and row['company_id'] == 3 for row in pending)
+
+
+def test_unchanged_status_is_not_logged():
+    session = SimpleNamespace(info={})
+    record_transition(session, SimpleNamespace(id=1, company_id=1), 'expense.status',
+                      ExpenseStatus.PENDING_APPROVAL, 'pending_approval')
+    assert PENDING_LOG_KEY not in session.info
+
+
+def test_rollback_discards_buffered_events():
+    session = SimpleNamespace(info={})
+    record_transition(session, SimpleNamespace(id=1, company_id=1), 'expense.status', None, 'submitted')
+    _discard_pending(session)
+    assert PENDING_LOG_KEY not in session.info
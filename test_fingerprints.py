@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests for duplicate-submission fingerprints
+"""
+
+import random
+from datetime import date
+from decimal import Decimal
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from fingerprints import (
+    compute_fingerprints, difference_hash, fields_fingerprint, hamming, normalize_merchant, phash_bands,
+)
+
+
+def make_receipt(path, seed=1):
+    rng = random.Random(seed)
+    image = Image.new('RGB', (400, 600), 'white')
+    draw = ImageDraw.Draw(image)
+    for line in range(20):
+        width = rng.randint(80, 360)
+        draw.rectangle([20, 20 + line * 28, 20 + width, 36 + line * 28], fill='black')
+    image.save(path)
+    return image
+
+
+def test_merchant_normalization():
+    assert normalize_merchant('Starbucks Coffee, Inc.') == 'starbucks coffee'
+    assert normalize_merchant('STARBUCKS  COFFEE') == 'starbucks coffee'
+    assert normalize_merchant(None) == ''
+
+
+def test_fields_fingerprint():
+    day = date(2024, 3, 1)
+    base = fields_fingerprint(Decimal('1234.40'), day, 'Hotel Adlon GmbH')
+    # Conversion rounding and merchant spelling don't change it
+    assert fields_fingerprint(Decimal('1234.0012'), day, 'hotel adlon') == base
+    assert fields_fingerprint(Decimal('1235.00'), day, 'Hotel Adlon') != base
+    assert fields_fingerprint(Decimal('1234.40'), date(2024, 3, 2), 'Hotel Adlon') != base
+    # Amount and date alone are too common to call a duplicate
+    assert fields_fingerprint(Decimal('1234.40'), day, '') is None
+
+
+def test_rephotographed_receipt_is_close(tmp_path):
+    original = make_receipt(tmp_path / 'original.png')
+    # Re-photographed: smaller, slightly darker, saved as JPEG
+    ImageEnhance.Brightness(original.resize((300, 450))).enhance(0.85).save(tmp_path / 'photo.jpg', quality=70)
+    make_receipt(tmp_path / 'other.png', seed=2)
+
+    a = difference_hash(tmp_path / 'original.png')
+    b = difference_hash(tmp_path / 'photo.jpg')
+    c = difference_hash(tmp_path / 'other.png')
+    assert hamming(a, b) <= 6
+    assert hamming(a, c) > 6
+    assert set(phash_bands(a)) & set(phash_bands(b))
+
+
+def test_non_image_receipt(tmp_path):
+    path = tmp_path / 'receipt.pdf'
+    path.write_bytes(b'%PDF-1.4 not really')
+    assert difference_hash(path) is None
+
+    kinds = [kind for kind, _, _ in compute_fingerprints(path, Decimal('10'), date(2024, 1, 1), 'Cafe')]
+    assert kinds == ['content', 'fields']
+
+
+def test_image_fingerprints(tmp_path):
+    make_receipt(tmp_path / 'r.png')
+    fingerprints = compute_fingerprints(tmp_path / 'r.png')
+    bands = [fp for fp in fingerprints if fp[0] == 'phash']
+    assert len(bands) == 8
+    assert len({value for _, value, _ in bands}) == 8
+    assert len({detail for _, _, detail in bands}) == 1
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the template fragment cache
+"""
+
+from jinja2 import Environment
+
+from fragment_cache import Deferred, FragmentCache, FragmentCacheExtension
+
+
+def test_lru_eviction_and_hit_rate():
+    cache = FragmentCache(max_size=2)
+    cache.set(('a',), 'A')
+    cache.set(('b',), 'B')
+    assert cache.get('list', ('a',)) == 'A'
+    cache.set(('c',), 'C')  # evicts b, the least recently used
+
+    assert cache.get('list', ('b',)) is None
+    assert cache.get('stats', ('c',)) == 'C'
+    stats = cache.stats()
+    assert stats['size'] == 2 and stats['evictions'] == 1
+    assert stats['hits'] == 2 and stats['misses'] == 1
+    assert stats['fragments']['list'] == {'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_company_versions_are_independent():
+    cache = FragmentCache()
+    cache.bump(1)
+    cache.bump(1)
+    assert cache.version(1) == 2
+    assert cache.version(2) == 0
+
+
+def test_deferred_runs_once_and_only_when_used():
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {'total': 3, 'items': [1, 2]}
+
+    value = Deferred(compute)
+    assert not calls
+    assert value['total'] == 3 and len(value) == 2 and value
+    assert len(calls) == 1
+
+    template = Environment().from_string('{{ stats.total }}')
+    assert template.render(stats=Deferred(lambda: {'total': 5})) == '5'
+
+
+def test_cache_tag_renders_body_outside_requests():
+    env = Environment(extensions=[FragmentCacheExtension], autoescape=True)
+    template = env.from_string(
+        "{% cache 'rows', page if not search %}<b>{{ name }}</b>{% endcache %}"
+    )
+    assert template.render(page=1, search=None, name='<x>') == '<b>&lt;x&gt;</b>'
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the historical exchange-rate table and rate file parsing
+"""
+
+import os
+import tempfile
+from datetime import date
+
+from app import create_app
+from extensions import db
+from fx_rates import RateTable, get_rate_table, parse_rate_file, record_rate
+
+ECB_CSV = """Date,USD,JPY,GBP,
+2024-01-08,1.0950,158.10,0.8600,
+2024-01-05,1.0921,158.48,0.8612,
+2024-01-04,1.0953,N/A,0.8630,
+"""
+
+
+def write_csv(content):
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as f:
+        f.write(content)
+    return path
+
+
+def build_table():
+    table = RateTable(base_currency='EUR', max_lookback_days=7)
+    path = write_csv(ECB_CSV)
+    try:
+        for row in parse_rate_file(path, 'EUR'):
+            table.add(*row)
+    finally:
+        os.remove(path)
+    table.sort()
+    return table
+
+
+def test_parse_ecb_wide_file_skips_missing_values():
+    path = write_csv(ECB_CSV)
+    try:
+        rows = list(parse_rate_file(path, 'EUR'))
+    finally:
+        os.remove(path)
+    assert ('EUR', 'USD', date(2024, 1, 5), 1.0921) in rows
+    assert not any(r[1] == 'JPY' and r[2] == date(2024, 1, 4) for r in rows)
+    assert len(rows) == 8
+
+
+def test_parse_long_file():
+    path = write_csv("date,from_currency,to_currency,rate\n2024-02-01,USD,INR,83.05\n")
+    try:
+        assert list(parse_rate_file(path)) == [('USD', 'INR', date(2024, 2, 1), 83.05)]
+    finally:
+        os.remove(path)
+
+
+def test_exact_and_prior_business_day_lookup():
+    table = build_table()
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 5)) == 1.0921
+    # Saturday and Sunday fall back to Friday's rate
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 6)) == 1.0921
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 7)) == 1.0921
+    # Before the first rate, or beyond the lookback window, there is no rate
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 3)) is None
+    assert table.rate_on('EUR', 'USD', date(2024, 2, 1)) is None
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 6), max_lookback_days=0) is None
+
+
+def test_inverse_and_cross_rates():
+    table = build_table()
+    assert abs(table.rate_on('USD', 'EUR', date(2024, 1, 5)) - 1 / 1.0921) < 1e-12
+    assert abs(table.rate_on('GBP', 'USD', date(2024, 1, 5)) - 1.0921 / 0.8612) < 1e-12
+    assert table.rate_on('USD', 'USD', date(2000, 1, 1)) == 1.0
+    assert table.rate_on('USD', 'XXX', date(2024, 1, 5)) is None
+
+
+def test_insert_keeps_order_and_existing_day():
+    table = build_table()
+    table.insert('EUR', 'USD', date(2024, 1, 6), 1.5)
+    table.insert('EUR', 'USD', date(2024, 1, 5), 9.9)
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 5)) == 1.0921
+    assert table.rate_on('EUR', 'USD', date(2024, 1, 7)) == 1.5
+
+
+def test_recorded_rate_reaches_the_table_only_on_commit(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'fx.db'}", 'ASSETS_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        day = date(2025, 3, 3)
+        assert get_rate_table().rate_on('USD', 'INR', day) is None
+
+        record_rate('USD', 'INR', day, 83.1)
+        db.session.rollback()
+        assert get_rate_table().rate_on('USD', 'INR', day) is None
+
+        record_rate('USD', 'INR', day, 83.2)
+        db.session.commit()
+        assert get_rate_table().rate_on('USD', 'INR', day) == 83.2
+        db.session.remove()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared outbound HTTP client
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_client import CircuitBreaker, CircuitOpenError, OutboundClient, StaleWhileRevalidateCache, UpstreamError
+from loadtest.mock_services import MockExchangeRateAPI
+
+
+def test_circuit_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()          # one trial call
+    assert not breaker.allow()      # everyone else still waits
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stale_while_revalidate_serves_stale_and_refreshes():
+    cache = StaleWhileRevalidateCache()
+    calls = []
+    refreshed = threading.Event()
+
+    def loader():
+        calls.append(1)
+        if len(calls) > 1:
+            refreshed.set()
+        return len(calls)
+
+    assert cache.get('k', loader, fresh_for=0.01, stale_for=10) == 1
+    time.sleep(0.02)
+    assert cache.get('k', loader, fresh_for=0.01, stale_for=10) == 1   # stale value, immediately
+    assert refreshed.wait(2)
+    time.sleep(0.01)
+    assert cache.peek('k') == 2
+
+
+def test_deadline_and_breaker_against_slow_upstream():
+    client = OutboundClient(deadline=0.1, failure_threshold=2, reset_timeout=60)
+    with MockExchangeRateAPI(latency_ms=300) as api:
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                client.get_json(f"{api.api_url}/USD")
+        with pytest.raises(CircuitOpenError):
+            client.get_json(f"{api.api_url}/USD")
+        assert api.request_count == 2
+
+
+def test_failed_upstream_raises_instead_of_guessing():
+    client = OutboundClient(deadline=2)
+    with MockExchangeRateAPI(failure_rate=1.0) as api:
+        with pytest.raises(UpstreamError):
+            client.get_json(f"{api.api_url}/USD")
+    with MockExchangeRateAPI() as api:
+        assert client.get_json(f"{api.api_url}/USD")['rates']['USD'] == 1.0
+
+
+def test_deadline_covers_a_trickling_body():
+    class Trickle(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '40')
+            self.end_headers()
+            # Each byte arrives well within a read timeout; the whole body does not
+            for _ in range(40):
+                self.wfile.write(b' ')
+                self.wfile.flush()
+                time.sleep(0.05)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Trickle)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = OutboundClient(deadline=0.3)
+    try:
+        started = time.monotonic()
+        with pytest.raises(UpstreamError, match='Deadline'):
+            client.get_json(f"http://127.0.0.1:{server.server_port}/")
+        assert time.monotonic() - started < 0.6
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for the JSON provider and response compression
+"""
+
+import gzip
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask import Flask, jsonify
+from werkzeug.http import parse_accept_header
+
+import json_provider
+from json_provider import dumps_bytes, init_json, negotiate_encoding, stream_json_array
+from models import ExpenseStatus, UserRole
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config.update(JSON_COMPRESS_MIN_SIZE=100, JSON_COMPRESS_LEVEL=6)
+    init_json(app)
+    return app
+
+
+def test_native_types():
+    payload = {
+        'amount': Decimal('12.50'),
+        'expense_date': date(2025, 3, 1),
+        'created_at': datetime(2025, 3, 1, 9, 30),
+        'status': ExpenseStatus.APPROVED,
+        'role': UserRole.MANAGER,
+    }
+    assert json.loads(dumps_bytes(payload)) == {
+        'amount': 12.5,
+        'expense_date': '2025-03-01',
+        'created_at': '2025-03-01T09:30:00',
+        'status': 'approved',
+        'role': 'manager',
+    }
+
+
+def test_stdlib_fallback_matches(monkeypatch):
+    payload = {'amount': Decimal('3.10'), 'day': date(2025, 1, 2), 'status': ExpenseStatus.PENDING_APPROVAL}
+    fast = json.loads(dumps_bytes(payload))
+    monkeypatch.setattr(json_provider, 'orjson', None)
+    assert json.loads(dumps_bytes(payload)) == fast
+
+
+def test_stream_json_array():
+    app = make_app()
+    with app.test_request_context():
+        plain = stream_json_array(range(5), lambda i: {'id': i}, batch_size=2)
+        keyed = stream_json_array([], lambda i: i, key='expenses', extra={'total': 0})
+        assert json.loads(b''.join(plain.response)) == [{'id': i} for i in range(5)]
+        assert json.loads(b''.join(keyed.response)) == {'expenses': [], 'total': 0}
+
+
+def test_large_responses_are_compressed():
+    app = make_app()
+    app.add_url_rule('/big', 'big', lambda: jsonify(rows=[{'amount': Decimal('1.00')}] * 50))
+    app.add_url_rule('/small', 'small', lambda: jsonify(ok=True))
+    client = app.test_client()
+
+    big = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+    assert big.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(big.data))['rows'][0] == {'amount': 1.0}
+    assert 'Content-Encoding' not in client.get('/big').headers
+    assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+
+
+def test_negotiate_encoding(monkeypatch):
+    monkeypatch.setattr(json_provider, 'brotli', None)
+    assert negotiate_encoding(parse_accept_header('gzip, br')) == 'gzip'
+    assert negotiate_encoding(parse_accept_header('identity')) is None
+
+
+def test_session_round_trip():
+    app = make_app()
+    app.secret_key = 'test'
+    serializer = app.session_interface.get_signing_serializer(app)
+    data = {'_flashes': [('message', 'Saved')], 'when': datetime(2025, 3, 1, 9, 30, tzinfo=timezone.utc)}
+    with app.app_context():
+        assert serializer.loads(serializer.dumps(data)) == data
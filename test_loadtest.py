@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the offline load-testing harness
+"""
+
+import os
+from datetime import date
+
+import requests
+
+from loadtest.mock_services import MockCountriesAPI, MockExchangeRateAPI
+from loadtest.runner import run_load_test, serve_app
+from app import create_app
+from extensions import db
+from loadtest.ocr_bench import FIELDS, field_matches, run, stage_rows
+from loadtest.receipt_corpus import format_amount, generate_corpus, load_manifest
+from loadtest.stats import LatencyRecorder, percentile
+
+
+def test_percentile_nearest_rank():
+    values = sorted(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_recorder_summary():
+    recorder = LatencyRecorder()
+    recorder.start()
+    for ms in (10, 20, 30):
+        recorder.record('GET /dashboard', ms / 1000.0)
+    recorder.record('GET /dashboard', 0.5, ok=False)
+    recorder.finish()
+
+    row = recorder.summary()[0]
+    assert row['route'] == 'GET /dashboard'
+    assert row['requests'] == 4
+    assert row['errors'] == 1
+    assert round(row['p50_ms']) == 20
+
+
+def test_mock_exchange_rate_api():
+    with MockExchangeRateAPI() as api:
+        data = requests.get(f"{api.api_url}/EUR", timeout=5).json()
+        assert data['base'] == 'EUR'
+        assert data['rates']['EUR'] == 1.0
+        assert data['rates']['USD'] > 1.0
+        assert requests.get(f"{api.api_url}/XXX", timeout=5).status_code == 404
+
+
+def test_mock_failure_injection():
+    with MockCountriesAPI(failure_rate=1.0) as api:
+        assert requests.get(api.api_url, timeout=5).status_code == 503
+        assert api.failure_count == 1
+
+    with MockCountriesAPI() as api:
+        countries = requests.get(api.api_url, timeout=5).json()
+        assert any(c['name']['common'] == 'India' for c in countries)
+
+
+def test_receipt_corpus_is_reproducible(tmp_path):
+    first = generate_corpus(str(tmp_path / 'a'), count=6, seed=3, fonts=[])
+    second = generate_corpus(str(tmp_path / 'b'), count=6, seed=3, fonts=[])
+    assert [entry['text'] for entry in first] == [entry['text'] for entry in second]
+    assert load_manifest(str(tmp_path / 'a')) == first
+    for entry in first:
+        assert os.path.exists(tmp_path / 'a' / entry['file'])
+        assert entry['merchant'] == entry['text'].splitlines()[0]
+        assert entry['font'] == 'bitmap'
+    assert format_amount(1234.5, 2, 'european') == '1.234,50'
+    assert format_amount(1234.5, 0, 'grouped') == '1,234'
+
+
+def test_ocr_bench_scores_extractors_on_exact_text(tmp_path):
+    entries = generate_corpus(str(tmp_path), count=10, seed=5, fonts=[])
+    result = run(str(tmp_path), entries, use_ocr=False)
+    assert result['images'] == 10 and len(result['per_image']) == 10
+    assert [row['stage'] for row in stage_rows(result['samples'])][0] == 'extract_amount'
+    assert all(0 <= result['correct'][field] <= 10 for field in FIELDS)
+    assert result['correct']['category'] == 10
+
+    entry = {'amount': '12.50', 'date': '2024-03-01', 'merchant': 'Blue Door Cafe', 'currency': 'EUR'}
+    assert field_matches('amount', 12.5, entry) and not field_matches('amount', None, entry)
+    assert field_matches('date', date(2024, 3, 1), entry)
+    assert field_matches('merchant', ' blue  door cafe', entry)
+    assert not field_matches('currency', 'USD', entry)
+
+
+def test_journeys_complete_against_the_app(tmp_path):
+    with MockCountriesAPI() as countries, MockExchangeRateAPI() as rates:
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'loadtest.db'}",
+            'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+            'COUNTRIES_API_URL': countries.api_url,
+            'EXCHANGE_RATE_API_URL': rates.api_url,
+            'OCR_FORCE_MOCK': True,
+            'RATE_LIMIT_ENABLED': False,
+            'ASSETS_ENABLED': False,
+        })
+        with app.app_context():
+            db.create_all()
+        server, base_url = serve_app(app)
+        try:
+            _, completed, failures = run_load_test(base_url, users=2, iterations=2, levels=2)
+        finally:
+            server.shutdown()
+    assert failures == []
+    assert completed == 4
@@ -3,7 +3,7 @@
 Test script to demonstrate multi-level approval workflow
 """
 
-from extensions import app, db
+from app import app, db
 from models import *
 from werkzeug.security import generate_password_hash
 from decimal import Decimal
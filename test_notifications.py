@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Tests for the notification outbox, digests and SMTP delivery
+"""
+
+import smtplib
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import create_app
+from extensions import db
+from loadtest.mock_services import MockSMTP
+from models import Company, NotificationOutbox, User, UserRole
+from notifications import (
+    SmtpSender, build_digest, claim_batch, dispatch_batch, dispatch_pending, enqueue_notification, requeue_dead,
+    retry_delay,
+)
+
+Recipient = namedtuple('Recipient', ['email', 'first_name'])
+
+
+def test_digest_coalesces_items():
+    message = build_digest(Recipient('m@example.com', 'Mia'), [
+        ('approval.activated', {'title': 'Taxi', 'expense_id': 1}),
+        ('approval.activated', {'title': 'Hotel', 'expense_id': 2}),
+        ('expense.status', {'title': 'Lunch', 'expense_id': 3, 'status': 'pending_approval'}),
+    ], 'expenses@example.com')
+    body = message.get_content()
+    assert message['Subject'] == '3 expense updates'
+    assert '"Taxi" is waiting for your approval.' in body
+    assert '"Lunch" is now pending approval.' in body
+
+
+def test_retry_delay_backs_off_exponentially():
+    assert [retry_delay(n, 60) for n in (1, 2, 3)] == [60, 120, 240]
+    assert retry_delay(20, 60) == 3600
+
+
+def test_smtp_sender_against_mock_server():
+    message = build_digest(Recipient('e@example.com', 'Eve'), [('expense.status', {'title': 'Taxi', 'status': 'approved'})],
+                           'expenses@example.com')
+    with MockSMTP() as server:
+        with SmtpSender(server.host, server.port) as sender:
+            sender.send(message)
+            sender.send(message)
+        assert len(server.messages) == 2
+        assert server.messages[0]['to'] == ['e@example.com']
+        assert 'Subject: Expense status changed' in server.messages[0]['data']
+
+    with MockSMTP(failure_rate=1.0) as server:
+        with SmtpSender(server.host, server.port) as sender, pytest.raises(smtplib.SMTPException):
+            sender.send(message)
+        assert server.failure_count == 1 and not server.messages
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'notifications.db'}",
+        'ASSETS_ENABLED': False,
+        'NOTIFY_DIGEST_SECONDS': 0,
+        'NOTIFY_MAX_ATTEMPTS': 2,
+        'NOTIFY_RETRY_BASE_SECONDS': 60,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def users(app):
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    users = [User(email=f'{name}@example.com', password_hash='x', first_name=name.title(), last_name='Doe',
+                  role=UserRole.EMPLOYEE, company_id=company.id) for name in ('mia', 'eve')]
+    db.session.add_all(users)
+    db.session.commit()
+    return users
+
+
+def queue(recipient, title):
+    enqueue_notification(db.session, recipient.id, 'expense.status', title=title, status='approved')
+
+
+def test_enqueue_is_part_of_the_transaction(app, users):
+    queue(users[0], 'Taxi')
+    db.session.rollback()
+    assert NotificationOutbox.query.count() == 0
+
+    app.config['NOTIFY_DIGEST_SECONDS'] = 60
+    queue(users[0], 'Taxi')
+    db.session.commit()
+    row = NotificationOutbox.query.one()
+    assert row.status == 'pending' and row.next_attempt_at > datetime.utcnow()
+    # Not due until the digest window closes
+    assert claim_batch(10, lease_seconds=60) == []
+
+
+def test_dispatch_sends_one_digest_per_recipient(users):
+    mia, eve = users
+    for recipient, title in ((mia, 'Taxi'), (mia, 'Hotel'), (eve, 'Lunch')):
+        queue(recipient, title)
+    db.session.commit()
+
+    with MockSMTP() as server, SmtpSender(server.host, server.port) as sender:
+        assert dispatch_pending(sender) == (3, 0)
+        assert sorted(message['to'][0] for message in server.messages) == ['eve@example.com', 'mia@example.com']
+        assert 'Subject: 2 expense updates' in next(m['data'] for m in server.messages if m['to'] == [mia.email])
+    rows = NotificationOutbox.query.all()
+    assert {row.status for row in rows} == {'sent'}
+    assert all(row.claim_token is None and row.locked_until is None for row in rows)
+    assert dispatch_pending(sender) == (0, 0)
+
+
+def test_claimed_rows_are_leased_to_one_dispatcher(users):
+    queue(users[0], 'Taxi')
+    db.session.commit()
+    assert len(claim_batch(10, lease_seconds=60)) == 1
+    assert claim_batch(10, lease_seconds=60) == []
+
+
+def test_failures_back_off_then_go_dead(users):
+    queue(users[0], 'Taxi')
+    db.session.commit()
+
+    with MockSMTP(failure_rate=1.0) as server, SmtpSender(server.host, server.port) as sender:
+        before = datetime.utcnow()
+        assert dispatch_batch(sender) == (0, 1)
+        row = NotificationOutbox.query.one()
+        assert (row.status, row.attempts, row.locked_until) == ('pending', 1, None)
+        assert row.next_attempt_at >= before + timedelta(seconds=60)
+        assert dispatch_batch(sender) == (0, 0)     # backing off
+
+        row.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        assert dispatch_batch(sender) == (0, 1)
+        assert NotificationOutbox.query.one().status == 'dead'
+        assert server.failure_count == 2
+
+    assert requeue_dead() == 1
+    with MockSMTP() as server, SmtpSender(server.host, server.port) as sender:
+        assert dispatch_batch(sender) == (1, 0)
+    assert NotificationOutbox.query.one().status == 'sent'
+
+
+def test_inactive_recipient_is_dead_lettered_at_once(users):
+    users[0].is_active = False
+    queue(users[0], 'Taxi')
+    db.session.commit()
+    with MockSMTP() as server, SmtpSender(server.host, server.port) as sender:
+        assert dispatch_batch(sender) == (0, 1)
+        assert not server.messages
+    row = NotificationOutbox.query.one()
+    assert (row.status, row.attempts) == ('dead', 1)
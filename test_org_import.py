@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for org-chart parsing, reporting-line validation and importing
+"""
+
+import pytest
+from werkzeug.security import check_password_hash
+
+from app import create_app
+from extensions import db
+from models import Company, User, UserRole
+from org_import import PasswordHashers, hash_passwords, import_org_chart, order_by_hierarchy, parse_org_chart
+
+
+def rows_for(pairs):
+    return [{'email': email, 'manager_email': manager, 'row': n} for n, (email, manager) in enumerate(pairs, start=1)]
+
+
+def test_parse_csv_and_json():
+    csv_rows = parse_org_chart(b"Email,First_Name,Last_Name,Role,Manager_Email\nA@X.com,Ann,Lee,manager,\n")
+    assert csv_rows[0]['email'] == 'a@x.com' and csv_rows[0]['role'] == 'manager' and csv_rows[0]['row'] == 1
+
+    json_rows = parse_org_chart('{"users": [{"email": "b@x.com", "manager_email": "A@x.com"}]}')
+    assert json_rows[0]['manager_email'] == 'a@x.com' and json_rows[0]['password'] == ''
+
+
+def test_levels_follow_reporting_lines():
+    rows = rows_for([('e@x', 'm@x'), ('m@x', 'ceo@x'), ('ceo@x', ''), ('f@x', 'boss@x')])
+    levels, errors = order_by_hierarchy(rows, known_managers={'boss@x': 7})
+    assert errors == {}
+    assert [[row['email'] for row in level] for level in levels] == [['ceo@x', 'f@x'], ['m@x'], ['e@x']]
+
+
+def test_cycles_orphans_and_their_reports_are_rejected():
+    rows = rows_for([
+        ('a@x', 'b@x'), ('b@x', 'c@x'), ('c@x', 'a@x'),  # cycle
+        ('d@x', 'a@x'),                                  # reports into the cycle
+        ('o@x', 'ghost@x'), ('p@x', 'o@x'),              # orphan and its report
+        ('q@x', 'dup@x'),                                # manager row rejected earlier
+        ('ok@x', ''),
+    ])
+    levels, errors = order_by_hierarchy(rows, known_managers={}, failed={'dup@x'})
+    assert set(errors) == {'a@x', 'b@x', 'c@x', 'd@x', 'o@x', 'p@x', 'q@x'}
+    assert errors['a@x'].startswith('Reporting cycle')
+    assert errors['o@x'] == 'Unknown manager ghost@x'
+    assert 'could not be imported' in errors['p@x']
+    assert [[row['email'] for row in level] for level in levels] == [['ok@x']]
+
+
+def test_hash_passwords_inline():
+    hashes = hash_passwords(['secret1', 'secret2'], workers=0)
+    assert check_password_hash(hashes[0], 'secret1') and check_password_hash(hashes[1], 'secret2')
+
+
+def test_shared_hashers_keep_their_pool():
+    hashers = PasswordHashers(max_workers=1)
+    try:
+        assert check_password_hash(hash_passwords(['secret1'], chunksize=1, hashers=hashers)[0], 'secret1')
+        pool = hashers.pool
+        hash_passwords(['secret2'], chunksize=1, hashers=hashers)
+        assert hashers.pool is pool
+    finally:
+        hashers.shutdown()
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'import.db'}", 'ASSETS_ENABLED': False,
+                      'IMPORT_HASH_WORKERS': 0})
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def company_id(app):
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    db.session.add_all([
+        User(email='boss@x.com', password_hash='x', first_name='Bo', last_name='Ss', role=UserRole.MANAGER,
+             company_id=company.id),
+        User(email='clerk@x.com', password_hash='x', first_name='Cl', last_name='Erk', role=UserRole.EMPLOYEE,
+             company_id=company.id),
+    ])
+    db.session.commit()
+    return company.id
+
+
+ORG_CHART = b"""email,first_name,last_name,role,manager_email,password
+lead@x.com,Lea,Lead,manager,boss@x.com,
+dev@x.com,Dev,One,employee,lead@x.com,hunter22
+"""
+
+
+def test_import_resolves_file_and_existing_managers(company_id):
+    result = import_org_chart(parse_org_chart(ORG_CHART), company_id)
+    assert result['created'] == 2 and result['errors'] == []
+    lead, dev = (User.query.filter_by(email=email).one() for email in ('lead@x.com', 'dev@x.com'))
+    assert lead.manager.email == 'boss@x.com' and dev.manager_id == lead.id
+    assert check_password_hash(dev.password_hash, 'hunter22')
+    generated = {user['email']: user.get('generated_password') for user in result['users']}
+    assert generated['dev@x.com'] is None and check_password_hash(lead.password_hash, generated['lead@x.com'])
+
+
+def test_import_is_all_or_nothing_unless_skipping_invalid(company_id):
+    chart = ORG_CHART + b"""clerk@x.com,Cl,Erk,,,
+new@x.com,New,Hire,employee,clerk@x.com,
+,No,Email,,,
+odd@x.com,Odd,Role,wizard,,
+"""
+    result = import_org_chart(parse_org_chart(chart), company_id)
+    assert result['created'] == 0 and User.query.count() == 2
+    assert [(error['row'], error['error']) for error in result['errors']] == [
+        (3, 'Email already registered'),
+        (4, 'Manager clerk@x.com is not a manager or admin'),
+        (5, 'Missing email'),
+        (6, 'Unknown role wizard'),
+    ]
+
+    result = import_org_chart(parse_org_chart(chart), company_id, skip_invalid=True)
+    assert result['created'] == 2 and len(result['errors']) == 4
+    assert {user['email'] for user in result['users']} == {'lead@x.com', 'dev@x.com'}
+    assert User.query.count() == 4
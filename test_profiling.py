@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for the request sampling profiler
+"""
+
+import json
+import os
+import threading
+import time
+
+from flask import Flask, jsonify
+from flask_login import LoginManager
+
+from app import create_app
+from extensions import db
+from models import Company, User, UserRole
+from profiling import (
+    PROFILE_HEADER, StackSampler, aggregate_by_endpoint, collapsed_stacks, init_profiling, load_summaries,
+    profile_token, speedscope_document, valid_profile_token, write_profile,
+)
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+def sample_busy_thread(seconds=0.1):
+    worker = threading.Thread(target=busy_loop, args=(seconds,))
+    worker.start()
+    sampler = StackSampler(worker.ident, interval=0.002).start()
+    worker.join()
+    sampler.stop()
+    return sampler
+
+
+def test_sampler_records_the_target_thread():
+    sampler = sample_busy_thread()
+    assert sampler.sample_count > 5
+    assert any(frame[0] == 'busy_loop' for stack in sampler.stacks for frame in stack)
+
+    document = speedscope_document(sampler, 'GET /busy')
+    profile = document['profiles'][0]
+    assert len(profile['samples']) == len(profile['weights']) == len(sampler.stacks)
+    names = [frame['name'] for frame in document['shared']['frames']]
+    assert 'busy_loop' in names
+    assert all(index < len(names) for stack in profile['samples'] for index in stack)
+
+    lines = collapsed_stacks(sampler).splitlines()
+    assert sum(int(line.rsplit(' ', 1)[1]) for line in lines) == sampler.sample_count
+    assert any('busy_loop (test_profiling.py' in line for line in lines)
+
+
+def test_summaries_aggregate_per_endpoint(tmp_path):
+    sampler = sample_busy_thread(0.05)
+    for company_id, duration in ((1, 10.0), (1, 30.0), (2, 99.0)):
+        write_profile(str(tmp_path), sampler, {
+            'endpoint': 'expenses.dashboard', 'method': 'GET', 'path': '/dashboard',
+            'duration_ms': duration, 'company_id': company_id,
+        })
+    assert len(os.listdir(tmp_path)) == 9
+
+    rows = aggregate_by_endpoint(load_summaries(str(tmp_path), company_id=1))
+    assert len(rows) == 1
+    assert rows[0]['profiles'] == 2 and rows[0]['max_ms'] == 30.0 and rows[0]['avg_ms'] == 20.0
+    assert rows[0]['frames'][0][0].startswith('busy_loop')
+
+    write_profile(str(tmp_path), sampler, {
+        'endpoint': 'api.countries', 'method': 'GET', 'path': '/api/countries', 'duration_ms': 1.0,
+    }, max_files=2)
+    assert len(load_summaries(str(tmp_path))) == 2
+
+
+def test_token_header_profiles_a_request(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', PROFILE_SAMPLE_RATE=0, PROFILE_INTERVAL_MS=1,
+                      PROFILE_DIR=str(tmp_path), PROFILE_MAX_FILES=10, PROFILE_TOKEN_MAX_AGE=60)
+    LoginManager(app).user_loader(lambda user_id: None)
+    init_profiling(app)
+
+    @app.route('/busy')
+    def busy():
+        busy_loop(0.05)
+        return jsonify({'ok': True})
+
+    client = app.test_client()
+    assert client.get('/busy').status_code == 200
+    assert load_summaries(str(tmp_path)) == []
+
+    token = profile_token(app, 1)
+    assert valid_profile_token(app, token) and not valid_profile_token(app, token + 'x')
+    assert client.get('/busy', headers={PROFILE_HEADER: token + 'x'}).status_code == 200
+    assert load_summaries(str(tmp_path)) == []
+
+    assert client.get('/busy', headers={PROFILE_HEADER: token}).status_code == 200
+    [summary] = load_summaries(str(tmp_path))
+    assert summary['endpoint'] == 'busy' and summary['status'] == 200 and summary['reason'] == 'requested'
+    assert summary['samples'] > 0 and summary['duration_ms'] >= 50
+    with open(tmp_path / f"{summary['name']}.speedscope.json") as f:
+        assert json.load(f)['profiles'][0]['type'] == 'sampled'
+
+
+def test_profiles_are_for_listed_operators_only(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'profiles.db'}",
+        'ASSETS_ENABLED': False,
+        'PROFILE_DIR': str(tmp_path / 'profiles'),
+        'PROFILE_ADMIN_EMAILS': ['ops@example.com'],
+    })
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Acme', country='India', currency='INR')
+        db.session.add(company)
+        db.session.flush()
+        ids = {}
+        for email in ('admin@example.com', 'ops@example.com'):
+            user = User(email=email, password_hash='x', first_name='A', last_name='B', role=UserRole.ADMIN,
+                        company_id=company.id)
+            db.session.add(user)
+            db.session.flush()
+            ids[email] = user.id
+        db.session.commit()
+
+    try:
+        for email, allowed in (('admin@example.com', False), ('ops@example.com', True)):
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(ids[email])
+            page = client.get('/admin/profiles')
+            assert page.status_code == (200 if allowed else 302)
+            assert (b'/admin/profiles' in client.get('/profile').data) == allowed
+            assert client.get('/admin/profiles/x.folded').status_code == (404 if allowed else 403)
+    finally:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for token-bucket rate limits
+"""
+
+import pytest
+from flask import Flask, jsonify
+from flask_login import LoginManager
+
+from app import create_app
+from cache_backends import RedisCache
+from extensions import db
+from ratelimit import Limit, LocalBuckets, RateLimiter, RedisBuckets, parse_limits, rate_limited
+
+
+def test_parse_limits():
+    user, company = parse_limits('user:10/minute, company:500/hour')
+    assert (user.scope, user.capacity, user.period) == ('user', 10, 60)
+    assert (company.scope, company.rate) == ('company', 500 / 3600)
+    assert parse_limits('') == []
+    with pytest.raises(ValueError):
+        parse_limits('tenant:5/minute')
+    with pytest.raises(ValueError):
+        parse_limits('ip:five/minute')
+
+
+def test_bucket_allows_bursts_then_refills():
+    buckets = LocalBuckets()
+    entries = [('k', Limit('ip', 3, 30))]
+    assert [buckets.take(entries, now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take(entries, now=0) == pytest.approx(10)
+    # One token refills every 10 seconds
+    assert buckets.take(entries, now=10) == 0
+    assert buckets.take(entries, now=10) > 0
+
+
+def test_denied_request_takes_no_tokens():
+    buckets = LocalBuckets()
+    small, large = ('user', Limit('user', 1, 60)), ('company', Limit('company', 5, 60))
+    assert buckets.take([small, large], now=0) == 0
+    assert buckets.take([small, large], now=0) > 0
+    # The company bucket only lost the one token actually used
+    assert [buckets.take([large], now=0) for _ in range(5)] == [0, 0, 0, 0, pytest.approx(12)]
+
+
+def test_unreachable_redis_lets_requests_through():
+    buckets = RedisBuckets(RedisCache(port=1, timeout=0.2))
+    assert buckets.take([('k', Limit('ip', 1, 60))]) == 0
+    assert buckets.take([('k', Limit('ip', 1, 60))]) == 0
+
+
+def test_view_returns_429_with_retry_after():
+    app = Flask(__name__)
+    LoginManager(app).user_loader(lambda user_id: None)
+    app.extensions['rate_limiter'] = RateLimiter({'ping': parse_limits('ip:2/minute')}, LocalBuckets())
+
+    @app.route('/ping', methods=['GET', 'POST'])
+    @rate_limited('ping', methods=('POST',))
+    def ping():
+        return jsonify({'ok': True})
+
+    client = app.test_client()
+    assert [client.post('/ping').status_code for _ in range(2)] == [200, 200]
+    response = client.post('/ping')
+    assert response.status_code == 429 and response.headers['Retry-After'] == '30'
+    assert client.get('/ping').status_code == 200
+    other = app.test_client()
+    assert other.post('/ping', environ_base={'REMOTE_ADDR': '10.0.0.9'}).status_code == 200
+
+
+def test_form_gets_page_with_message_and_proxy_address_is_used(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'limits.db'}",
+        'RATE_LIMITS': {'login': 'ip:1/minute'},
+        'TRUSTED_PROXY_HOPS': 1,
+        'ASSETS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    proxied = {'X-Forwarded-For': '203.0.113.7'}
+    form = {'email': 'nobody@example.com', 'password': 'x'}
+    assert client.post('/login', data=form, headers=proxied).status_code == 200
+    response = client.post('/login', data=form, headers=proxied)
+    assert response.status_code == 429 and response.headers['Retry-After'] == '60'
+    assert 'Too many attempts' in response.get_data(as_text=True)
+    assert client.post('/login', json=form, headers=proxied).get_json()['error'].startswith('Too many')
+    # Another client behind the same proxy has its own bucket
+    assert client.post('/login', data=form, headers={'X-Forwarded-For': '203.0.113.8'}).status_code == 200
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests for receipt thumbnail and display-image rendering, and unused receipt cleanup
+"""
+
+import os
+import threading
+import time
+from datetime import date
+
+from PIL import Image
+
+import receipts
+from app import create_app
+from extensions import db
+from models import Company, Expense, ExpenseCategory, ExpenseStatus, User, UserRole
+from receipts import (
+    DerivativeWorkers, derivative_path, has_derivatives, purge_orphaned_receipts, render_derivatives,
+)
+
+
+def make_receipt(folder, name, size=(3000, 2000)):
+    path = os.path.join(folder, name)
+    Image.new('RGB', size, (200, 180, 160)).save(path, 'JPEG')
+    return path
+
+
+def test_only_images_get_derivatives():
+    assert has_derivatives('abc_receipt.JPG')
+    assert has_derivatives('abc_scan.tiff')
+    assert not has_derivatives('abc_invoice.pdf')
+    assert not has_derivatives('no_extension')
+
+
+def test_render_writes_webp_at_each_size(tmp_path):
+    folder = str(tmp_path)
+    source = make_receipt(folder, 'a_receipt.jpg')
+    assert sorted(render_derivatives(source, folder, 'a_receipt.jpg')) == ['display', 'thumb']
+
+    for kind, edge in (('thumb', 320), ('display', 1600)):
+        with Image.open(derivative_path(folder, 'a_receipt.jpg', kind)) as image:
+            assert image.format == 'WEBP'
+            assert max(image.size) == edge
+    # Nothing left to do the second time
+    assert render_derivatives(source, folder, 'a_receipt.jpg') == []
+
+
+def test_small_images_are_not_enlarged(tmp_path):
+    folder = str(tmp_path)
+    source = make_receipt(folder, 'b_receipt.jpg', size=(200, 100))
+    render_derivatives(source, folder, 'b_receipt.jpg')
+    with Image.open(derivative_path(folder, 'b_receipt.jpg', 'display')) as image:
+        assert image.size == (200, 100)
+
+
+def test_ensure_renders_missing_derivative(tmp_path):
+    folder = str(tmp_path)
+    make_receipt(folder, 'c_receipt.jpg')
+    workers = DerivativeWorkers(folder, max_workers=1)
+    path = workers.ensure('c_receipt.jpg', 'thumb')
+    assert path == derivative_path(folder, 'c_receipt.jpg', 'thumb') and os.path.exists(path)
+    assert workers.ensure('missing_receipt.jpg', 'thumb') is None
+
+
+def test_ensure_gives_up_on_a_slow_render(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_receipt(folder, 'd_receipt.jpg')
+    release = threading.Event()
+    monkeypatch.setattr(receipts, 'render_derivatives', lambda *args, **kwargs: release.wait(5) and [])
+    workers = DerivativeWorkers(folder, max_workers=1)
+    try:
+        assert workers.ensure('d_receipt.jpg', 'thumb', timeout=0.05) is None
+    finally:
+        release.set()
+
+
+def test_purge_deletes_only_old_unused_receipts(tmp_path):
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'receipts.db'}", 'ASSETS_ENABLED': False,
+                      'UPLOAD_FOLDER': str(folder)})
+    used, abandoned, fresh = (f'{token * 32}_receipt.jpg' for token in 'abc')
+    for name in (used, abandoned, fresh):
+        make_receipt(str(folder), name, size=(40, 40))
+        render_derivatives(str(folder / name), str(folder), name)
+        if name != fresh:
+            day_ago = time.time() - 25 * 3600
+            os.utime(folder / name, (day_ago, day_ago))
+    (folder / 'notes.txt').write_text('not a receipt')
+    os.utime(folder / 'notes.txt', (0, 0))
+
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Acme', country='India', currency='INR')
+        db.session.add(company)
+        db.session.flush()
+        user = User(email='e@example.com', password_hash='x', first_name='E', last_name='Doe',
+                    role=UserRole.EMPLOYEE, company_id=company.id)
+        category = ExpenseCategory(name='Travel', company_id=company.id)
+        db.session.add_all([user, category])
+        db.session.flush()
+        db.session.add(Expense(title='Taxi', amount=10, currency='INR', amount_in_company_currency=10,
+                               expense_date=date(2025, 1, 1), status=ExpenseStatus.DRAFT, receipt_filename=used,
+                               employee_id=user.id, company_id=company.id, category_id=category.id))
+        db.session.commit()
+        try:
+            assert purge_orphaned_receipts(str(folder), 24 * 3600) == 1
+        finally:
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+
+    assert sorted(os.listdir(folder)) == sorted([used, fresh, 'derived', 'notes.txt'])
+    assert not any(name.startswith(abandoned) for name in os.listdir(folder / 'derived'))
+    assert os.path.exists(derivative_path(str(folder), used, 'thumb'))
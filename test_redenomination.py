@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for chunked expense re-denomination
+"""
+
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+import redenomination
+from app import create_app
+from archive import archive_batch, restore_expense
+from extensions import db
+from models import (
+    ArchivedExpense, Company, CurrencyConversionJob, Expense, ExpenseCategory, ExpenseStatus, User, UserRole,
+)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setattr(redenomination, 'get_rate_for_date', lambda from_currency, to_currency, on_date: 2.0)
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'jobs.db'}",
+        'REDENOMINATION_CHUNK_SIZE': 2,
+        'REDENOMINATION_CHUNK_PAUSE': 0,
+        'REDENOMINATION_LEASE_SECONDS': 60,
+        'ASSETS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def scheduled_job(expenses=5):
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    user = User(email='owner@example.com', password_hash='x', first_name='Owner', last_name='User',
+                role=UserRole.ADMIN, company_id=company.id)
+    category = ExpenseCategory(name='Travel', company_id=company.id)
+    db.session.add_all([user, category])
+    db.session.flush()
+    for i in range(expenses):
+        db.session.add(Expense(title=f'Trip {i}', amount=10, currency='USD', amount_in_company_currency=10,
+                               expense_date=date(2025, 1, 1), status=ExpenseStatus.DRAFT,
+                               employee_id=user.id, company_id=company.id, category_id=category.id))
+    company.currency = 'EUR'
+    job = redenomination.schedule_redenomination(company, 'INR')
+    db.session.commit()
+    return job.id
+
+
+def test_convert_chunk_looks_up_each_currency_date_once(monkeypatch):
+    calls = []
+
+    def fake_rate(from_currency, to_currency, on_date):
+        calls.append((from_currency, to_currency, on_date))
+        return {'USD': 0.9, 'GBP': 1.15}[from_currency]
+
+    monkeypatch.setattr(redenomination, 'get_rate_for_date', fake_rate)
+    rows = [
+        (1, Decimal('10.00'), 'USD', date(2024, 1, 5)),
+        (2, Decimal('20.00'), 'USD', date(2024, 1, 5)),
+        (3, Decimal('5.55'), 'GBP', date(2024, 1, 5)),
+    ]
+    rates = {}
+    updates = redenomination.convert_chunk(rows, 'EUR', rates)
+
+    assert calls == [('USD', 'EUR', date(2024, 1, 5)), ('GBP', 'EUR', date(2024, 1, 5))]
+    assert [u['id'] for u in updates] == [1, 2, 3]
+    assert updates[1]['amount_in_company_currency'] == Decimal('18.00')
+    assert updates[2]['amount_in_company_currency'] == Decimal('6.38')
+
+    # The rate cache carries over to the next chunk
+    redenomination.convert_chunk([(4, Decimal('1.00'), 'USD', date(2024, 1, 5))], 'EUR', rates)
+    assert len(calls) == 2
+
+
+def test_lease_is_held_per_run(app):
+    job_id = scheduled_job()
+    assert redenomination._claim(job_id, 60, 'run-a')
+    # A second run in the same process must not share the lease
+    assert not redenomination._claim(job_id, 60, 'run-b')
+
+    db.session.get(CurrencyConversionJob, job_id).heartbeat_at = datetime.utcnow() - timedelta(seconds=61)
+    db.session.commit()
+    assert redenomination._claim(job_id, 60, 'run-b')
+    assert db.session.get(CurrencyConversionJob, job_id).worker_id == 'run-b'
+
+
+def test_resume_skips_just_scheduled_jobs(app, monkeypatch):
+    launched = []
+    monkeypatch.setattr(redenomination, 'launch_job', lambda job_id, app=None: launched.append(job_id))
+    job_id = scheduled_job()
+    assert redenomination.resume_stale_jobs() == []
+
+    db.session.get(CurrencyConversionJob, job_id).heartbeat_at = datetime.utcnow() - timedelta(seconds=61)
+    db.session.commit()
+    assert redenomination.resume_stale_jobs() == [job_id] == launched
+
+
+def test_concurrent_runs_convert_each_expense_once(app):
+    job_id = scheduled_job(expenses=5)
+    threads = [threading.Thread(target=redenomination.run_job, args=(app, job_id)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.session.expire_all()
+    job = db.session.get(CurrencyConversionJob, job_id)
+    assert (job.status, job.processed_count, job.worker_id) == ('completed', 5, None)
+    assert {e.amount_in_company_currency for e in Expense.query} == {Decimal('20.00')}
+
+
+def test_archived_expenses_are_converted_too(app):
+    job_id = scheduled_job(expenses=3)
+    # Archive the first two as they were before the currency change
+    old = datetime.utcnow() - timedelta(days=400)
+    Expense.query.update({'status': ExpenseStatus.APPROVED, 'updated_at': old}, synchronize_session=False)
+    db.session.commit()
+    assert archive_batch(datetime.utcnow() - timedelta(days=365)) == 2
+
+    redenomination.run_job(app, job_id)
+    db.session.expire_all()
+    job = db.session.get(CurrencyConversionJob, job_id)
+    assert (job.status, job.processed_count, job.total_count) == ('completed', 3, 3)
+    assert {e.amount_in_company_currency for e in ArchivedExpense.query} == {Decimal('20.00')}
+    assert {e.amount_in_company_currency for e in Expense.query} == {Decimal('20.00')}
+
+    restored = restore_expense(ArchivedExpense.query.first().id)
+    assert restored.amount_in_company_currency == Decimal('20.00')
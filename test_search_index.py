@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests for the full-text expense index
+"""
+
+import sqlite3
+from datetime import date
+
+import pytest
+
+import search_index
+from app import create_app
+from extensions import db
+from models import Company, Expense, ExpenseCategory, ExpenseStatus, User, UserRole
+from search_index import (
+    SQLITE_DDL, InvalidCursor, decode_cursor, encode_cursor, match_expression, search_expenses, search_terms,
+)
+
+
+def make_db():
+    conn = sqlite3.connect(':memory:')
+    conn.executescript('''
+        CREATE TABLE "user" (id INTEGER PRIMARY KEY, first_name TEXT, last_name TEXT);
+        CREATE TABLE expense_category (id INTEGER PRIMARY KEY, name TEXT);
+        CREATE TABLE expense (id INTEGER PRIMARY KEY, title TEXT, description TEXT, merchant TEXT,
+                              ocr_text TEXT, employee_id INTEGER, category_id INTEGER);
+    ''')
+    for statement in SQLITE_DDL:
+        conn.execute(statement)
+    conn.execute('INSERT INTO "user" VALUES (1, \'Erika\', \'Mustermann\')')
+    conn.execute("INSERT INTO expense_category VALUES (1, 'Travel')")
+    return conn
+
+
+def search(conn, query):
+    match = match_expression(search_terms(query), 'sqlite')
+    return [row[0] for row in conn.execute('SELECT rowid FROM expense_fts WHERE expense_fts MATCH ? ORDER BY rank', (match,))]
+
+
+def test_triggers_keep_index_current():
+    conn = make_db()
+    conn.execute("INSERT INTO expense VALUES (1, 'Hotel Adlon', 'Conference', 'Adlon', 'BERLIN TOTAL 120', 1, 1)")
+    conn.execute("INSERT INTO expense VALUES (2, 'Taxi', 'Airport', NULL, NULL, 1, 1)")
+
+    assert search(conn, 'berl hotel') == [1]
+    assert sorted(search(conn, 'mustermann travel')) == [1, 2]
+
+    conn.execute("UPDATE expense SET title = 'Train to Munich' WHERE id = 2")
+    assert search(conn, 'munich') == [2] and search(conn, 'taxi') == []
+
+    conn.execute("UPDATE \"user\" SET last_name = 'Schmidt' WHERE id = 1")
+    conn.execute("UPDATE expense_category SET name = 'Lodging' WHERE id = 1")
+    assert sorted(search(conn, 'schmidt lodging')) == [1, 2]
+
+    conn.execute('DELETE FROM expense WHERE id = 1')
+    assert search(conn, 'hotel') == []
+
+
+def test_query_terms_are_sanitised():
+    assert search_terms('Hotel "Berlin" OR NEAR(x*') == ['hotel', 'berlin', 'or', 'near', 'x']
+    assert match_expression(['hotel', 'berlin'], 'sqlite') == '"hotel"* "berlin"*'
+    assert match_expression(['hotel', 'berlin'], 'postgresql') == 'hotel:* & berlin:*'
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(-3.25e-06, 42)) == (-3.25e-06, 42)
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not-a-cursor')
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'search.db'}", 'ASSETS_ENABLED': False})
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Acme', country='Germany', currency='EUR')
+        db.session.add(company)
+        db.session.flush()
+        user = User(email='erika@example.com', password_hash='x', first_name='Erika', last_name='Mustermann',
+                    role=UserRole.EMPLOYEE, company_id=company.id)
+        category = ExpenseCategory(name='Travel', company_id=company.id)
+        db.session.add_all([user, category])
+        db.session.flush()
+        for title, merchant in (('Hotel Adlon', 'Adlon_Kempinski'), ('Taxi', None), ('Hotel Berlin', None)):
+            db.session.add(Expense(title=title, merchant=merchant, amount=10, currency='EUR',
+                                   amount_in_company_currency=10, expense_date=date(2025, 1, 1),
+                                   status=ExpenseStatus.DRAFT, employee_id=user.id, company_id=company.id,
+                                   category_id=category.id))
+        db.session.commit()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.mark.parametrize('full_text', [True, False])
+def test_search_expenses_pages_through_matches(app, monkeypatch, full_text):
+    if not full_text:
+        monkeypatch.setattr(search_index, 'FULL_TEXT_DIALECTS', ())
+    visible = Expense.company_id.isnot(None)
+
+    first, cursor = search_expenses('hotel', visible, limit=1)
+    second, last = search_expenses('hotel', visible, cursor=cursor, limit=1)
+    assert sorted(e.title for e in first + second) == ['Hotel Adlon', 'Hotel Berlin']
+    assert last is None
+    assert [e.title for e in search_expenses('mustermann taxi', visible)[0]] == ['Taxi']
+    assert len(search_expenses('travel', visible)[0]) == 3
+
+
+def test_substring_fallback_treats_wildcards_literally(app, monkeypatch):
+    monkeypatch.setattr(search_index, 'FULL_TEXT_DIALECTS', ())
+    visible = Expense.company_id.isnot(None)
+    assert [e.title for e in search_expenses('adlon_kemp', visible)[0]] == ['Hotel Adlon']
+    assert search_expenses('hotel_berlin', visible)[0] == []
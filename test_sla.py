@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Tests for approval SLA due times, the escalation heap and escalating
+"""
+
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from app import create_app
+from expense_log import read_events
+from extensions import db
+from models import (
+    Approval, ApprovalStep, Company, Expense, ExpenseCategory, ExpenseStatus, NotificationOutbox, User, UserRole,
+)
+from sla import SlaScheduler, due_time, escalate
+
+
+def test_due_time_uses_company_override():
+    app = Flask(__name__)
+    app.config['APPROVAL_SLA_HOURS'] = 48
+    start = datetime(2025, 3, 1, 9, 0)
+    with app.app_context():
+        assert due_time(SimpleNamespace(approval_sla_hours=None), start) == start + timedelta(hours=48)
+        assert due_time(SimpleNamespace(approval_sla_hours=4), start) == start + timedelta(hours=4)
+        assert due_time(SimpleNamespace(approval_sla_hours=0), start) is None
+
+
+def test_heap_pops_due_entries_in_order():
+    scheduler = SlaScheduler(app=None)
+    now = datetime(2025, 3, 1, 12, 0)
+    scheduler.schedule(1, now - timedelta(minutes=5))
+    scheduler.schedule(2, now - timedelta(minutes=30))
+    scheduler.schedule(3, now + timedelta(minutes=5))
+    assert scheduler.pop_due(now) == [(2, now - timedelta(minutes=30)), (1, now - timedelta(minutes=5))]
+    assert scheduler.pop_due(now) == []
+    assert scheduler.pop_due(now + timedelta(minutes=5)) == [(3, now + timedelta(minutes=5))]
+
+
+def test_rescheduling_supersedes_the_old_entry():
+    scheduler = SlaScheduler(app=None)
+    now = datetime(2025, 3, 1, 12, 0)
+    scheduler.schedule(1, now - timedelta(minutes=1))
+    scheduler.schedule(1, now + timedelta(hours=1))
+    scheduler.schedule(1, now + timedelta(hours=1))
+    assert scheduler.pop_due(now) == []
+    assert scheduler.pop_due(now + timedelta(hours=1)) == [(1, now + timedelta(hours=1))]
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'sla.db'}",
+        'ASSETS_ENABLED': False,
+        'APPROVAL_SLA_HOURS': 4,
+        'EXPENSE_EVENTS_SETTLE_SECONDS': 0,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def overdue_expense(chain, later_approver=None):
+    """
+    An expense whose step 1 approval by chain[-1] is overdue. `chain` names
+    the reporting line top down; `later_approver` also approves step 2.
+    """
+    company = Company(name='Acme', country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    users = {}
+    manager_id = None
+    for name in chain + ['employee']:
+        user = User(email=f'{name}@example.com', password_hash='x', first_name=name.title(), last_name='Doe',
+                    role=UserRole.MANAGER, company_id=company.id, manager_id=manager_id)
+        db.session.add(user)
+        db.session.flush()
+        users[name] = user
+        manager_id = user.id if name != chain[-1] else manager_id
+    category = ExpenseCategory(name='Travel', company_id=company.id)
+    db.session.add(category)
+    db.session.flush()
+    expense = Expense(title='Taxi', amount=10, currency='INR', amount_in_company_currency=10,
+                      expense_date=date(2025, 1, 1), status=ExpenseStatus.PENDING_APPROVAL,
+                      employee_id=users['employee'].id, company_id=company.id, category_id=category.id)
+    db.session.add(expense)
+    db.session.flush()
+    due_at = datetime.utcnow() - timedelta(minutes=1)
+    approval = Approval(expense_id=expense.id, approver_id=users[chain[-1]].id, sequence=1, due_at=due_at)
+    db.session.add_all([
+        approval,
+        ApprovalStep(expense_id=expense.id, sequence=1, status='active', total=1, required=1,
+                     specific_approver_id=users[chain[-1]].id),
+    ])
+    if later_approver:
+        db.session.add_all([
+            Approval(expense_id=expense.id, approver_id=users[later_approver].id, sequence=2),
+            ApprovalStep(expense_id=expense.id, sequence=2, status='waiting', total=1, required=1),
+        ])
+    db.session.commit()
+    return users, approval.id, due_at
+
+
+def test_escalate_hands_the_approval_to_the_manager(app):
+    users, approval_id, due_at = overdue_expense(['boss', 'approver'])
+    assert escalate(approval_id, due_at)
+
+    approval = db.session.get(Approval, approval_id)
+    assert (approval.approver_id, approval.escalated_from_id) == (users['boss'].id, users['approver'].id)
+    assert approval.due_at > datetime.utcnow() + timedelta(hours=3)
+    assert ApprovalStep.query.filter_by(sequence=1).one().specific_approver_id == users['boss'].id
+    [logged] = read_events(kinds=['approval.escalated'])
+    assert logged.data == {'from_approver_id': users['approver'].id, 'to_approver_id': users['boss'].id}
+    assert [(row.recipient_id, row.kind) for row in NotificationOutbox.query] == [
+        (users['boss'].id, 'approval.activated')]
+
+    # The queued entry is stale now, so a second scheduler can't escalate it again
+    assert not escalate(approval_id, due_at)
+    assert db.session.get(Approval, approval_id).approver_id == users['boss'].id
+
+
+def test_escalation_skips_approvers_of_later_steps(app):
+    users, approval_id, due_at = overdue_expense(['ceo', 'boss', 'approver'], later_approver='boss')
+    assert escalate(approval_id, due_at)
+    assert db.session.get(Approval, approval_id).approver_id == users['ceo'].id
+
+
+def test_no_manager_left_stops_the_clock(app):
+    users, approval_id, due_at = overdue_expense(['boss', 'approver'], later_approver='boss')
+    assert not escalate(approval_id, due_at)
+    approval = db.session.get(Approval, approval_id)
+    assert (approval.approver_id, approval.due_at) == (users['approver'].id, None)
+    assert NotificationOutbox.query.count() == 0
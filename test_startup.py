@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Tests for the app factory and the cold-start budget
+"""
+
+from flask import url_for
+
+from app import create_app
+from loadtest.startup_bench import DEFAULT_BUDGET_MS, probe_once
+
+
+def test_create_app_builds_independent_apps(tmp_path):
+    config = {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'a.db'}", 'ASSETS_ENABLED': False}
+    first = create_app(config)
+    second = create_app(dict(config, SECRET_KEY='other'))
+
+    assert first is not second and second.config['SECRET_KEY'] == 'other'
+    assert set(first.blueprints) == {'auth', 'expenses', 'approvals', 'admin', 'api', 'ocr', 'receipts'}
+    with first.test_request_context():
+        assert url_for('expenses.new_expense') == '/expenses/new'
+        assert url_for('api.api_expense_details', expense_id=3) == '/api/expenses/3'
+
+
+def test_cold_start_within_budget_without_ocr_or_http_stack():
+    result = probe_once()
+    assert result['status'] == 200
+    assert result['deferred_loaded'] == []
+    assert result['total_ms'] < DEFAULT_BUDGET_MS
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Tests for routing companies to dedicated databases and moving them between databases
+"""
+
+from datetime import date
+
+import pytest
+from sqlalchemy import select
+
+from app import create_app
+from expense_log import EventConsumer, record_transition
+from extensions import db
+from models import (
+    Company, EventConsumerOffset, Expense, ExpenseCategory, ExpenseEvent, ExpenseStatus, NotificationOutbox, User,
+    UserRole,
+)
+from notifications import enqueue_notification
+from tenancy import (
+    TenantMoveError, TenantMovingError, create_tenant_schema, move_company, sync_company, tenant_scope,
+)
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'shared.db'}",
+        'TENANT_DATABASE_URLS': {'big': f"sqlite:///{tmp_path / 'big.db'}"},
+        'TENANT_MAP_TTL': 0,
+        'EXPENSE_EVENTS_SETTLE_SECONDS': 0,
+        'ASSETS_ENABLED': False,
+    })
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def add_company(name, expenses=2):
+    company = Company(name=name, country='India', currency='INR')
+    db.session.add(company)
+    db.session.flush()
+    user = User(email=f'{name}@example.com', password_hash='x', first_name=name, last_name='Owner',
+                role=UserRole.ADMIN, company_id=company.id)
+    category = ExpenseCategory(name='Travel', company_id=company.id)
+    db.session.add_all([user, category])
+    db.session.flush()
+    for i in range(expenses):
+        db.session.add(Expense(title=f'{name} {i}', amount=10, currency='INR', amount_in_company_currency=10,
+                               expense_date=date(2025, 1, 1), status=ExpenseStatus.DRAFT,
+                               employee_id=user.id, company_id=company.id, category_id=category.id))
+    db.session.commit()
+    return company.id
+
+
+def titles(engine):
+    with engine.connect() as connection:
+        return sorted(connection.execute(select(Expense.__table__.c.title)).scalars())
+
+
+def test_move_routes_company_tables_to_its_database(app):
+    moved, staying = add_company('acme'), add_company('globex')
+    move_company(moved, 'big', settle=0, log=lambda message: None)
+
+    assert titles(db.engines['tenant_big']) == ['acme 0', 'acme 1']
+    assert titles(db.engines[None]) == ['globex 0', 'globex 1']
+    with tenant_scope(moved):
+        assert [e.title for e in Expense.query.order_by(Expense.id)] == ['acme 0', 'acme 1']
+        # Users stay in the shared database, with a copy alongside the company's data
+        assert Expense.query.first().employee.first_name == 'acme'
+    with tenant_scope(staying):
+        assert Expense.query.count() == 2
+
+    move_company(moved, None, settle=0, log=lambda message: None)
+    assert titles(db.engines[None]) == ['acme 0', 'acme 1', 'globex 0', 'globex 1']
+    assert titles(db.engines['tenant_big']) == []
+
+
+def test_second_pass_copies_only_changes(app):
+    company_id = add_company('acme', expenses=3)
+    source, target = db.engines[None], db.engines['tenant_big']
+    create_tenant_schema(target)
+    with source.connect() as src, target.connect() as dst:
+        assert sync_company(src, dst, company_id)[0] == 4
+
+        first, second, third = Expense.query.order_by(Expense.id).all()
+        first.title = 'renamed'
+        db.session.delete(third)
+        db.session.commit()
+        src.rollback()
+        assert sync_company(src, dst, company_id) == (1, 1)
+    assert titles(target) == ['acme 1', 'renamed']
+
+
+def test_move_refuses_ids_taken_in_target(app):
+    company_id = add_company('acme')
+    target = db.engines['tenant_big']
+    create_tenant_schema(target)
+    with target.begin() as connection:
+        connection.execute(Company.__table__.insert(), {'id': 99, 'name': 'other', 'country': 'India',
+                                                        'currency': 'INR', 'database_locked': False})
+        connection.execute(ExpenseCategory.__table__.insert(), {'id': 1, 'name': 'Other', 'company_id': 99})
+    with pytest.raises(TenantMoveError):
+        move_company(company_id, 'big', settle=0, log=lambda message: None)
+    company = db.session.get(Company, company_id)
+    assert company.database_name is None and not company.database_locked
+
+
+def test_writes_pause_while_company_is_locked(app):
+    company_id = add_company('acme')
+    db.session.get(Company, company_id).database_locked = True
+    db.session.commit()
+    with tenant_scope(company_id):
+        expense = Expense.query.first()
+        expense.title = 'changed'
+        with pytest.raises(TenantMovingError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_events_and_outbox_commit_with_the_company(app):
+    company_id = add_company('acme')
+    owner = User.query.filter_by(company_id=company_id).one().id
+    move_company(company_id, 'big', settle=0, log=lambda message: None)
+
+    with tenant_scope(company_id):
+        expense = Expense.query.order_by(Expense.id).first()
+        expense.status = ExpenseStatus.SUBMITTED
+        record_transition(db.session, expense, 'expense', ExpenseStatus.DRAFT, ExpenseStatus.SUBMITTED)
+        enqueue_notification(db.session, owner, 'submitted', expense_id=expense.id)
+        db.session.commit()
+        assert EventConsumer('export').drain(lambda events: None) == 1
+
+    for table in (ExpenseEvent.__table__, NotificationOutbox.__table__, EventConsumerOffset.__table__):
+        with db.engines['tenant_big'].connect() as connection:
+            assert connection.execute(select(table)).all()
+        with db.engines[None].connect() as connection:
+            assert not connection.execute(select(table)).all()
+
+    # Moving back carries the company's events and notifications, but not the consumer offsets
+    move_company(company_id, None, settle=0, log=lambda message: None)
+    assert [e.kind for e in ExpenseEvent.query] == ['expense']
+    assert NotificationOutbox.query.one().recipient_id == owner
+    assert EventConsumerOffset.query.count() == 0
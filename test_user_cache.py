@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the Flask-Login user snapshot cache
+"""
+
+import time
+
+import pytest
+
+import blueprints.expenses as expenses_blueprint
+from app import create_app
+from extensions import db
+from models import Company, ExpenseCategory, User, UserRole
+from user_cache import CachedUser, CompanySnapshot, UserCache, UserSnapshot
+
+
+def make_snapshot(user_id=1, company_id=10, currency='USD'):
+    return UserSnapshot(
+        id=user_id, email=f'user{user_id}@example.com', first_name='Ada', last_name='Lovelace',
+        role=UserRole.MANAGER, company_id=company_id, manager_id=None, active=True,
+        company=CompanySnapshot(company_id, 'Acme', 'United States', currency),
+    )
+
+
+def test_cache_hit_and_ttl_expiry():
+    cache = UserCache(ttl=0.05)
+    cache.set(make_snapshot())
+    assert cache.get(1).email == 'user1@example.com'
+    time.sleep(0.06)
+    assert cache.get(1) is None
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_invalidation_by_user_and_company():
+    cache = UserCache()
+    cache.set(make_snapshot(1, company_id=10))
+    cache.set(make_snapshot(2, company_id=10))
+    cache.set(make_snapshot(3, company_id=20))
+
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    cache.invalidate_company(10)
+    assert cache.get(2) is None
+    assert cache.get(3) is not None
+
+
+def test_size_bound_evicts_least_recently_used():
+    cache = UserCache(max_size=2)
+    cache.set(make_snapshot(1))
+    cache.set(make_snapshot(2))
+    cache.get(1)
+    cache.set(make_snapshot(3))
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+
+
+def test_cached_user_exposes_snapshot_without_database():
+    user = CachedUser(make_snapshot(currency='EUR'))
+    assert user.get_id() == '1'
+    assert user.is_authenticated and user.is_active
+    assert user.full_name == 'Ada Lovelace'
+    assert user.role == UserRole.MANAGER
+    assert user.company.currency == 'EUR'
+    with pytest.raises(AttributeError):
+        user.first_name = 'Grace'
+
+
+def test_new_expense_converts_to_the_current_company_currency(tmp_path, monkeypatch):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'users.db'}", 'ASSETS_ENABLED': False,
+                      'USER_CACHE_TTL': 300})
+    targets = []
+
+    def rate(from_currency, to_currency, on_date, record=False):
+        targets.append(to_currency)
+        return 2.0
+
+    monkeypatch.setattr(expenses_blueprint, 'get_rate_for_date', rate)
+    with app.app_context():
+        db.create_all(bind_key=None)
+        company = Company(name='Acme', country='India', currency='INR')
+        db.session.add(company)
+        db.session.flush()
+        user = User(email='e@example.com', password_hash='x', first_name='E', last_name='Doe',
+                    role=UserRole.EMPLOYEE, company_id=company.id)
+        category = ExpenseCategory(name='Travel', company_id=company.id)
+        db.session.add_all([user, category])
+        db.session.commit()
+        ids = user.id, company.id, category.id
+
+    try:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(ids[0])
+        assert client.get('/expenses').status_code == 200   # caches the user with INR
+        with app.app_context():
+            # Another worker changed the currency; this worker's snapshot still says INR
+            db.session.get(Company, ids[1]).currency = 'EUR'
+            db.session.commit()
+        response = client.post('/expenses/new', json={
+            'title': 'Taxi', 'amount': '10', 'currency': 'USD', 'expense_date': '2025-01-01',
+            'category_id': ids[2],
+        })
+        assert response.status_code == 200
+        assert targets == ['EUR']
+    finally:
+        with app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
@@ -0,0 +1,154 @@
+"""
+Cached user loading for Flask-Login
+
+Authenticated requests are served from a TTL cache of a small user
+snapshot, so most requests never query the user or company tables.
+Anything not in the snapshot falls back to loading the full User model.
+The cache lives in the CACHE_URL backend, so with a shared backend a
+profile change or company edit in one worker is seen by all of them.
+"""
+
+from collections import namedtuple
+
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+
+from cache_backends import LocalCache, Namespace, cache_backend
+from extensions import db
+from models import User
+
+CompanySnapshot = namedtuple('CompanySnapshot', ['id', 'name', 'country', 'currency'])
+
+SNAPSHOT_FIELDS = (
+    'id', 'email', 'first_name', 'last_name', 'role',
+    'company_id', 'manager_id', 'active', 'company',
+)
+UserSnapshot = namedtuple('UserSnapshot', SNAPSHOT_FIELDS)
+
+
+def make_snapshot(user):
+    company = user.company
+    return UserSnapshot(
+        id=user.id,
+        email=user.email,
+        first_name=user.first_name,
+        last_name=user.last_name,
+        role=user.role,
+        company_id=user.company_id,
+        manager_id=user.manager_id,
+        active=user.is_active,
+        company=CompanySnapshot(company.id, company.name, company.country, company.currency),
+    )
+
+
+class CachedUser(UserMixin):
+    """Read-only current_user backed by a snapshot; other attributes load the User model"""
+
+    def __init__(self, snapshot):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_model', None)
+
+    @property
+    def id(self):
+        return self._snapshot.id
+
+    @property
+    def is_active(self):
+        return bool(self._snapshot.active)
+
+    @property
+    def full_name(self):
+        return f"{self._snapshot.first_name} {self._snapshot.last_name}"
+
+    @property
+    def model(self):
+        """The full User row, loaded on first use"""
+        if self._model is None:
+            object.__setattr__(self, '_model', db.session.get(User, self._snapshot.id))
+        return self._model
+
+    def __getattr__(self, name):
+        if name in SNAPSHOT_FIELDS:
+            return getattr(self._snapshot, name)
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.model, name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"current_user is read-only; load the User model to change '{name}'")
+
+
+class UserCache:
+    """
+    TTL cache of user snapshots. Each entry records its company's version,
+    so invalidate_company() is a single counter bump however many users are
+    cached, and it reaches every worker sharing the backend.
+    """
+
+    def __init__(self, ttl=60, max_size=10000, backend=None):
+        self.ttl = ttl
+        self.backend = backend if backend is not None else LocalCache(max_size=max_size)
+        self.companies = Namespace(self.backend, 'users')
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id):
+        return f'user:{user_id}'
+
+    def get(self, user_id):
+        entry = self.backend.get(self._key(user_id))
+        if entry is not None:
+            version, snapshot = entry
+            if version == self.companies.version(snapshot.company_id):
+                self.hits += 1
+                return snapshot
+        self.misses += 1
+        return None
+
+    def set(self, snapshot):
+        version = self.companies.version(snapshot.company_id)
+        if version is not None:
+            self.backend.set(self._key(snapshot.id), (version, snapshot), ttl=self.ttl)
+
+    def invalidate(self, user_id):
+        self.backend.delete(self._key(user_id))
+
+    def invalidate_company(self, company_id):
+        self.companies.bump(company_id)
+
+    def clear(self):
+        self.backend.clear()
+
+
+def init_user_cache(app):
+    app.extensions['user_cache'] = UserCache(
+        ttl=app.config.get('USER_CACHE_TTL', 60),
+        backend=cache_backend(app, max_size=app.config.get('USER_CACHE_SIZE', 10000)),
+    )
+
+
+def get_user_cache():
+    return current_app.extensions['user_cache']
+
+
+def load_cached_user(user_id):
+    """Flask-Login user loader: snapshot from cache, or one joined query on a miss"""
+    cache = get_user_cache()
+    snapshot = cache.get(user_id)
+    if snapshot is None:
+        user = db.session.get(User, user_id, options=[joinedload(User.company)])
+        if user is None:
+            return None
+        snapshot = make_snapshot(user)
+        cache.set(snapshot)
+    return CachedUser(snapshot)
+
+
+def invalidate_user(user_id):
+    get_user_cache().invalidate(user_id)
+
+
+def invalidate_company_users(company_id):
+    get_user_cache().invalidate_company(company_id)